@@ -0,0 +1,73 @@
+# social_casino_backend/app/auto_cashout.py
+#
+# Автокэшаут в реальном времени. На старте раунда активные ставки с autoCashoutAt
+# складываются в кучу по целевому множителю; момент срабатывания считается
+# обратной кривой CrashGame.get_duration_from_multiplier. Одна задача спит до
+# ближайшего триггера и отдаёт созревшие ставки на расчёт — O(log n) на ставку,
+# и расчёт размазывается по раунду, а не падает целиком на краш.
+
+import time
+import heapq
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from app.bet_table import Bet
+from app.game_logic import CrashGame
+
+logger = logging.getLogger("uvicorn.error")
+
+# триггеры ближе этого окна обрабатываются одной пачкой
+TRIGGER_BATCH_WINDOW = 0.005
+
+
+class AutoCashoutScheduler:
+    """Fires auto-cashouts at the moment the round multiplier reaches each bet's target."""
+
+    def __init__(self, on_due: Callable[[list[Bet]], Awaitable[None]]):
+        self._on_due = on_due
+        self._heap: list[tuple[float, int, Bet]] = []
+        self._start_time = 0.0
+        self._task: asyncio.Task | None = None
+        self.fired = 0
+
+    def start(self, bets: list[Bet], start_time: float, crash_point: float | None) -> None:
+        """Schedules every bet whose target is reachable this round (target <= crash point)."""
+        self.stop()
+        self._start_time = start_time
+        self._heap = [
+            (bet.auto_cashout_at, i, bet)
+            for i, bet in enumerate(bets)
+            if bet.auto_cashout_at and (crash_point is None or bet.auto_cashout_at <= crash_point)
+        ]
+        heapq.heapify(self._heap)
+        if self._heap:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        """Called at round end: whatever did not fire is left to resolve_bets."""
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+        self._heap = []
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def _run(self) -> None:
+        heap = self._heap
+        while heap:
+            due_at = self._start_time + CrashGame.get_duration_from_multiplier(heap[0][0])
+            delay = due_at - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            horizon = time.time() - self._start_time + TRIGGER_BATCH_WINDOW
+            due: list[Bet] = []
+            while heap and CrashGame.get_duration_from_multiplier(heap[0][0]) <= horizon:
+                due.append(heapq.heappop(heap)[2])
+            self.fired += len(due)
+            try:
+                await self._on_due(due)
+            except Exception as e:
+                logger.exception(f"[AUTO_CASHOUT] settlement failed: {e}")
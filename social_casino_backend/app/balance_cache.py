@@ -0,0 +1,175 @@
+# social_casino_backend/app/balance_cache.py
+#
+# Кэш балансов в памяти процесса + отложенная запись в SQLite.
+# Чтения на горячем пути — поиск в dict; изменения копятся как записи журнала
+# (bet/win с round_id) и раз в BALANCE_FLUSH_INTERVAL секунд уходят в БД одной
+# транзакцией. Пишем именно дельты (balance = balance + ?), поэтому несколько
+# воркеров над одной БД не затирают изменения друг друга. Кэш одного воркера
+# не видит трат в другом (тот же юзер подключён к двум воркерам), поэтому при
+# флаше списания ещё раз сверяются с балансом в БД; не прошедшее списание не
+# пишется, и вызвавший add() узнаёт об этом через rejected().
+
+import os
+import asyncio
+import logging
+from typing import Dict, Any
+
+from app.storage import storage
+
+BALANCE_FLUSH_INTERVAL = float(os.getenv("BALANCE_FLUSH_INTERVAL", "0.5"))
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class BalanceCache:
+    """
+    Authoritative in-process balances with write-behind persistence.
+    A cached balance already includes this process' unflushed deltas; on a miss
+    the balance is the DB value plus whatever is still pending here.
+    DB reads and flushes go through the storage thread in FIFO order; a read that
+    overlapped a flush submission is simply repeated, so flushed deltas are never
+    counted twice or lost.
+    Flushes are serialized: flush() returns only once everything added before the
+    call is durable (or raises), even if another flush was already in flight.
+    """
+
+    def __init__(self):
+        self._balances: dict[int, float] = {}
+        self._pending: dict[int, float] = {}
+        self._entries: list[tuple[int, str, float, int | None]] = []
+        # номер каждой записи из _entries (тот, что вернул add())
+        self._seqs: list[int] = []
+        self._seq = 0
+        # номера списаний, которые БД отвергла при флаше; забираются через rejected()
+        self._rejected: set[int] = set()
+        self.rejected_debits = 0
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        # растёт при каждой отправке флаша в поток БД
+        self._flush_generation = 0
+        # один флаш за раз: второй ждёт первый, а не возвращается с пустыми руками
+        self._flush_lock = asyncio.Lock()
+
+    async def get(self, user_id: int) -> float:
+        """
+        Current balance. The value is cached before returning without yielding, so a
+        caller can check it and add() right away without racing other coroutines.
+        """
+        balance = self._balances.get(user_id)
+        if balance is not None:
+            self.hits += 1
+            return balance
+        self.misses += 1
+        while True:
+            generation = self._flush_generation
+            db_balance = await storage.get_balance(user_id)
+            if generation == self._flush_generation:
+                break
+        balance = self._balances.get(user_id)
+        if balance is None:
+            balance = db_balance + self._pending.get(user_id, 0.0)
+            self._balances[user_id] = balance
+        return balance
+
+    def add(self, user_id: int, delta: float, kind: str, round_id: int | None = None) -> int:
+        """
+        Applies a delta in memory and schedules it (and its ledger entry) for persistence.
+        Returns the entry number to check with rejected() once a flush has committed it.
+        """
+        balance = self._balances.get(user_id)
+        if balance is not None:
+            self._balances[user_id] = balance + float(delta)
+        self._pending[user_id] = self._pending.get(user_id, 0.0) + float(delta)
+        self._entries.append((user_id, kind, float(delta), round_id))
+        self._seq += 1
+        self._seqs.append(self._seq)
+        return self._seq
+
+    def cancel(self, seq: int) -> bool:
+        """Drops an entry that has not been sent to the DB yet and undoes it in memory. False if it is already out."""
+        try:
+            i = self._seqs.index(seq)
+        except ValueError:
+            return False
+        user_id, _, delta, _ = self._entries.pop(i)
+        del self._seqs[i]
+        self._pending[user_id] = self._pending.get(user_id, 0.0) - delta
+        balance = self._balances.get(user_id)
+        if balance is not None:
+            self._balances[user_id] = balance - delta
+        return True
+
+    def rejected(self, seq: int) -> bool:
+        """True (once) if the flush refused this debit because the stored balance could not cover it."""
+        if seq in self._rejected:
+            self._rejected.discard(seq)
+            return True
+        return False
+
+    def invalidate(self, user_id: int) -> None:
+        """Forgets the cached value (the DB was changed elsewhere, or the user left). Pending deltas stay."""
+        self._balances.pop(user_id, None)
+
+    async def flush(self) -> int:
+        """
+        Writes all pending ledger entries in one transaction. Returns the number of entries written.
+        Waits for a flush already in flight first: its entries may include the caller's, and if it
+        fails they are put back and written (or the error raised) here.
+        """
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        if not self._entries:
+            return 0
+        entries, self._entries = self._entries, []
+        seqs, self._seqs = self._seqs, []
+        pending, self._pending = self._pending, {}
+        self._flush_generation += 1
+        try:
+            rejected = await storage.apply_ledger_entries(entries)
+        except Exception:
+            # вернём записи обратно, чтобы не потерять их до следующей попытки
+            self._entries[:0] = entries
+            self._seqs[:0] = seqs
+            for user_id, delta in pending.items():
+                self._pending[user_id] = self._pending.get(user_id, 0.0) + delta
+            self.flush_errors += 1
+            raise
+        for i in rejected:
+            # кэш этого юзера разошёлся с БД — следующий get() перечитает баланс
+            self._rejected.add(seqs[i])
+            self._balances.pop(entries[i][0], None)
+        self.rejected_debits += len(rejected)
+        self.flushes += 1
+        self.flushed_rows += len(entries) - len(rejected)
+        return len(entries) - len(rejected)
+
+    async def run_flusher(self, interval: float = BALANCE_FLUSH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"[BALANCE] flush failed, will retry: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached_users": len(self._balances),
+            "pending_users": len(self._pending),
+            "pending_entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else None,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "rejected_debits": self.rejected_debits,
+        }
+
+
+balance_cache = BalanceCache()
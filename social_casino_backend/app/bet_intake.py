@@ -0,0 +1,96 @@
+# social_casino_backend/app/bet_intake.py
+#
+# Групповой коммит ставок. add_bet проверяет и списывает ставку в кэше балансов,
+# затем ждёт submit(): ставки копятся до BET_BATCH_MAX штук или BET_BATCH_WINDOW_MS
+# миллисекунд и коммитятся одной транзакцией. bet_confirm уходит каждому
+# игроку отдельно, но только после того, как его списание реально записано.
+
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, Any
+
+from app.balance_cache import balance_cache
+
+BET_BATCH_MAX = int(os.getenv("BET_BATCH_MAX", "500"))
+BET_BATCH_WINDOW_MS = float(os.getenv("BET_BATCH_WINDOW_MS", "5"))
+
+
+class BetIntake:
+    """
+    Micro-batching commit stage. Callers stage their writes elsewhere (the balance
+    cache), then await submit(); one commit() call makes a whole batch durable.
+    """
+
+    def __init__(self, commit: Callable[[], Awaitable[Any]]):
+        self._commit = commit
+        self._waiting: list[asyncio.Future] = []
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+        self.max_batch = 0
+
+    async def submit(self) -> None:
+        """Waits until everything staged so far is committed; raises if the batch commit failed."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(future)
+        self._idle.clear()
+        self._wakeup.set()
+        if len(self._waiting) >= BET_BATCH_MAX:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await future
+
+    async def drain(self) -> None:
+        """Waits until no bet is waiting for its commit (called before a round starts)."""
+        await self._idle.wait()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=BET_BATCH_WINDOW_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+            batch, self._waiting = self._waiting[:BET_BATCH_MAX], self._waiting[BET_BATCH_MAX:]
+            if len(self._waiting) < BET_BATCH_MAX:
+                self._full.clear()
+            if not self._waiting:
+                self._wakeup.clear()
+
+            try:
+                await self._commit()
+            except Exception as e:
+                self.failed += len(batch)
+                for future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                self.batches += 1
+                self.committed += len(batch)
+                self.max_batch = max(self.max_batch, len(batch))
+                for future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+            if not self._waiting:
+                self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "committed": self.committed,
+            "failed": self.failed,
+            "waiting": len(self._waiting),
+            "avg_batch": (self.committed / self.batches) if self.batches else None,
+            "max_batch": self.max_batch,
+        }
+
+
+bet_intake = BetIntake(commit=balance_cache.flush)
@@ -0,0 +1,124 @@
+# social_casino_backend/app/bet_table.py
+#
+# Ставки текущего раунда. Вместо dict[user_id, [dict, dict]] со строковыми
+# статусами — компактные записи со __slots__, плоский массив слотов
+# (индекс юзера * PANELS + панель) и индексы по статусу, чтобы переходы фаз
+# раунда трогали только нужные ставки.
+
+from enum import IntEnum
+from typing import Iterable
+
+PANELS = 2
+
+
+class BetStatus(IntEnum):
+    PLACED = 0
+    ACTIVE = 1
+    CASHED_OUT = 2
+    RESOLVED = 3
+
+
+class Bet:
+    __slots__ = ("user_id", "panel_id", "amount", "auto_cashout_at", "auto_bet", "status", "win_amount", "cashed_out_at")
+
+    def __init__(self, user_id: str, panel_id: int, amount: float, auto_cashout_at: float | None, auto_bet: bool = False):
+        self.user_id = user_id
+        self.panel_id = panel_id
+        self.amount = amount
+        self.auto_cashout_at = auto_cashout_at
+        self.auto_bet = auto_bet
+        self.status = BetStatus.PLACED
+        self.win_amount = 0.0
+        self.cashed_out_at: float | None = None
+
+
+class BetTable:
+    """Round-scoped bet store keyed by integer user index and panel, indexed by status."""
+
+    def __init__(self):
+        self._index: dict[str, int] = {}
+        self._slots: list[Bet | None] = []
+        self._free: list[int] = []
+        self._by_status: list[set[Bet]] = [set() for _ in BetStatus]
+
+    def _user_index(self, user_id: str) -> int:
+        idx = self._index.get(user_id)
+        if idx is None:
+            if self._free:
+                idx = self._free.pop()
+            else:
+                idx = len(self._slots) // PANELS
+                self._slots.extend([None] * PANELS)
+            self._index[user_id] = idx
+        return idx
+
+    def get(self, user_id: str, panel_id: int) -> Bet | None:
+        idx = self._index.get(user_id)
+        if idx is None:
+            return None
+        return self._slots[idx * PANELS + panel_id]
+
+    def place(self, user_id: str, panel_id: int, amount: float, auto_cashout_at: float | None) -> Bet:
+        bet = Bet(user_id, panel_id, amount, auto_cashout_at)
+        self._insert(bet)
+        return bet
+
+    def _insert(self, bet: Bet) -> None:
+        self._slots[self._user_index(bet.user_id) * PANELS + bet.panel_id] = bet
+        self._by_status[bet.status].add(bet)
+
+    def remove(self, user_id: str, panel_id: int) -> None:
+        idx = self._index.get(user_id)
+        if idx is None:
+            return
+        bet = self._slots[idx * PANELS + panel_id]
+        if bet is not None:
+            self._by_status[bet.status].discard(bet)
+            self._slots[idx * PANELS + panel_id] = None
+        if all(self._slots[idx * PANELS + p] is None for p in range(PANELS)):
+            del self._index[user_id]
+            self._free.append(idx)
+
+    def remove_user(self, user_id: str) -> None:
+        for panel_id in range(PANELS):
+            self.remove(user_id, panel_id)
+
+    def set_status(self, bet: Bet, status: BetStatus) -> None:
+        self._by_status[bet.status].discard(bet)
+        bet.status = status
+        self._by_status[status].add(bet)
+
+    def transition(self, from_status: BetStatus, to_status: BetStatus) -> int:
+        """Moves every bet in from_status to to_status. Returns how many moved."""
+        moved = self._by_status[from_status]
+        for bet in moved:
+            bet.status = to_status
+        self._by_status[to_status] |= moved
+        self._by_status[from_status] = set()
+        return len(moved)
+
+    def with_status(self, status: BetStatus) -> list[Bet]:
+        return list(self._by_status[status])
+
+    def count(self, status: BetStatus) -> int:
+        return len(self._by_status[status])
+
+    def users(self) -> Iterable[str]:
+        """Users that currently have at least one bet."""
+        return list(self._index)
+
+    def start_round(self) -> None:
+        """Drops last round's bets; auto bets stay for activate_auto_bets."""
+        keep = [bet for bet in self._slots if bet is not None and bet.auto_bet]
+        self._index.clear()
+        self._slots.clear()
+        self._free.clear()
+        self._by_status = [set() for _ in BetStatus]
+        for bet in keep:
+            self._insert(bet)
+
+    def auto_bets(self) -> list[Bet]:
+        return [bet for bets in self._by_status for bet in bets if bet.auto_bet]
+
+    def __len__(self) -> int:
+        return sum(len(bets) for bets in self._by_status)
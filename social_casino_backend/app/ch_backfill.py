@@ -0,0 +1,182 @@
+# social_casino_backend/app/ch_backfill.py
+#
+# Онлайн-бэкфилл старых таблиц ClickHouse в новую раскладку (миграции 0007–0010).
+# Новые строки попадают в *_v2 сразу (логгер + MV-мост со старых таблиц), а
+# история до момента создания моста (cutover) копируется здесь по одному дню,
+# с паузой между днями, чтобы не мешать рабочей нагрузке. Прогресс лежит в
+# _backfill_state, так что бэкфилл переживает рестарт и смену лидера.
+# Копирование роллапы не трогает: их MV на spins_v2 берут строки только с
+# момента миграции 0009, а историю до него роллапам один раз пересобираем из
+# spins_v2, когда spins скопирован целиком. Поэтому перелив недокопированного
+# дня (удалить и вставить заново) ничего в роллапах не задваивает.
+# Запускает только лидер шины раунда.
+
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict
+
+from app.http_clients import http_clients
+from app.clickhouse_logger import CLICKHOUSE_ENABLED, CLICKHOUSE_HOST, CLICKHOUSE_DB, _auth_tuple
+from app.migrations_runner import MIGRATIONS_TABLE, migration_cutoff
+
+logger = logging.getLogger("uvicorn.error")
+
+CH_BACKFILL_ENABLED = os.getenv("CH_BACKFILL_ENABLED", "1") == "1"
+CH_BACKFILL_PAUSE = float(os.getenv("CH_BACKFILL_PAUSE", "1.0"))
+
+BACKFILL_STATE_TABLE = "_backfill_state"
+# бизнес-события не подпадают под TTL game_events_v2 (миграция 0008) — копируем их целиком
+BUSINESS_EVENT_TYPES = ("successful_payment",)
+
+BACKFILLS = [
+    {
+        "source": "spins",
+        "target": "spins_v2",
+        "migration": "0007_create_spins_v2.sql",
+        "ts": "timestamp",
+        "columns": "user_id, event_type, amount, multiplier, timestamp",
+        "select": "toUInt64OrZero(user_id), event_type, amount, multiplier, timestamp",
+        "where": "",
+        "rollups": True,
+    },
+    {
+        "source": "game_events",
+        "target": "game_events_v2",
+        "migration": "0008_create_game_events_v2.sql",
+        "ts": "ts",
+        "columns": "ts, event_type, user_id, user_source, payload",
+        "select": "ts, event_type, toUInt64(greatest(ifNull(user_id, 0), 0)), ifNull(user_source, ''), payload",
+        # старше TTL новой таблицы копировать незачем
+        "where": "AND (ts >= now() - INTERVAL 90 DAY OR event_type IN ({}))".format(
+            ", ".join(f"'{t}'" for t in BUSINESS_EVENT_TYPES)),
+    },
+]
+
+# роллапы, которые после копирования spins пересобираются из spins_v2 (см. миграцию 0009)
+ROLLUPS_MIGRATION = "0009_feed_rollups_from_spins_v2.sql"
+ROLLUPS = [
+    {"table": "spins_hourly", "key": "hour", "bucket": "toStartOfHour(timestamp)"},
+    {"table": "spins_daily", "key": "day", "bucket": "toDate(timestamp)"},
+]
+ROLLUP_SUMS = """
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+"""
+
+
+async def _query(sql: str) -> list[dict]:
+    r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, auth=_auth_tuple(), timeout=300.0,
+                                params={"query": sql, "database": CLICKHOUSE_DB, "default_format": "JSON"})
+    r.raise_for_status()
+    return r.json().get("data", []) if r.content.strip() else []
+
+
+class ChBackfill:
+    """Copies history of the legacy tables into their *_v2 replacements one day at a time."""
+
+    def __init__(self):
+        self.progress: dict[str, dict] = {}
+        self.running = False
+        self.error: str | None = None
+
+    async def run(self) -> None:
+        if not (CLICKHOUSE_ENABLED and CH_BACKFILL_ENABLED) or self.running:
+            return
+        self.running = True
+        try:
+            for spec in BACKFILLS:
+                await self._backfill(spec)
+                if spec.get("rollups"):
+                    await self._rebuild_rollups(spec)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = str(e)
+            logger.warning(f"[BACKFILL] stopped: {e}")
+        finally:
+            self.running = False
+
+    async def _cutover(self, spec: dict) -> str | None:
+        rows = await _query(f"SELECT toString(min(cutover)) AS c, count() AS n FROM {BACKFILL_STATE_TABLE} WHERE source = '{spec['source']}'")
+        if rows and int(rows[0]["n"]):
+            return rows[0]["c"]
+        # момент применения миграции с MV-мостом: всё, что новее, уже дошло до *_v2 через него
+        rows = await _query(f"SELECT toString(min(applied_at)) AS c, count() AS n FROM {MIGRATIONS_TABLE} "
+                            f"WHERE version = '{spec['migration']}'")
+        return rows[0]["c"] if rows and int(rows[0]["n"]) else None
+
+    async def _backfill(self, spec: dict) -> None:
+        source, target, ts = spec["source"], spec["target"], spec["ts"]
+        cutover = await self._cutover(spec)
+        if cutover is None:
+            return
+        before = f"{ts} < toDateTime('{cutover}') {spec['where']}"
+        days = await _query(f"SELECT toYYYYMMDD({ts}) AS day, count() AS n FROM {source} WHERE {before} GROUP BY day ORDER BY day")
+        done = {int(r["day"]) for r in await _query(f"SELECT day FROM {BACKFILL_STATE_TABLE} WHERE source = '{source}'")}
+        progress = self.progress[source] = {
+            "target": target, "cutover": cutover,
+            "days_total": len(days), "days_done": len(done), "rows_copied": 0,
+        }
+
+        for item in days:
+            day, expected = int(item["day"]), int(item["n"])
+            if day in done:
+                continue
+            in_day = f"toYYYYMMDD({ts}) = {day} AND {before}"
+            copied = int((await _query(f"SELECT count() AS n FROM {target} WHERE {in_day}"))[0]["n"])
+            if copied and copied != expected:
+                # предыдущая попытка оборвалась посреди дня — переливаем день заново;
+                # MV роллапов эти строки не видят (они старше среза миграции 0009)
+                logger.warning(f"[BACKFILL] {target} day {day} partially copied ({copied}/{expected}), redoing")
+                await _query(f"ALTER TABLE {target} DELETE WHERE {in_day} SETTINGS mutations_sync = 2")
+                copied = 0
+            if not copied:
+                await _query(f"INSERT INTO {target} ({spec['columns']}) SELECT {spec['select']} FROM {source} WHERE {in_day}")
+                progress["rows_copied"] += expected
+            await _query(f"INSERT INTO {BACKFILL_STATE_TABLE} (source, target, cutover, day, rows, done_at) "
+                         f"VALUES ('{source}', '{target}', toDateTime('{cutover}'), {day}, {expected}, now())")
+            progress["days_done"] += 1
+            await asyncio.sleep(CH_BACKFILL_PAUSE)
+
+        logger.info(f"[BACKFILL] {source} -> {target} done: {json.dumps(progress)}")
+
+    async def _rebuild_rollups(self, spec: dict) -> None:
+        """
+        Replaces the rollups' history before the 0009 cutoff (rows of the legacy MVs and backfills)
+        with sums over the now complete spins_v2. Delete-then-insert by `source`, so a rerun after a
+        crash redoes it cleanly; marked done in _backfill_state.
+        """
+        target = spec["target"]
+        cutoff = await migration_cutoff(ROLLUPS_MIGRATION)
+        if cutoff is None:
+            return
+        rows = await _query(f"SELECT count() AS n FROM {BACKFILL_STATE_TABLE} WHERE source = '{target}' AND target = 'rollups'")
+        if int(rows[0]["n"]):
+            return
+        for rollup in ROLLUPS:
+            table, key = rollup["table"], rollup["key"]
+            # всё, кроме живой MV на spins_v2: старые MV со spins, их бэкфиллы и прошлая попытка пересборки
+            await _query(f"ALTER TABLE {table} DELETE WHERE source != 'spins_v2' SETTINGS mutations_sync = 2")
+            await _query(f"INSERT INTO {table} ({key}, source, deposit_sum, bet_success_cnt, bet_fail_cnt, win_sum, loss_sum) "
+                         f"SELECT {rollup['bucket']} AS {key}, 'spins_v2_backfill' AS source,{ROLLUP_SUMS}"
+                         f"FROM {target} WHERE timestamp < toDateTime('{cutoff}') GROUP BY {key}")
+        await _query(f"INSERT INTO {BACKFILL_STATE_TABLE} (source, target, cutover, day, rows, done_at) "
+                     f"VALUES ('{target}', 'rollups', toDateTime('{cutoff}'), 0, 0, now())")
+        self.progress["rollups"] = {"source": target, "cutoff": cutoff, "rebuilt": True}
+        logger.info(f"[BACKFILL] rollups rebuilt from {target} before {cutoff}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": CLICKHOUSE_ENABLED and CH_BACKFILL_ENABLED,
+            "running": self.running,
+            "error": self.error,
+            "tables": self.progress,
+        }
+
+
+ch_backfill = ChBackfill()
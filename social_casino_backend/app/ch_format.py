@@ -0,0 +1,168 @@
+# social_casino_backend/app/ch_format.py
+#
+# Тело INSERT для ClickHouse. По умолчанию — RowBinary: колонки пишутся
+# бинарно по известной схеме таблицы (без имён полей в каждой строке и без
+# двойного JSON для payload), тело сжимается (gzip, либо zstd при установленном
+# zstandard). JSONEachRow остаётся запасным вариантом: CH_INSERT_FORMAT=json,
+# таблица без описанной схемы или колонка, которую RowBinary-кодер не знает.
+
+import os
+import gzip
+import json
+import struct
+import calendar
+import time
+from typing import Any, Callable, Sequence
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from app.ws_codec import orjson
+
+CH_INSERT_FORMAT = os.getenv("CH_INSERT_FORMAT", "rowbinary")           # rowbinary | json
+CH_INSERT_COMPRESSION = os.getenv("CH_INSERT_COMPRESSION", "gzip")      # gzip | zstd | none
+CH_INSERT_COMPRESSION_LEVEL = int(os.getenv("CH_INSERT_COMPRESSION_LEVEL", "3"))
+
+FORMAT_ROWBINARY = "rowbinary"
+FORMAT_JSON = "json"
+
+# в одной пачке почти все строки приходятся на несколько секунд — кешируем разбор
+_last_ts: tuple[str, int] = ("", 0)
+
+
+def _epoch(value: Any) -> int:
+    """DateTime value as unix seconds; strings are the '%Y-%m-%d %H:%M:%S' UTC format the logger writes."""
+    global _last_ts
+    if isinstance(value, (int, float)):
+        return int(value)
+    if value == _last_ts[0]:
+        return _last_ts[1]
+    epoch = calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    _last_ts = (value, epoch)
+    return epoch
+
+
+def _varint(n: int) -> bytes:
+    if n < 0x80:
+        return bytes((n,))
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _enc_string(value: Any) -> bytes:
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+    elif isinstance(value, (dict, list)):
+        data = orjson.dumps(value) if orjson is not None else json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    else:
+        data = str(value).encode("utf-8")
+    return _varint(len(data)) + data
+
+
+# фиксированной ширины: (код struct, приведение значения)
+_FIXED: dict[str, tuple[str, Callable[[Any], Any]]] = {
+    "Float64": ("d", float),
+    "Int64": ("q", int),
+    "UInt64": ("Q", int),
+    "UInt32": ("I", int),
+    "UInt8": ("B", int),
+    "DateTime": ("I", _epoch),
+}
+
+
+def _unwrap(ch_type: str) -> str:
+    # LowCardinality(T) в RowBinary кодируется как T
+    if ch_type.startswith("LowCardinality(") and ch_type.endswith(")"):
+        return ch_type[len("LowCardinality("):-1]
+    return ch_type
+
+
+def _value_encoder(ch_type: str) -> Callable[[Any], bytes] | None:
+    ch_type = _unwrap(ch_type)
+    if ch_type.startswith("Nullable(") and ch_type.endswith(")"):
+        inner = _value_encoder(ch_type[len("Nullable("):-1])
+        if inner is None:
+            return None
+        return lambda v: b"\x01" if v is None else b"\x00" + inner(v)
+    if ch_type == "String":
+        return _enc_string
+    if ch_type in _FIXED:
+        code, conv = _FIXED[ch_type]
+        pack = struct.Struct("<" + code).pack
+        return lambda v: pack(conv(v))
+    return None
+
+
+def row_binary_supported(columns: Sequence[tuple[str, str]]) -> bool:
+    return all(_value_encoder(ch_type) is not None for _, ch_type in columns)
+
+
+def _row_encoder(columns: Sequence[tuple[str, str]]) -> Callable[[dict], list[bytes]]:
+    """
+    Compiles a schema into a per-row encoder. Runs of fixed-width columns are packed
+    with a single struct call; strings and nullables go through their own encoders.
+    """
+    steps: list[Callable[[dict], bytes]] = []
+    run: list[tuple[str, str, Callable[[Any], Any]]] = []
+
+    def close_run():
+        if not run:
+            return
+        pack = struct.Struct("<" + "".join(code for _, code, _ in run)).pack
+        fields = [(name, conv) for name, _, conv in run]
+        steps.append(lambda row: pack(*[conv(row[name]) for name, conv in fields]))
+        run.clear()
+
+    for name, ch_type in columns:
+        base = _unwrap(ch_type)
+        if base in _FIXED:
+            run.append((name, *_FIXED[base]))
+            continue
+        close_run()
+        enc = _value_encoder(ch_type)
+        steps.append(lambda row, name=name, enc=enc: enc(row.get(name)))
+    close_run()
+    return lambda row: [step(row) for step in steps]
+
+
+def encode_row_binary(columns: Sequence[tuple[str, str]], rows: list[dict]) -> bytes:
+    encode_row = _row_encoder(columns)
+    out: list[bytes] = []
+    for row in rows:
+        out.extend(encode_row(row))
+    return b"".join(out)
+
+
+def encode_json_each_row(rows: list[dict]) -> bytes:
+    if orjson is not None:
+        return b"\n".join(orjson.dumps(row) for row in rows) + b"\n"
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def compress(data: bytes, method: str = CH_INSERT_COMPRESSION) -> tuple[bytes, str | None]:
+    """Compresses an insert body. Returns (body, Content-Encoding or None)."""
+    if method == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=CH_INSERT_COMPRESSION_LEVEL).compress(data), "zstd"
+    if method in ("gzip", "zstd"):
+        return gzip.compress(data, compresslevel=min(CH_INSERT_COMPRESSION_LEVEL, 9)), "gzip"
+    return data, None
+
+
+def build_insert(table: str, rows: list[dict], columns: Sequence[tuple[str, str]] | None,
+                 fmt: str = CH_INSERT_FORMAT) -> tuple[str, bytes, dict[str, str]]:
+    """Returns (query, body, headers) for one multi-row INSERT."""
+    if fmt == FORMAT_ROWBINARY and columns and row_binary_supported(columns):
+        query = f"INSERT INTO {table} ({', '.join(name for name, _ in columns)}) FORMAT RowBinary"
+        data = encode_row_binary(columns, rows)
+    else:
+        query = f"INSERT INTO {table} FORMAT JSONEachRow"
+        data = encode_json_each_row(rows)
+    body, encoding = compress(data)
+    headers = {"Content-Encoding": encoding} if encoding else {}
+    return query, body, headers
@@ -0,0 +1,223 @@
+# social_casino_backend/app/ch_spill.py
+#
+# Дисковый буфер аналитики на время недоступности ClickHouse. Флашер
+# ClickHouseWriter сбрасывает сюда строки, которые не смог отправить, и потом
+# проигрывает их большими пачками в исходном порядке. Формат — append-only
+# сегменты JSON Lines ({"t": таблица, "r": строка}) в CH_SPILL_DIR; сегмент
+# закрывается по размеру, общий объём ограничен CH_SPILL_MAX_BYTES (при
+# переполнении удаляются самые старые сегменты).
+# Все методы синхронные и вызываются из флашера через asyncio.to_thread —
+# путь ставки диск не трогает.
+#
+# Воркеры uvicorn (GAME_BUS=unix) делят один CH_SPILL_DIR, поэтому у каждого
+# процесса свой слот — подкаталог под flock, который держится до конца жизни
+# процесса. На старте процесс сначала занимает слот умершего воркера (и
+# проигрывает его сегменты), иначе заводит новый. Сегменты слотов, которые так
+# никто и не занял (воркеров стало меньше), забирает к себе лидер шины
+# (adopt_orphans). Лимит CH_SPILL_MAX_BYTES — на слот.
+
+import os
+import json
+import tempfile
+import threading
+from typing import Any, Dict, Iterable
+
+CH_SPILL_DIR = os.getenv("CH_SPILL_DIR", "ch_spill")
+CH_SPILL_SEGMENT_BYTES = int(os.getenv("CH_SPILL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+CH_SPILL_MAX_BYTES = int(os.getenv("CH_SPILL_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_SUFFIX = ".jsonl"
+_SLOT_PREFIX = "w"
+_LOCK_NAME = ".lock"
+
+
+def _try_lock_slot(path: str) -> int | None:
+    """Takes the slot's flock without blocking; returns the held fd or None if another process owns it."""
+    import fcntl
+
+    try:
+        fd = os.open(os.path.join(path, _LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _slots(root: str) -> list[str]:
+    return sorted(n for n in os.listdir(root) if n.startswith(_SLOT_PREFIX) and os.path.isdir(os.path.join(root, n)))
+
+
+def _segment_names(path: str) -> list[str]:
+    return sorted(n for n in os.listdir(path) if n.endswith(_SUFFIX))
+
+
+class SpillQueue:
+    """Ordered on-disk queue of (table, row) records split into size-capped segments."""
+
+    def __init__(self, directory: str = CH_SPILL_DIR, segment_bytes: int = CH_SPILL_SEGMENT_BYTES, max_bytes: int = CH_SPILL_MAX_BYTES):
+        self.root = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.directory, self._slot_fd = self._claim_slot()
+        # сегменты, оставшиеся с прошлого запуска (своего или умершего воркера), тоже будут проиграны
+        self._segments: list[str] = _segment_names(self.directory)
+        self._sizes: dict[str, int] = {n: os.path.getsize(self._path(n)) for n in self._segments}
+        self._next = int(self._segments[-1][:-len(_SUFFIX)]) + 1 if self._segments else 1
+        self._current: str | None = None
+        self.spilled_rows = 0
+        self.dropped_segments = 0
+        self.dropped_bytes = 0
+        self.adopted_segments = 0
+
+    def _claim_slot(self) -> tuple[str, int]:
+        for name in _slots(self.root):
+            path = os.path.join(self.root, name)
+            fd = _try_lock_slot(path)
+            if fd is not None:
+                return path, fd
+        while True:
+            path = tempfile.mkdtemp(prefix=_SLOT_PREFIX, dir=self.root)
+            # между mkdtemp и flock слот мог занять другой процесс — тогда пробуем следующий
+            fd = _try_lock_slot(path)
+            if fd is not None:
+                return path, fd
+
+    def adopt_orphans(self) -> int:
+        """Moves segments of slots no live process holds into this slot. Returns how many were moved."""
+        moved = 0
+        for name in _slots(self.root):
+            path = os.path.join(self.root, name)
+            if path == self.directory:
+                continue
+            fd = _try_lock_slot(path)
+            if fd is None:
+                continue
+            try:
+                with self._lock:
+                    for segment in _segment_names(path):
+                        target = f"{self._next:012d}{_SUFFIX}"
+                        self._next += 1
+                        os.replace(os.path.join(path, segment), self._path(target))
+                        self._segments.append(target)
+                        self._sizes[target] = os.path.getsize(self._path(target))
+                        moved += 1
+                    self._enforce_cap()
+                os.remove(os.path.join(path, _LOCK_NAME))
+                os.rmdir(path)
+            except OSError:
+                pass  # в слоте осталось что-то чужое — заберём в следующий раз
+            finally:
+                os.close(fd)
+        self.adopted_segments += moved
+        return moved
+
+    def _forget(self, name: str) -> None:
+        self._segments.remove(name)
+        self._sizes.pop(name, None)
+        if name == self._current:
+            self._current = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def pending(self) -> bool:
+        return bool(self._segments)
+
+    def append(self, records: Iterable[tuple[str, dict]]) -> int:
+        """Appends records to the open segment (rolling it by size). Returns how many were written."""
+        data = "".join(json.dumps({"t": table, "r": row}, ensure_ascii=False) + "\n" for table, row in records).encode("utf-8")
+        if not data:
+            return 0
+        with self._lock:
+            if self._current is None or self._sizes[self._current] >= self.segment_bytes:
+                self._current = f"{self._next:012d}{_SUFFIX}"
+                self._next += 1
+                self._segments.append(self._current)
+                self._sizes[self._current] = 0
+            with open(self._path(self._current), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._sizes[self._current] += len(data)
+            rows = data.count(b"\n")
+            self.spilled_rows += rows
+            self._enforce_cap()
+            return rows
+
+    def _enforce_cap(self) -> None:
+        while sum(self._sizes.values()) > self.max_bytes and len(self._segments) > 1:
+            oldest = self._segments.pop(0)
+            self.dropped_segments += 1
+            self.dropped_bytes += self._sizes.pop(oldest)
+            try:
+                os.remove(self._path(oldest))
+            except FileNotFoundError:
+                pass
+
+    def oldest(self) -> tuple[str, list[tuple[str, dict]]] | None:
+        """
+        Returns the oldest segment and its records; the open segment is sealed first.
+        A segment whose file is gone counts as already acked and is skipped.
+        """
+        with self._lock:
+            while self._segments:
+                name = self._segments[0]
+                if name == self._current:
+                    self._current = None
+                try:
+                    f = open(self._path(name), "rb")
+                except FileNotFoundError:
+                    self._forget(name)
+                    continue
+                with f:
+                    records = []
+                    for line in f:
+                        try:
+                            item = json.loads(line)
+                        except ValueError:
+                            continue  # недописанная строка после падения процесса
+                        records.append((item["t"], item["r"]))
+                return name, records
+            return None
+
+    def ack(self, name: str) -> None:
+        """Deletes a segment that was fully replayed."""
+        with self._lock:
+            if name in self._sizes:
+                self._forget(name)
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+    def rewrite(self, name: str, records: list[tuple[str, dict]]) -> None:
+        """Replaces a partially replayed segment with the records that were not sent yet."""
+        data = "".join(json.dumps({"t": table, "r": row}, ensure_ascii=False) + "\n" for table, row in records).encode("utf-8")
+        with self._lock:
+            if name not in self._sizes:
+                return
+            tmp = self._path(name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path(name))
+            self._sizes[name] = len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dir": self.directory,
+            "adopted_segments": self.adopted_segments,
+            "segments": len(self._segments),
+            "bytes": sum(self._sizes.values()),
+            "max_bytes": self.max_bytes,
+            "spilled_rows": self.spilled_rows,
+            "dropped_segments": self.dropped_segments,
+            "dropped_bytes": self.dropped_bytes,
+        }
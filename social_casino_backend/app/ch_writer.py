@@ -0,0 +1,278 @@
+# social_casino_backend/app/ch_writer.py
+#
+# Фоновая пакетная запись в ClickHouse. log_event/log_spin больше не ходят в сеть:
+# строка кладётся в очередь своей таблицы, а один флашер шлёт многострочные
+# INSERT по одному общему соединению — по CH_BATCH_SIZE строк или раз в
+# CH_FLUSH_INTERVAL секунд. Очереди ограничены CH_QUEUE_MAX строками; при
+# переполнении срабатывает CH_OVERFLOW_POLICY (drop_oldest | drop_new), чтобы
+# недоступный ClickHouse не съел память процесса.
+# Если задан дисковый буфер (app.ch_spill), всё, что не удалось отправить,
+# уходит туда и проигрывается по порядку раньше новых строк, когда ClickHouse
+# снова доступен. После сбоя отправки следующая попытка — не раньше чем через
+# паузу, растущую вдвое до CH_RETRY_MAX секунд; до тех пор строки копятся на
+# диске, а сегмент буфера не перечитывается на каждом тике.
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from app.ch_spill import SpillQueue
+
+logger = logging.getLogger("uvicorn.error")
+
+CH_BATCH_SIZE = int(os.getenv("CH_BATCH_SIZE", "1000"))
+CH_FLUSH_INTERVAL = float(os.getenv("CH_FLUSH_INTERVAL", "1.0"))
+CH_QUEUE_MAX = int(os.getenv("CH_QUEUE_MAX", "100000"))
+CH_OVERFLOW_POLICY = os.getenv("CH_OVERFLOW_POLICY", "drop_oldest")
+CH_SHUTDOWN_TIMEOUT = float(os.getenv("CH_SHUTDOWN_TIMEOUT", "5.0"))
+# сколько ждать проверки доступности, прежде чем считать ClickHouse недоступным
+CH_READY_TIMEOUT = float(os.getenv("CH_READY_TIMEOUT", "2.0"))
+CH_SPILL_REPLAY_BATCH = int(os.getenv("CH_SPILL_REPLAY_BATCH", "10000"))
+CH_RETRY_MAX = float(os.getenv("CH_RETRY_MAX", "30.0"))
+
+
+class _TableQueue:
+    __slots__ = ("rows", "enqueued", "written", "dropped", "failed_flushes", "batches")
+
+    def __init__(self):
+        self.rows: deque[dict] = deque()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.batches = 0
+
+
+class ClickHouseWriter:
+    """
+    Per-table in-memory queues drained by a single background task.
+    send(table, rows) performs one multi-row insert; ready() tells whether the sink
+    is reachable (rows are kept queued, or spilled to disk, while it is not).
+    """
+
+    def __init__(self, send: Callable[[str, list[dict]], Awaitable[None]], ready: Callable[[], Awaitable[bool]],
+                 spill: SpillQueue | None = None):
+        self._send = send
+        self._ready = ready
+        self._spill = spill
+        self.replayed_rows = 0
+        self.replay_batches = 0
+        self.replay_failures = 0
+        self.last_replay_rows_per_sec: float | None = None
+        # пауза после сбоя: 0 — ClickHouse отвечает, иначе следующая попытка не раньше _retry_at
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._queues: dict[str, _TableQueue] = {}
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _queue(self, table: str) -> _TableQueue:
+        queue = self._queues.get(table)
+        if queue is None:
+            queue = self._queues[table] = _TableQueue()
+        return queue
+
+    def enqueue(self, table: str, row: dict) -> bool:
+        """Queues one row without blocking. Returns False if the row was dropped."""
+        queue = self._queue(table)
+        queue.enqueued += 1
+        if len(queue.rows) >= CH_QUEUE_MAX:
+            queue.dropped += 1
+            if CH_OVERFLOW_POLICY == "drop_new":
+                return False
+            queue.rows.popleft()
+        queue.rows.append(row)
+        if len(queue.rows) >= CH_BATCH_SIZE:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=CH_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"[CH] writer flush failed: {e}")
+
+    async def _is_ready(self) -> bool:
+        try:
+            return await asyncio.wait_for(self._ready(), timeout=CH_READY_TIMEOUT)
+        except Exception:
+            return False
+
+    async def flush(self) -> None:
+        """Replays the disk backlog, then sends everything queued in batches of CH_BATCH_SIZE rows."""
+        spill = self._spill
+        backlog = spill is not None and spill.pending()
+        if not backlog and not any(queue.rows for queue in self._queues.values()):
+            return
+        if time.monotonic() < self._retry_at:
+            await self._spill_queued()
+            return
+        if not await self._is_ready():
+            self._backoff()
+            await self._spill_queued()
+            return
+        # старые строки с диска уходят раньше новых из памяти — порядок сохраняется
+        if backlog and not await self._replay():
+            self._backoff()
+            await self._spill_queued()
+            return
+        failed = False
+        # снимок: пока ждём _send, enqueue может завести очередь новой таблицы
+        for table, queue in list(self._queues.items()):
+            while queue.rows:
+                batch = [queue.rows.popleft() for _ in range(min(CH_BATCH_SIZE, len(queue.rows)))]
+                try:
+                    await self._send(table, batch)
+                except Exception as e:
+                    # возвращаем пачку в голову очереди, следующая попытка — на следующем тике
+                    queue.failed_flushes += 1
+                    queue.rows.extendleft(reversed(batch))
+                    while len(queue.rows) > CH_QUEUE_MAX:
+                        queue.rows.pop()
+                        queue.dropped += 1
+                    logger.warning(f"[CH] insert {table} failed ({len(batch)} rows kept): {e}")
+                    await self._spill_queued([table])
+                    failed = True
+                    break
+                queue.batches += 1
+                queue.written += len(batch)
+        if failed:
+            self._backoff()
+        else:
+            self._retry_delay = 0.0
+
+    def _backoff(self) -> None:
+        self._retry_delay = min(max(self._retry_delay * 2, CH_FLUSH_INTERVAL), CH_RETRY_MAX)
+        self._retry_at = time.monotonic() + self._retry_delay
+
+    async def _spill_queued(self, tables: list[str] | None = None) -> None:
+        """Moves queued rows of the given tables (all by default) to the disk buffer, if there is one."""
+        if self._spill is None:
+            return
+        taken: list[tuple[str, deque[dict]]] = []
+        for table in (tables if tables is not None else list(self._queues)):
+            queue = self._queues[table]
+            if queue.rows:
+                taken.append((table, queue.rows))
+                queue.rows = deque()
+        if not taken:
+            return
+        try:
+            await asyncio.to_thread(self._spill.append, [(table, row) for table, rows in taken for row in rows])
+        except Exception as e:
+            logger.warning(f"[CH] spill to disk failed, rows stay in memory: {e}")
+            for table, rows in taken:
+                queue = self._queues[table]
+                rows.extend(queue.rows)
+                queue.rows = rows
+
+    async def _replay(self) -> bool:
+        """Sends spilled segments oldest first. Returns False if the sink failed midway."""
+        spill = self._spill
+        started = time.perf_counter()
+        replayed = 0
+        try:
+            while spill.pending():
+                segment = await asyncio.to_thread(spill.oldest)
+                if segment is None:
+                    break
+                name, records = segment
+                sent = False
+                by_table: dict[str, list[dict]] = {}
+                for table, row in records:
+                    by_table.setdefault(table, []).append(row)
+                groups = list(by_table.items())
+                for i, (table, rows) in enumerate(groups):
+                    for offset in range(0, len(rows), CH_SPILL_REPLAY_BATCH):
+                        try:
+                            await self._send(table, rows[offset:offset + CH_SPILL_REPLAY_BATCH])
+                        except Exception as e:
+                            # в сегменте остаётся только неотправленное, чтобы не задвоить строки;
+                            # если из сегмента ничего не ушло, он и так не изменился
+                            rest = [(table, row) for row in rows[offset:]]
+                            rest += [(t, row) for t, later in groups[i + 1:] for row in later]
+                            if sent:
+                                await asyncio.to_thread(spill.rewrite, name, rest)
+                            self.replay_failures += 1
+                            logger.warning(f"[CH] spill replay of {table} failed ({len(rest)} rows left): {e}")
+                            return False
+                        sent = True
+                        batch_rows = min(CH_SPILL_REPLAY_BATCH, len(rows) - offset)
+                        replayed += batch_rows
+                        self.replayed_rows += batch_rows
+                        self.replay_batches += 1
+                await asyncio.to_thread(spill.ack, name)
+            return True
+        finally:
+            elapsed = time.perf_counter() - started
+            if replayed and elapsed > 0:
+                self.last_replay_rows_per_sec = replayed / elapsed
+
+    async def adopt_orphaned_spill(self) -> None:
+        """Takes over disk segments left by workers that are gone (called by the round bus leader)."""
+        if self._spill is None:
+            return
+        try:
+            moved = await asyncio.to_thread(self._spill.adopt_orphans)
+        except Exception as e:
+            logger.warning(f"[CH] adopting orphaned spill segments failed: {e}")
+            return
+        if moved:
+            logger.info(f"[CH] adopted {moved} orphaned spill segments")
+
+    async def close(self) -> None:
+        """Stops the background task and flushes what is left (bounded by CH_SHUTDOWN_TIMEOUT)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=CH_SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"[CH] final flush failed: {e}")
+        # не успели отправить — сохраняем на диск до следующего запуска
+        if self._spill is not None:
+            leftovers = [(table, row) for table, queue in self._queues.items() for row in queue.rows]
+            if leftovers:
+                self._spill.append(leftovers)
+                for queue in self._queues.values():
+                    queue.rows.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "spill": self._spill.stats() if self._spill is not None else None,
+            "replayed_rows": self.replayed_rows,
+            "replay_batches": self.replay_batches,
+            "replay_failures": self.replay_failures,
+            "last_replay_rows_per_sec": self.last_replay_rows_per_sec,
+            "retry_delay": self._retry_delay,
+            "batch_size": CH_BATCH_SIZE,
+            "flush_interval": CH_FLUSH_INTERVAL,
+            "queue_max": CH_QUEUE_MAX,
+            "overflow_policy": CH_OVERFLOW_POLICY,
+            "tables": {
+                table: {
+                    "queued": len(queue.rows),
+                    "enqueued": queue.enqueued,
+                    "written": queue.written,
+                    "dropped": queue.dropped,
+                    "batches": queue.batches,
+                    "failed_flushes": queue.failed_flushes,
+                }
+                for table, queue in self._queues.items()
+            },
+        }
@@ -2,19 +2,32 @@
 
 import os
 import json
+import time
 import datetime
 import asyncio
-import httpx
 import logging
 from typing import Optional, Dict, Any
 
+from app.ch_writer import ClickHouseWriter
+from app.http_clients import http_clients
+from app.ch_format import build_insert, CH_INSERT_FORMAT, FORMAT_JSON, FORMAT_ROWBINARY
+from app.ch_spill import SpillQueue, CH_SPILL_DIR
+from app.live_metrics import live_metrics
+
 CLICKHOUSE_ENABLED = os.getenv("CLICKHOUSE_ENABLED", "0") == "1"
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "http://localhost:8123/")
 CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "")
 CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "default")
-CLICKHOUSE_LOG_TABLE = os.getenv("CLICKHOUSE_TABLE", "game_events")
-CLICKHOUSE_SPINS_TABLE = os.getenv("CLICKHOUSE_SPINS_TABLE", "spins")
+# с миграций 0007/0008 пишем в таблицы с оптимизированной схемой;
+# старые game_events/spins остаются только для проигрыша старого дискового буфера
+CLICKHOUSE_LOG_TABLE = os.getenv("CLICKHOUSE_TABLE", "game_events_v2")
+CLICKHOUSE_SPINS_TABLE = os.getenv("CLICKHOUSE_SPINS_TABLE", "spins_v2")
+LEGACY_LOG_TABLE = "game_events"
+LEGACY_SPINS_TABLE = "spins"
+# роллапы spins (см. migrations/0003–0006)
+CLICKHOUSE_SPINS_HOURLY_TABLE = "spins_hourly"
+CLICKHOUSE_SPINS_DAILY_TABLE = "spins_daily"
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -26,27 +39,27 @@ _last_error: Optional[str] = None
 def _auth_tuple():
     return (CLICKHOUSE_USER, CLICKHOUSE_PASSWORD) if (CLICKHOUSE_USER or CLICKHOUSE_PASSWORD) else None
 
-async def _exec(client: httpx.AsyncClient, sql: str, *, database: str | None = None) -> None:
+async def _exec(sql: str, *, database: str | None = None) -> None:
     params = {"query": sql}
     if database:
         params["database"] = database
-    r = await client.post(CLICKHOUSE_HOST, params=params, auth=_auth_tuple())
+    r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params=params, auth=_auth_tuple(), timeout=5.0)
     r.raise_for_status()
 
-async def _fetch_text(client: httpx.AsyncClient, sql: str, *, database: str | None = None) -> str:
+async def _fetch_text(sql: str, *, database: str | None = None) -> str:
     params = {"query": sql, "default_format": "TabSeparated"}
     if database:
         params["database"] = database
-    r = await client.post(CLICKHOUSE_HOST, params=params, auth=_auth_tuple())
+    r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params=params, auth=_auth_tuple(), timeout=5.0)
     r.raise_for_status()
     return r.text.strip()
 
-async def _ping_with_retries(client: httpx.AsyncClient, attempts: int = 8) -> None:
+async def _ping_with_retries(attempts: int = 8) -> None:
     delay = 0.5
     last_exc: Optional[Exception] = None
     for _ in range(attempts):
         try:
-            await _exec(client, "SELECT 1")
+            await _exec("SELECT 1")
             return
         except Exception as e:
             last_exc = e
@@ -86,27 +99,25 @@ async def ensure_clickhouse() -> Dict[str, Any]:
             status["payload_type"] = "String" if _payload_is_string else "JSON"
             return status
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                await _ping_with_retries(client)
-                status["reachable"] = True
-
-                try:
-                    dtype = await _fetch_text(
-                        client,
-                        f"SELECT type FROM system.columns "
-                        f"WHERE database = '{CLICKHOUSE_DB}' AND table = '{CLICKHOUSE_LOG_TABLE}' AND name = 'payload' LIMIT 1"
-                    )
-                    t = (dtype or "").strip().lower()
-                    _payload_is_string = not ("json" in t or "object('json')" in t)
-                    status["payload_type"] = "String" if _payload_is_string else "JSON"
-                except Exception as e:
-                    _payload_is_string = True
-                    status["payload_type"] = "String"
-                    _last_error = f"payload type detect failed: {e}"
-                    status["error"] = _last_error
-
-                _ensured = True
-                return status
+            await _ping_with_retries()
+            status["reachable"] = True
+
+            try:
+                dtype = await _fetch_text(
+                    f"SELECT type FROM system.columns "
+                    f"WHERE database = '{CLICKHOUSE_DB}' AND table = '{CLICKHOUSE_LOG_TABLE}' AND name = 'payload' LIMIT 1"
+                )
+                t = (dtype or "").strip().lower()
+                _payload_is_string = not ("json" in t or "object('json')" in t)
+                status["payload_type"] = "String" if _payload_is_string else "JSON"
+            except Exception as e:
+                _payload_is_string = True
+                status["payload_type"] = "String"
+                _last_error = f"payload type detect failed: {e}"
+                status["error"] = _last_error
+
+            _ensured = True
+            return status
         except Exception as e:
             _last_error = f"CH ping failed: {e}"
             status["error"] = _last_error
@@ -126,68 +137,124 @@ async def ch_status() -> Dict[str, Any]:
     if not CLICKHOUSE_ENABLED:
         return info
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await _ping_with_retries(client)
-            info["reachable"] = True
+        await _ping_with_retries()
+        info["reachable"] = True
     except Exception as e:
         info["last_error"] = f"ch_status ping failed: {e}"
     return info
 
-async def log_event(event_type: str, user_id: int | None = None, payload: dict | None = None, user_source: str | None = None) -> None:
-    if not CLICKHOUSE_ENABLED:
-        return
+# ---- пакетная запись ----
+
+async def _sink_ready() -> bool:
     st = await ensure_clickhouse()
-    if not st.get("reachable"):
-        return
+    return bool(st.get("reachable"))
 
-    ts_str = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    row_payload = (payload or {})
-    if _payload_is_string is True:
-        row_payload = json.dumps(row_payload, ensure_ascii=False)
 
-    row = {
-        "ts": ts_str,
-        "event_type": event_type,
-        "user_id": user_id,
-        "user_source": user_source,
-        "payload": row_payload,
-    }
-    data_to_send = json.dumps(row, ensure_ascii=False) + "\n"
-    params = {"query": f"INSERT INTO {CLICKHOUSE_LOG_TABLE} FORMAT JSONEachRow", "database": CLICKHOUSE_DB}
+# схемы таблиц для RowBinary (порядок колонок = порядок в INSERT)
+GAME_EVENTS_COLUMNS = [
+    ("ts", "DateTime"),
+    ("event_type", "LowCardinality(String)"),
+    ("user_id", "UInt64"),
+    ("user_source", "LowCardinality(String)"),
+    ("payload", "String"),
+]
+SPINS_COLUMNS = [
+    ("user_id", "UInt64"),
+    ("event_type", "LowCardinality(String)"),
+    ("amount", "Float64"),
+    ("multiplier", "Float64"),
+    ("timestamp", "DateTime"),
+]
+LEGACY_GAME_EVENTS_COLUMNS = [
+    ("ts", "DateTime"),
+    ("event_type", "String"),
+    ("user_id", "Nullable(Int64)"),
+    ("user_source", "Nullable(String)"),
+    ("payload", "String"),
+]
+LEGACY_SPINS_COLUMNS = [
+    ("user_id", "String"),
+    ("event_type", "String"),
+    ("amount", "Float64"),
+    ("multiplier", "Float64"),
+    ("timestamp", "DateTime"),
+]
+_TABLE_COLUMNS = {
+    CLICKHOUSE_LOG_TABLE: GAME_EVENTS_COLUMNS,
+    CLICKHOUSE_SPINS_TABLE: SPINS_COLUMNS,
+    LEGACY_LOG_TABLE: LEGACY_GAME_EVENTS_COLUMNS,
+    LEGACY_SPINS_TABLE: LEGACY_SPINS_COLUMNS,
+}
+_PAYLOAD_TABLES = {CLICKHOUSE_LOG_TABLE, LEGACY_LOG_TABLE}
+# таблицы, которые отвергли RowBinary (схема разошлась), -> до какого момента (monotonic) писать в них JSON;
+# потом снова пробуем RowBinary — схему могли поправить
+CH_JSON_FALLBACK_TTL = float(os.getenv("CH_JSON_FALLBACK_TTL", "600"))
+_json_only: dict[str, float] = {}
+# ошибки разбора тела: только они говорят, что не подошёл сам формат (а не права, адрес или размер)
+_FORMAT_ERRORS = ("CANNOT_PARSE", "TYPE_MISMATCH", "INCORRECT_DATA", "CANNOT_READ_ALL_DATA",
+                  "NO_SUCH_COLUMN_IN_TABLE", "INCORRECT_NUMBER_OF_COLUMNS")
 
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.post(CLICKHOUSE_HOST, params=params, content=data_to_send.encode("utf-8"), auth=_auth_tuple())
-            if resp.status_code >= 400:
-                logger.warning(f"[CH] insert game_events failed: status={resp.status_code} body={resp.text!r} row={data_to_send!r}")
-                resp.raise_for_status()
-    except Exception as e:
-        logger.warning(f"[CH] insert game_events exception: {e}")
 
-async def log_spin(*, user_id: str, event_type: str, amount: float, multiplier: float, timestamp: datetime.datetime | None = None) -> None:
+def _is_format_error(status_code: int, body: str) -> bool:
+    return 400 <= status_code < 500 and any(code in body for code in _FORMAT_ERRORS)
+
+
+async def _insert_rows(table: str, rows: list[dict]) -> None:
+    columns = _TABLE_COLUMNS.get(table)
+    if table in _PAYLOAD_TABLES and _payload_is_string is not True:
+        columns = None  # payload типа JSON — только через JSONEachRow
+    fmt = FORMAT_JSON if (_json_only.get(table, 0.0) > time.monotonic() or not columns) else CH_INSERT_FORMAT
+    if fmt == FORMAT_JSON and table in _PAYLOAD_TABLES and _payload_is_string is True:
+        rows = [{**row, "payload": json.dumps(row["payload"], ensure_ascii=False)} for row in rows]
+
+    query, body, headers = build_insert(table, rows, columns, fmt)
+    params = {"query": query, "database": CLICKHOUSE_DB}
+    resp = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params=params, content=body, headers=headers, auth=_auth_tuple())
+    if resp.status_code >= 400:
+        # прочие 4xx (401/403, 404, 413) — обычный сбой: пачка вернётся в очередь, писатель подождёт и повторит
+        if fmt == FORMAT_ROWBINARY and _is_format_error(resp.status_code, resp.text):
+            logger.warning(f"[CH] RowBinary insert into {table} rejected ({resp.status_code} {resp.text!r}), "
+                           f"falling back to JSONEachRow for {CH_JSON_FALLBACK_TTL:.0f}s")
+            _json_only[table] = time.monotonic() + CH_JSON_FALLBACK_TTL
+            return await _insert_rows(table, rows)
+        logger.warning(f"[CH] insert {table} failed: status={resp.status_code} body={resp.text!r} rows={len(rows)}")
+        resp.raise_for_status()
+
+
+ch_writer = ClickHouseWriter(
+    send=_insert_rows,
+    ready=_sink_ready,
+    # пустой CH_SPILL_DIR выключает дисковый буфер
+    spill=SpillQueue(CH_SPILL_DIR) if (CLICKHOUSE_ENABLED and CH_SPILL_DIR) else None,
+)
+
+
+async def close_clickhouse() -> None:
+    """Flushes queued rows on app shutdown (the HTTP client itself belongs to app.http_clients)."""
+    await ch_writer.close()
+
+
+async def log_event(event_type: str, user_id: int | None = None, payload: dict | None = None, user_source: str | None = None) -> None:
     if not CLICKHOUSE_ENABLED:
         return
-    st = await ensure_clickhouse()
-    if not st.get("reachable"):
-        return
+    ch_writer.enqueue(CLICKHOUSE_LOG_TABLE, {
+        "ts": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "event_type": event_type,
+        "user_id": user_id or 0,
+        "user_source": user_source or "",
+        "payload": payload or {},
+    })
 
+async def log_spin(*, user_id: str, event_type: str, amount: float, multiplier: float, timestamp: datetime.datetime | None = None) -> None:
+    # живые счётчики для дашборда ведём и без ClickHouse
+    live_metrics.record(event_type, float(amount))
+    if not CLICKHOUSE_ENABLED:
+        return
     ts = timestamp or datetime.datetime.utcnow()
-    ts_str = ts.strftime("%Y-%m-%d %H:%M:%S")
-    row = {
-        "user_id": str(user_id),
+    ch_writer.enqueue(CLICKHOUSE_SPINS_TABLE, {
+        "user_id": int(user_id),
         "event_type": event_type,
         "amount": float(amount),
         "multiplier": float(multiplier),
-        "timestamp": ts_str,
-    }
-    data_to_send = json.dumps(row, ensure_ascii=False) + "\n"
-    params = {"query": f"INSERT INTO {CLICKHOUSE_SPINS_TABLE} FORMAT JSONEachRow", "database": CLICKHOUSE_DB}
-
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.post(CLICKHOUSE_HOST, params=params, content=data_to_send.encode("utf-8"), auth=_auth_tuple())
-            if resp.status_code >= 400:
-                logger.warning(f"[CH] insert spins failed: status={resp.status_code} body={resp.text!r} row={data_to_send!r}")
-                resp.raise_for_status()
-    except Exception as e:
-        logger.warning(f"[CH] insert spins exception: {e}")
+        "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+    })
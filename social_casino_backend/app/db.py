@@ -3,6 +3,7 @@
 import sqlite3
 import threading
 import os
+import time
 
 local = threading.local()
 DATABASE_URL = os.getenv("SQLITE_PATH", "social_casino.db")
@@ -14,8 +15,46 @@ CREATE TABLE IF NOT EXISTS users (
     balance     REAL NOT NULL DEFAULT 0
 );
 CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance);
+
+-- журнал всех изменений баланса, только INSERT
+CREATE TABLE IF NOT EXISTS balance_ledger (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id         INTEGER NOT NULL,
+    kind            TEXT NOT NULL,   -- bet | win | deposit | refund
+    amount          REAL NOT NULL,   -- знаковая дельта
+    round_id        INTEGER,
+    idempotency_key TEXT UNIQUE,
+    created_at      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_user ON balance_ledger(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_ledger_round ON balance_ledger(round_id);
+
+-- история раундов для проверки честности, одна строка на раунд;
+-- round_id (ms-таймстамп подготовки) — rowid, выборки и пагинация идут по нему
+CREATE TABLE IF NOT EXISTS rounds (
+    round_id           INTEGER PRIMARY KEY,
+    nonce              INTEGER NOT NULL,
+    mode               TEXT NOT NULL,   -- seed | chain
+    hashed_server_seed TEXT NOT NULL,   -- хеш сида или commitment цепочки
+    server_seed        TEXT,            -- раскрытый сид; в режиме seed NULL, пока сид не сменился
+    crash_point        REAL NOT NULL,
+    started_at         REAL,
+    ended_at           REAL NOT NULL,
+    bets_count         INTEGER NOT NULL DEFAULT 0,
+    bets_sum           REAL NOT NULL DEFAULT 0,
+    wins_count         INTEGER NOT NULL DEFAULT 0,
+    wins_sum           REAL NOT NULL DEFAULT 0
+);
 """
 
+ROUND_COLUMNS = ("round_id", "nonce", "mode", "hashed_server_seed", "server_seed", "crash_point",
+                 "started_at", "ended_at", "bets_count", "bets_sum", "wins_count", "wins_sum")
+
+LEDGER_BET = "bet"
+LEDGER_WIN = "win"
+LEDGER_DEPOSIT = "deposit"
+LEDGER_REFUND = "refund"
+
 def _configure_connection(conn: sqlite3.Connection) -> None:
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
@@ -47,30 +86,47 @@ def get_or_create_user(user_id: int, username: str | None = None) -> None:
         )
         db.commit()
 
-def update_balance(user_id: int, amount: float, op: str = "set") -> float:
+def apply_balance_mutation(user_id: int, amount: float, kind: str, *, round_id: int | None = None,
+                           idempotency_key: str | None = None) -> float | None:
+    """
+    Applies a signed delta atomically and records it in the ledger.
+    The sufficient-funds check and the update are a single statement; returns the
+    new balance, or None if a debit would make the balance negative.
+    A repeated idempotency_key is not applied again: the current balance is returned.
+    """
     db = get_db()
-    cur = db.cursor()
-    cur.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    if row is None:
-        cur.execute("INSERT INTO users(user_id, balance) VALUES(?, 0)", (user_id,))
-        db.commit()
-        current = 0.0
-    else:
-        current = float(row["balance"])
-
-    if op == "inc":
-        new_balance = current + float(amount)
-    elif op == "dec":
-        new_balance = current - float(amount)
-    else:
-        new_balance = float(amount)
-
-    cur.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-    db.commit()
+    amount = float(amount)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        cur = db.execute(
+            "INSERT INTO balance_ledger(user_id, kind, amount, round_id, idempotency_key, created_at) "
+            "VALUES(?, ?, ?, ?, ?, ?) ON CONFLICT(idempotency_key) DO NOTHING",
+            (user_id, kind, amount, round_id, idempotency_key, time.time()),
+        )
+        if cur.rowcount == 0:
+            db.execute("ROLLBACK")
+            return get_balance(user_id)
 
-    cur.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    return float(cur.fetchone()["balance"])
+        if amount >= 0:
+            row = db.execute(
+                "INSERT INTO users(user_id, balance) VALUES(?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance "
+                "RETURNING balance",
+                (user_id, amount),
+            ).fetchone()
+        else:
+            row = db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? AND balance + ? >= 0 RETURNING balance",
+                (amount, user_id, amount),
+            ).fetchone()
+        if row is None:
+            db.execute("ROLLBACK")
+            return None
+        db.execute("COMMIT")
+        return float(row["balance"])
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
 
 def get_balance(user_id: int) -> float:
     db = get_db()
@@ -78,3 +134,92 @@ def get_balance(user_id: int) -> float:
     cur.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
     row = cur.fetchone()
     return float(row["balance"]) if row else 0.0
+
+def apply_ledger_entries(entries: list[tuple[int, str, float, int | None]]) -> list[int]:
+    """
+    Persists many mutations (user_id, kind, amount, round_id) in one transaction: entries go
+    to the ledger, balances get one upsert per user. Users missing from the table are created
+    with the delta as their balance.
+    Debits are re-checked against the stored balance in entry order (the same guard as
+    apply_balance_mutation): another worker may have spent the money since this process
+    cached it. Returns the indices of rejected debits; they are not written.
+    """
+    if not entries:
+        return []
+    now = time.time()
+
+    db = get_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # под BEGIN IMMEDIATE другие писатели ждут, так что прочитанные балансы не устареют до COMMIT
+        balances: dict[int, float] = {}
+        for user_id in {entry[0] for entry in entries}:
+            row = db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            balances[user_id] = float(row["balance"]) if row else 0.0
+        deltas: dict[int, float] = {}
+        accepted: list[tuple[int, str, float, int | None, float]] = []
+        rejected: list[int] = []
+        for i, (user_id, kind, amount, round_id) in enumerate(entries):
+            amount = float(amount)
+            if amount < 0 and balances[user_id] + amount < 0:
+                rejected.append(i)
+                continue
+            balances[user_id] += amount
+            deltas[user_id] = deltas.get(user_id, 0.0) + amount
+            accepted.append((user_id, kind, amount, round_id, now))
+        db.executemany(
+            "INSERT INTO balance_ledger(user_id, kind, amount, round_id, created_at) VALUES(?, ?, ?, ?, ?)",
+            accepted,
+        )
+        db.executemany(
+            "INSERT INTO users(user_id, balance) VALUES(?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance",
+            list(deltas.items()),
+        )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return rejected
+
+def record_round(row: tuple) -> None:
+    """
+    Stores one finished round (values in ROUND_COLUMNS order) in a single statement.
+    With several workers each one records the same round: the first insert wins and the
+    others only add their bet aggregates.
+    """
+    get_db().execute(
+        f"INSERT INTO rounds({', '.join(ROUND_COLUMNS)}) VALUES({', '.join('?' * len(ROUND_COLUMNS))}) "
+        "ON CONFLICT(round_id) DO UPDATE SET "
+        "bets_count = bets_count + excluded.bets_count, bets_sum = bets_sum + excluded.bets_sum, "
+        "wins_count = wins_count + excluded.wins_count, wins_sum = wins_sum + excluded.wins_sum",
+        row,
+    )
+
+def reveal_seed(hashed_server_seed: str, server_seed: str) -> int:
+    """Fills in the seed of every seed-mode round played with it (called once the seed is retired)."""
+    cur = get_db().execute(
+        "UPDATE rounds SET server_seed = ? WHERE mode = 'seed' AND hashed_server_seed = ? AND server_seed IS NULL",
+        (server_seed, hashed_server_seed),
+    )
+    return cur.rowcount
+
+def get_round(round_id: int) -> dict | None:
+    row = get_db().execute(f"SELECT {', '.join(ROUND_COLUMNS)} FROM rounds WHERE round_id = ?", (round_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_rounds(before: int | None = None, limit: int = 50) -> list[dict]:
+    """Newest-first page of rounds older than `before` (keyset pagination, no OFFSET scans)."""
+    cur = get_db().execute(
+        f"SELECT {', '.join(ROUND_COLUMNS)} FROM rounds WHERE round_id < ? ORDER BY round_id DESC LIMIT ?",
+        (before if before is not None else 2**63 - 1, limit),
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+def get_rounds_range(from_id: int, to_id: int, limit: int) -> list[dict]:
+    """Oldest-first rounds with from_id <= round_id <= to_id."""
+    cur = get_db().execute(
+        f"SELECT {', '.join(ROUND_COLUMNS)} FROM rounds WHERE round_id BETWEEN ? AND ? ORDER BY round_id LIMIT ?",
+        (from_id, to_id, limit),
+    )
+    return [dict(row) for row in cur.fetchall()]
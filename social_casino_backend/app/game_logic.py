@@ -5,6 +5,10 @@ import hashlib
 import uuid
 import math
 
+from typing import Any, Dict, Sequence
+
+from app.hash_chain import HashChain, game_int, verify_segment
+
 class CrashGame:
     """
     Implements a robust and Provably Fair logic for the crash game.
@@ -14,13 +18,23 @@ class CrashGame:
     # The house edge is set to 3%. This means that 3% of the time, the game
     # will result in an instant 1.00x crash. This is a common and fair rate.
     HOUSE_EDGE = 0.03
+    # This client_seed is public and can remain constant for verifiability.
+    CLIENT_SEED = "social-casino-is-awesome-and-fair"
+    # Rounds played on one random server seed before it is rotated.
+    SEED_ROUNDS = 2000
 
-    def __init__(self):
+    def __init__(self, chain_length: int | None = None):
         self.server_seed = ""
         self.hashed_server_seed = ""
         self.nonce = 0
+        # Hash-chain mode: seeds and crash points are precomputed per chain (see app.hash_chain).
+        self.chain_length = chain_length
+        self.chain: HashChain | None = None
+        self.next_chain: HashChain | None = None
         self.rotate_seeds()
         self.start_time: float | None = None # Start time of the current round
+        self.crash_point: float | None = None # Crash point of the running round (server-side only)
+        self.round_id: int | None = None # Id of the current round (ms timestamp of its preparation)
         self.history: list = [] # History of recent rounds
         self.current_countdown = 0
 
@@ -30,7 +44,21 @@ class CrashGame:
         A new seed is used for each batch of games (e.g., every 2000 nonces) to ensure
         long-term unpredictability. The hash is shown to players *before* the round
         so they know the seed is predetermined.
+
+        In hash-chain mode the published hash is the chain commitment, and the
+        next chain (prepared in the background if possible) takes over.
         """
+        if self.chain_length:
+            self.chain = self.next_chain or HashChain.generate(self.chain_length, self.CLIENT_SEED, self.crash_point_from_int)
+            self.next_chain = None
+            self.server_seed = ""
+            self.hashed_server_seed = self.chain.commitment
+            self.nonce = 0
+            print("="*50)
+            print(f"** NEW HASH CHAIN ({len(self.chain)} rounds) **")
+            print(f"Chain Commitment (Public): {self.hashed_server_seed}")
+            print("="*50)
+            return
         self.server_seed = uuid.uuid4().hex
         self.hashed_server_seed = hashlib.sha256(self.server_seed.encode('utf-8')).hexdigest()
         self.nonce = 0
@@ -40,6 +68,15 @@ class CrashGame:
         print(f"Hashed Server Seed (Public): {self.hashed_server_seed}")
         print("="*50)
 
+    def needs_rotation(self) -> bool:
+        """True when the current seed (or hash chain) has been used up."""
+        return self.nonce >= (len(self.chain) if self.chain is not None else self.SEED_ROUNDS)
+
+    def prepare_next_chain(self) -> None:
+        """Precomputes the chain that rotate_seeds switches to; meant to run off the event loop."""
+        if self.chain_length and self.next_chain is None:
+            self.next_chain = HashChain.generate(self.chain_length, self.CLIENT_SEED, self.crash_point_from_int)
+
 
     def _get_game_hash(self) -> hmac.HMAC:
         """
@@ -48,11 +85,23 @@ class CrashGame:
         Because the server_seed is secret until after the round, the outcome cannot be
         predicted or manipulated by the server or the client.
         """
-        # This client_seed is public and can remain constant for verifiability.
-        # Its purpose is to add another layer to the HMAC generation.
-        client_seed = "social-casino-is-awesome-and-fair" # You can keep this or change it
-        message = f"{client_seed}-{self.nonce}".encode('utf-8')
-        return hmac.new(self.server_seed.encode('utf-8'), message, hashlib.sha256)
+        return self.game_hash(self.server_seed, self.nonce)
+
+    @classmethod
+    def game_hash(cls, server_seed: str, nonce: int) -> hmac.HMAC:
+        # The public client_seed adds another layer to the HMAC generation.
+        message = f"{cls.CLIENT_SEED}-{nonce}".encode('utf-8')
+        return hmac.new(server_seed.encode('utf-8'), message, hashlib.sha256)
+
+    @classmethod
+    def crash_point_for_seed(cls, server_seed: str, nonce: int) -> float:
+        """Recomputes a seed-mode round from its revealed server seed and nonce."""
+        return cls.crash_point_from_int(int(cls.game_hash(server_seed, nonce).hexdigest()[:8], 16))
+
+    @classmethod
+    def crash_point_for_chain_seed(cls, seed_hex: str) -> float:
+        """Recomputes a hash-chain round from its revealed seed."""
+        return cls.crash_point_from_int(game_int(bytes.fromhex(seed_hex), cls.CLIENT_SEED.encode()))
 
     def calculate_crash_point(self) -> float:
         """
@@ -68,13 +117,22 @@ class CrashGame:
            This ensures that lower multipliers are significantly more common than high ones.
         """
         self.nonce += 1
+        if self.chain is not None:
+            # Hash-chain mode: the seed of this round is revealed in round_info after the crash,
+            # the crash point was computed together with the chain.
+            self.server_seed = self.chain.seed_hex(self.nonce - 1)
+            return self.chain.crash_point(self.nonce - 1)
+
         game_hmac = self._get_game_hash()
         hex_val = game_hmac.hexdigest()
 
         # Use the first 8 characters (4 bytes -> 32 bits) of the hash.
         # 32 bits provides 4,294,967,296 possible outcomes, which is more than enough for fairness.
-        int_val = int(hex_val[:8], 16)
+        return self.crash_point_from_int(int(hex_val[:8], 16))
 
+    @classmethod
+    def crash_point_from_int(cls, int_val: int) -> float:
+        """Maps the leading 32 bits of a game hash to a crash point (shared by all seed modes)."""
         # Total possible outcomes for a 32-bit integer.
         e = 2**32
 
@@ -82,7 +140,7 @@ class CrashGame:
         # If the generated number is within the lowest `HOUSE_EDGE` percentage of outcomes,
         # the game crashes instantly. This is a more robust and standard way to implement
         # the house edge than using a modulo operator.
-        if int_val < e * self.HOUSE_EDGE:
+        if int_val < e * cls.HOUSE_EDGE:
             return 1.00
 
         # --- Fair Distribution Calculation ---
@@ -90,11 +148,15 @@ class CrashGame:
         # The formula `(1 - HOUSE_EDGE) * e / (e - int_val)` maps the remaining `int_val`
         # to a curve where 1.00x is the minimum and high multipliers are rare.
         # This is a standard and well-regarded formula for crash game fairness.
-        crash_point = ((1 - self.HOUSE_EDGE) * e) / (e - int_val)
+        crash_point = ((1 - cls.HOUSE_EDGE) * e) / (e - int_val)
 
         # Round down to 2 decimal places and ensure the result is never less than 1.00.
         return max(1.00, math.floor(crash_point * 100) / 100)
 
+    @classmethod
+    def verify_chain_segment(cls, seeds_hex: Sequence[str], previous: str | None = None) -> Dict[str, Any]:
+        """Verifies revealed hash-chain seeds and recomputes their crash points."""
+        return verify_segment(seeds_hex, cls.CLIENT_SEED, cls.crash_point_from_int, previous)
 
     @classmethod
     def get_multiplier_from_duration(cls, duration: float) -> float:
@@ -111,4 +173,24 @@ class CrashGame:
         if multiplier < 1.0:
             return 0.0
         # This is the inverse function of get_multiplier_from_duration.
-        return math.log(multiplier) / 0.06
\ No newline at end of file
+        return math.log(multiplier) / 0.06
+
+class RoundState:
+    """
+    Mirror of the current round as seen by a process that holds WebSocket connections.
+    Filled from round loop events (see app.round_bus), so it works the same whether
+    the CrashGame loop runs in this process or in another one.
+    crash_point is server-side only: it is used to reject cashouts that arrive after
+    the crash but before the round_end event, and is never sent to clients.
+    """
+
+    def __init__(self):
+        self.start_time: float | None = None
+        self.crash_point: float | None = None
+        self.round_id: int | None = None
+        self.nonce = 0
+        self.hashed_server_seed = ""
+        self.history: list = []
+        self.current_countdown = 0
+        # ставки закрыты с момента round_start (ещё до start_time: он ставится после drain)
+        self.bets_closed = False
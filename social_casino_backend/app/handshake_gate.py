@@ -0,0 +1,127 @@
+# social_casino_backend/app/handshake_gate.py
+#
+# Допуск рукопожатий WebSocket. После деплоя тысячи клиентов переподключаются
+# одновременно; проверка initData и апсерт юзера идут не больше чем по
+# HANDSHAKE_CONCURRENCY за раз, остальные ждут в очереди. Если очередь длиннее
+# HANDSHAKE_QUEUE_MAX или ожидание дольше HANDSHAKE_QUEUE_TIMEOUT — соединение
+# сразу закрывается кодом 1013 (try again later), клиент переподключится позже.
+# Раунд и countdown на том же event loop не ждут, пока разберётся вся толпа.
+
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+HANDSHAKE_CONCURRENCY = int(os.getenv("HANDSHAKE_CONCURRENCY", "64"))
+HANDSHAKE_QUEUE_MAX = int(os.getenv("HANDSHAKE_QUEUE_MAX", "2000"))
+HANDSHAKE_QUEUE_TIMEOUT = float(os.getenv("HANDSHAKE_QUEUE_TIMEOUT", "5"))
+# сколько ждать первого сообщения с initData после accept
+HANDSHAKE_RECV_TIMEOUT = float(os.getenv("HANDSHAKE_RECV_TIMEOUT", "10"))
+
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class HandshakeRejected(Exception):
+    """Raised when the handshake queue is full or the wait for a slot timed out."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Latency:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": (self.total / self.count * 1000) if self.count else None,
+            "max_ms": self.max * 1000,
+        }
+
+
+class HandshakeGate:
+    """Concurrency limit with a bounded wait queue for the handshake stage."""
+
+    def __init__(self, concurrency: int = HANDSHAKE_CONCURRENCY, queue_max: int = HANDSHAKE_QUEUE_MAX,
+                 queue_timeout: float = HANDSHAKE_QUEUE_TIMEOUT):
+        self.concurrency = concurrency
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        self.queue_wait = _Latency()
+        self.stage_latency = _Latency()
+        self.handshake_latency = _Latency()
+
+    def overloaded(self) -> bool:
+        """True when a new connection would not fit into the queue; count it as rejected."""
+        if self.waiting < self.queue_max:
+            return False
+        self._reject("queue_full")
+        return True
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.overloaded():
+            raise HandshakeRejected("queue_full")
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+            raise HandshakeRejected("queue_timeout")
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.queue_wait.add(started - queued_at)
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            self.stage_latency.add(time.perf_counter() - started)
+
+    def observe(self, seconds: float) -> None:
+        """Records the full accept-to-connected time of a successful handshake."""
+        self.handshake_latency.add(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_max": self.queue_max,
+            "queue_timeout": self.queue_timeout,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait": self.queue_wait.as_dict(),
+            "stage_latency": self.stage_latency.as_dict(),
+            "handshake_latency": self.handshake_latency.as_dict(),
+        }
+
+
+handshake_gate = HandshakeGate()
@@ -0,0 +1,104 @@
+# social_casino_backend/app/hash_chain.py
+#
+# Provably fair в режиме цепочки хешей. Цепочка строится от случайного
+# последнего сида назад: s[k-1] = sha256(s[k]); раунды идут от s[1] к s[N],
+# а заранее публикуется только commitment = s[0]. Раскрытый сид раунда
+# ничего не говорит о следующем (это прообраз), но любой может проверить,
+# что sha256(сид) равен сиду предыдущего раунда — и так до commitment.
+#
+# Цепочка и все её crash point считаются заранее (в фоне, вне event loop) и
+# хранятся плотно: сиды одним bytes по 32 байта, множители — array('d').
+# Старт раунда — просто чтение по индексу, без крипты.
+#
+# Множитель раунда: первые 32 бита HMAC-SHA256(key=сид, msg=client_seed),
+# дальше та же формула, что и в CrashGame.calculate_crash_point.
+
+import os
+import hmac
+import hashlib
+from array import array
+from typing import Any, Callable, Dict, Optional, Sequence
+
+CRASH_HASH_CHAIN = os.getenv("CRASH_HASH_CHAIN", "0") == "1"
+CRASH_CHAIN_LENGTH = int(os.getenv("CRASH_CHAIN_LENGTH", "10000"))
+
+SEED_BYTES = 32
+
+
+def game_int(seed: bytes, client_seed: bytes) -> int:
+    """Leading 32 bits of the round hash for a chain seed."""
+    return int.from_bytes(hmac.digest(seed, client_seed, "sha256")[:4], "big")
+
+
+class HashChain:
+    """Precomputed chain of round seeds (in play order) with their crash points."""
+
+    __slots__ = ("seeds", "crash_points", "commitment")
+
+    def __init__(self, seeds: bytes, crash_points: array, commitment: str):
+        self.seeds = seeds
+        self.crash_points = crash_points
+        self.commitment = commitment
+
+    @classmethod
+    def generate(cls, length: int, client_seed: str, crash_point_from_int: Callable[[int], float],
+                 terminal: Optional[bytes] = None) -> "HashChain":
+        h = terminal or os.urandom(SEED_BYTES)
+        chain = [h]
+        for _ in range(length):
+            h = hashlib.sha256(h).digest()
+            chain.append(h)
+        # chain[0] — commitment, дальше сиды в порядке раундов
+        chain.reverse()
+        key = client_seed.encode()
+        crash_points = array("d", (crash_point_from_int(game_int(s, key)) for s in chain[1:]))
+        return cls(b"".join(chain[1:]), crash_points, chain[0].hex())
+
+    def __len__(self) -> int:
+        return len(self.crash_points)
+
+    def seed_hex(self, index: int) -> str:
+        return self.seeds[index * SEED_BYTES:(index + 1) * SEED_BYTES].hex()
+
+    def crash_point(self, index: int) -> float:
+        return self.crash_points[index]
+
+
+def verify_segment(seeds_hex: Sequence[str], client_seed: str, crash_point_from_int: Callable[[int], float],
+                   previous: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Checks consecutive revealed seeds (in play order): each must hash to the one before it,
+    and the first to `previous` (the chain commitment or the seed revealed just before the segment).
+    Returns the crash points recomputed from the seeds and the index of the first broken link,
+    or {"ok": False, "error": ...} if the input is malformed.
+    """
+    # мусор на входе — ответ с ошибкой, а не исключение (эндпоинт отдал бы 500)
+    if not all(isinstance(seed_hex, str) for seed_hex in seeds_hex):
+        return {"ok": False, "error": "seeds must be hex strings"}
+    prev = None
+    if previous:
+        try:
+            prev = bytes.fromhex(previous)
+        except (TypeError, ValueError):
+            prev = b""
+        if len(prev) != SEED_BYTES:
+            return {"ok": False, "error": f"previous must be a {SEED_BYTES}-byte hex string"}
+    key = client_seed.encode()
+    crash_points = []
+    first_invalid = None
+    for i, seed_hex in enumerate(seeds_hex):
+        try:
+            seed = bytes.fromhex(seed_hex)
+        except ValueError:
+            seed = b""
+        if len(seed) != SEED_BYTES or (prev is not None and hashlib.sha256(seed).digest() != prev):
+            first_invalid = i
+            break
+        crash_points.append(crash_point_from_int(game_int(seed, key)))
+        prev = seed
+    return {
+        "ok": first_invalid is None,
+        "checked": len(crash_points),
+        "first_invalid": first_invalid,
+        "crash_points": crash_points,
+    }
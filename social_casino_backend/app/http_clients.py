@@ -0,0 +1,124 @@
+# social_casino_backend/app/http_clients.py
+#
+# Общие httpx-клиенты процесса, по одному на апстрим (ClickHouse, Telegram Bot API).
+# Раньше каждый вызов открывал свой AsyncClient и платил за TCP (и TLS для
+# api.telegram.org) заново. Здесь — пул соединений с keep-alive, лимиты и
+# таймауты на апстрим, HTTP/2 если установлен пакет h2, и счётчики латентности.
+# Клиенты создаются лениво при первом запросе и закрываются на shutdown.
+
+import os
+import time
+from collections import deque
+from typing import Any, Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CLICKHOUSE_MAX_CONNECTIONS = int(os.getenv("HTTP_CLICKHOUSE_MAX_CONNECTIONS", "8"))
+HTTP_TELEGRAM_MAX_CONNECTIONS = int(os.getenv("HTTP_TELEGRAM_MAX_CONNECTIONS", "16"))
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "1") == "1"
+
+# сколько последних замеров держать для перцентилей
+LATENCY_WINDOW = 1024
+
+
+class _UpstreamStats:
+    __slots__ = ("requests", "errors", "total", "max", "recent")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, elapsed: float, failed: bool) -> None:
+        self.requests += 1
+        self.errors += int(failed)
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append(elapsed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+
+        def pct(p: float) -> float | None:
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))] * 1000, 2) if recent else None
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.requests * 1000, 2) if self.requests else None,
+            "p50_ms": pct(0.5),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class HttpClients:
+    """Registry of long-lived pooled AsyncClients keyed by upstream name."""
+
+    def __init__(self):
+        self._configs: dict[str, dict] = {}
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._stats: dict[str, _UpstreamStats] = {}
+
+    def register(self, name: str, *, timeout: float, max_connections: int, http2: bool = False) -> None:
+        self._configs[name] = {
+            "timeout": timeout,
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            "http2": http2 and HTTP_HTTP2 and HTTP2_AVAILABLE,
+        }
+        self._stats[name] = _UpstreamStats()
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = httpx.AsyncClient(**self._configs[name])
+        return client
+
+    async def post(self, name: str, url: str, **kwargs) -> httpx.Response:
+        """POST through the upstream's pooled client; a per-call timeout may be passed as usual."""
+        started = time.perf_counter()
+        failed = True
+        try:
+            resp = await self.client(name).post(url, **kwargs)
+            failed = resp.status_code >= 500
+            return resp
+        finally:
+            self._stats[name].observe(time.perf_counter() - started, failed)
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2_available": HTTP2_AVAILABLE,
+            "upstreams": {
+                name: {
+                    "open": name in self._clients,
+                    "http2": self._configs[name]["http2"],
+                    "max_connections": self._configs[name]["limits"].max_connections,
+                    **stats.snapshot(),
+                }
+                for name, stats in self._stats.items()
+            },
+        }
+
+
+http_clients = HttpClients()
+http_clients.register("clickhouse", timeout=10.0, max_connections=HTTP_CLICKHOUSE_MAX_CONNECTIONS)
+# h2 по TLS только к Telegram: ClickHouse слушает обычный HTTP/1.1
+http_clients.register("telegram", timeout=20.0, max_connections=HTTP_TELEGRAM_MAX_CONNECTIONS, http2=True)
@@ -0,0 +1,177 @@
+# social_casino_backend/app/init_data.py
+#
+# Проверка Telegram WebApp initData. Всё, что зависит только от токена бота,
+# считается один раз при создании валидатора: секрет HMAC (WebAppData) и
+# Ed25519-ключ Telegram для подписи third-party. Строка разбирается за один
+# проход, а уже проверенные initData лежат в ограниченном TTL-кэше (не дольше,
+# чем их auth_date остаётся валидным) — шторм переподключений не гоняет крипту заново.
+# Ed25519 (самое дорогое) в avalidate уходит в пул потоков: PyNaCl отпускает GIL,
+# и event loop с раундом не ждёт проверку подписи.
+
+import os
+import time
+import json
+import hmac
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+try:
+    from nacl.signing import VerifyKey
+    from nacl.exceptions import BadSignatureError
+except ImportError:  # pragma: no cover
+    VerifyKey = None
+    BadSignatureError = Exception
+
+from app.ttl_cache import TTLCache
+
+TMA_PUBLIC_KEY_HEX_PROD = "e7bf03a2fa4602af4580703d88dda5bb59f32ed8b02a56c187fe7d34caed242d"
+
+# initData старше суток не принимаем; чуть "из будущего" — допускаем рассинхрон часов
+AUTH_MAX_AGE = 86400
+AUTH_MAX_SKEW = 60
+
+INIT_DATA_CACHE_TTL = float(os.getenv("INIT_DATA_CACHE_TTL", "3600"))
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "50000"))
+INIT_DATA_VERIFY_WORKERS = int(os.getenv("INIT_DATA_VERIFY_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+ValidationResult = Tuple[bool, Optional[Dict[str, Any]], str]
+
+
+class ParsedInitData:
+    """initData split once: the data-check string plus the fields validation needs."""
+
+    __slots__ = ("hash", "signature", "check_string", "auth_date", "user_raw")
+
+    def __init__(self, init_data: str):
+        pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+        self.hash = (pairs.pop("hash", None) or "").lower()
+        self.signature = pairs.pop("signature", None)
+        self.check_string = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
+        self.auth_date = pairs.get("auth_date", "0")
+        self.user_raw = pairs.get("user", "{}")
+
+
+def _b64url_decode_with_padding(s: str) -> bytes:
+    pad = (-len(s)) % 4
+    if pad:
+        s = s + ("=" * pad)
+    return base64.urlsafe_b64decode(s.encode())
+
+
+class InitDataValidator:
+    """Validates initData by bot-token HMAC, falling back to Telegram's Ed25519 signature."""
+
+    def __init__(self, bot_token: str, bot_id: Optional[int], public_key_hex: str = TMA_PUBLIC_KEY_HEX_PROD):
+        self._secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        self._signature_prefix = f"{bot_id}:WebAppData\n" if bot_id else None
+        self._verify_key = VerifyKey(bytes.fromhex(public_key_hex)) if VerifyKey is not None else None
+        self._cache = TTLCache(ttl=INIT_DATA_CACHE_TTL, max_size=INIT_DATA_CACHE_SIZE)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.offloaded = 0
+
+    @staticmethod
+    def _cache_key(init_data: str) -> bytes:
+        # ключ — вся строка целиком: одного hash мало, его можно приклеить к чужим данным
+        return hashlib.sha256(init_data.encode()).digest()
+
+    def _cached(self, key: bytes) -> Optional[ValidationResult]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            user_obj, expires_at = cached
+            if time.time() <= expires_at:
+                return True, user_obj, "ok_cached"
+        return None
+
+    def _remember(self, key: bytes, parsed: ParsedInitData, result: ValidationResult) -> ValidationResult:
+        ok, user_obj, _ = result
+        if ok:
+            expires_at = int(parsed.auth_date) + AUTH_MAX_AGE
+            self._cache.set(key, (user_obj, expires_at), ttl=expires_at - time.time())
+        return result
+
+    def validate(self, init_data: str) -> ValidationResult:
+        key = self._cache_key(init_data)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        parsed = ParsedInitData(init_data)
+        result = self._validate_hash(parsed)
+        if not result[0] and self._signature_prefix:
+            result = self._validate_signature(parsed)
+        return self._remember(key, parsed, result)
+
+    async def avalidate(self, init_data: str) -> ValidationResult:
+        """Same as validate, but the Ed25519 check runs on the verification thread pool."""
+        key = self._cache_key(init_data)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        parsed = ParsedInitData(init_data)
+        result = self._validate_hash(parsed)
+        if not result[0] and self._signature_prefix:
+            if parsed.signature and self._verify_key is not None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=INIT_DATA_VERIFY_WORKERS, thread_name_prefix="initdata")
+                self.offloaded += 1
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, self._validate_signature, parsed)
+            else:
+                result = self._validate_signature(parsed)
+        return self._remember(key, parsed, result)
+
+    def _validate_hash(self, parsed: ParsedInitData) -> ValidationResult:
+        if not parsed.hash:
+            return False, None, "missing_hash"
+        calc_hash = hmac.new(self._secret_key, parsed.check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(calc_hash, parsed.hash):
+            return False, None, "bad_hash"
+        return self._check_claims(parsed, "ok_hash")
+
+    def _validate_signature(self, parsed: ParsedInitData) -> ValidationResult:
+        if not parsed.signature:
+            return False, None, "missing_signature"
+        if self._verify_key is None:
+            return False, None, "signature_unsupported"
+        try:
+            sig = _b64url_decode_with_padding(parsed.signature)
+        except Exception as e:
+            return False, None, f"bad_signature_b64:{e}"
+        try:
+            self._verify_key.verify((self._signature_prefix + parsed.check_string).encode(), sig)
+        except BadSignatureError:
+            return False, None, "bad_signature"
+        return self._check_claims(parsed, "ok_signature")
+
+    @staticmethod
+    def _check_claims(parsed: ParsedInitData, ok_reason: str) -> ValidationResult:
+        try:
+            auth_date = int(parsed.auth_date)
+        except ValueError:
+            return False, None, "bad_auth_date"
+        if not (-AUTH_MAX_SKEW <= (int(time.time()) - auth_date) <= AUTH_MAX_AGE):
+            return False, None, "auth_date_too_old"
+        try:
+            user_obj = json.loads(parsed.user_raw)
+        except Exception:
+            return False, None, "bad_user_json"
+        if not user_obj or "id" not in user_obj:
+            return False, None, "missing_user"
+        return True, user_obj, ok_reason
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "signature_supported": self._verify_key is not None,
+            "verify_workers": INIT_DATA_VERIFY_WORKERS,
+            "signature_offloaded": self.offloaded,
+            "cache": self._cache.stats(),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,110 @@
+# social_casino_backend/app/live_metrics.py
+#
+# Операционные метрики в памяти процесса: те же события, что уходят в spins
+# через log_spin (ставки, выигрыши, проигрыши, депозиты), складываются в
+# счётчики за всё время и в окна по минутам (последний час) и по часам
+# (последние сутки). Дашборду не нужен ClickHouse, чтобы обновляться раз в секунду.
+# Счётчики свои у каждого процесса: при нескольких воркерах дашборд суммирует их сам.
+
+import os
+import time
+from collections import deque
+from typing import Any, Dict
+
+LIVE_METRICS_MINUTES = int(os.getenv("LIVE_METRICS_MINUTES", "60"))
+LIVE_METRICS_HOURS = int(os.getenv("LIVE_METRICS_HOURS", "24"))
+
+
+class _Bucket:
+    __slots__ = ("deposit_sum", "deposit_cnt", "bet_success_cnt", "bet_success_sum",
+                 "bet_fail_cnt", "win_sum", "win_cnt", "loss_sum", "loss_cnt")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def add(self, event_type: str, amount: float) -> None:
+        if event_type == "bet_success":
+            self.bet_success_cnt += 1
+            self.bet_success_sum += amount
+        elif event_type == "win":
+            self.win_cnt += 1
+            self.win_sum += amount
+        elif event_type == "loss":
+            self.loss_cnt += 1
+            self.loss_sum += amount
+        elif event_type == "bet_fail":
+            self.bet_fail_cnt += 1
+        elif event_type == "deposit":
+            self.deposit_cnt += 1
+            self.deposit_sum += amount
+
+    def merge(self, other: "_Bucket") -> None:
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        # как в /admin/metrics/summary
+        data["net"] = float(self.win_sum - self.deposit_sum)
+        return data
+
+
+class _Window:
+    """Ring of fixed-width time buckets."""
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.buckets: deque[tuple[int, _Bucket]] = deque(maxlen=size)
+
+    def current(self, now: float) -> _Bucket:
+        start = int(now) // self.width * self.width
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append((start, _Bucket()))
+        return self.buckets[-1][1]
+
+    def total(self, now: float) -> _Bucket:
+        horizon = int(now) // self.width * self.width - self.width * (self.buckets.maxlen - 1)
+        total = _Bucket()
+        for start, bucket in self.buckets:
+            if start >= horizon:
+                total.merge(bucket)
+        return total
+
+    def series(self) -> list[Dict[str, Any]]:
+        return [{"start": start, **bucket.as_dict()} for start, bucket in self.buckets]
+
+
+class LiveMetrics:
+    """Rolling per-process counters of spin events (bets, wins, losses, deposits)."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.totals = _Bucket()
+        self.minutes = _Window(60, LIVE_METRICS_MINUTES)
+        self.hours = _Window(3600, LIVE_METRICS_HOURS)
+
+    def record(self, event_type: str, amount: float) -> None:
+        now = time.time()
+        self.totals.add(event_type, amount)
+        self.minutes.current(now).add(event_type, amount)
+        self.hours.current(now).add(event_type, amount)
+
+    def snapshot(self, series: bool = False) -> Dict[str, Any]:
+        now = time.time()
+        data: Dict[str, Any] = {
+            "pid": os.getpid(),
+            "ts": now,
+            "uptime": now - self.started_at,
+            "totals": self.totals.as_dict(),
+            "current_minute": self.minutes.current(now).as_dict(),
+            f"last_{LIVE_METRICS_MINUTES}m": self.minutes.total(now).as_dict(),
+            f"last_{LIVE_METRICS_HOURS}h": self.hours.total(now).as_dict(),
+        }
+        if series:
+            data["by_minute"] = self.minutes.series()
+            data["by_hour"] = self.hours.series()
+        return data
+
+
+live_metrics = LiveMetrics()
@@ -3,32 +3,40 @@
 import os
 import asyncio
 import time
-import hashlib
-import hmac
 import json
-import base64
-from typing import Tuple, Optional, Dict, Any
-from urllib.parse import parse_qsl, unquote
+from typing import Optional, Dict, Any
 
-import httpx
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import logging
 from datetime import datetime, timedelta
 
-from app.clickhouse_logger import log_event, ensure_clickhouse, ch_status, log_spin, _auth_tuple, CLICKHOUSE_DB, CLICKHOUSE_HOST, CLICKHOUSE_SPINS_TABLE
+from app.clickhouse_logger import log_event, ensure_clickhouse, ch_status, log_spin, ch_writer, close_clickhouse, _auth_tuple, CLICKHOUSE_DB, CLICKHOUSE_HOST, CLICKHOUSE_SPINS_HOURLY_TABLE, CLICKHOUSE_SPINS_DAILY_TABLE
 from app.migrations_runner import run_migrations, migrations_status
-from app.ws_manager import WebSocketManager
-from app.game_logic import CrashGame
-from app.db import init_db, get_or_create_user, update_balance, get_balance
+from app.ws_manager import WebSocketManager, HISTORY_SIZE
+from app.ws_codec import negotiate_encoding
+from app.game_logic import CrashGame, RoundState
+from app.round_bus import create_bus
+from app.db import LEDGER_DEPOSIT
+from app.storage import storage
+from app.bet_intake import bet_intake
+from app.balance_cache import balance_cache
+from app.http_clients import http_clients
+from app.ttl_cache import TTLCache
+from app.ch_backfill import ch_backfill
+from app.live_metrics import live_metrics
+from app.init_data import InitDataValidator
+from app.session_tokens import SessionTokens
+from app.hash_chain import CRASH_HASH_CHAIN, CRASH_CHAIN_LENGTH
+from app.round_history import to_round_info, verify_rounds
+from app.handshake_gate import handshake_gate, HandshakeRejected, CLOSE_TRY_AGAIN_LATER, HANDSHAKE_RECV_TIMEOUT
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 if not BOT_TOKEN:
     raise RuntimeError("TELEGRAM_BOT_TOKEN не задан в окружении контейнера.")
 BOT_ID = int(BOT_TOKEN.split(":", 1)[0])
 
-TMA_PUBLIC_KEY_HEX_PROD = "e7bf03a2fa4602af4580703d88dda5bb59f32ed8b02a56c187fe7d34caed242d"
-
 logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI()
@@ -40,180 +48,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-game = CrashGame()
-manager = WebSocketManager(game)
-
-def _sorted_pairs_without(init_data: str, *exclude: str) -> tuple[str, Dict[str, str]]:
-    pairs = dict(parse_qsl(init_data, keep_blank_values=True))
-    for k in exclude:
-        pairs.pop(k, None)
-    check_string = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
-    return check_string, pairs
-
-def _validate_hash(init_data: str, bot_token: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
-    all_pairs = dict(parse_qsl(init_data, keep_blank_values=True))
-    given_hash = (all_pairs.get("hash") or "").lower()
-    if not given_hash:
-        return False, None, "missing_hash"
-
-    check_string, data = _sorted_pairs_without(init_data, "hash", "signature")
-
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-    calc_hash = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
-    if calc_hash != given_hash:
-        return False, None, "bad_hash"
-
-    try:
-        auth_date = int(data.get("auth_date", "0"))
-    except ValueError:
-        return False, None, "bad_auth_date"
-    now = int(time.time())
-    if not (-60 <= (now - auth_date) <= 86400):
-        return False, None, "auth_date_too_old"
-
-    try:
-        user_obj = json.loads(data.get("user", "{}"))
-    except Exception:
-        return False, None, "bad_user_json"
-    if not user_obj or "id" not in user_obj:
-        return False, None, "missing_user"
-    return True, user_obj, "ok_hash"
-
-def _b64url_decode_with_padding(s: str) -> bytes:
-    pad = (-len(s)) % 4
-    if pad:
-        s = s + ("=" * pad)
-    return base64.urlsafe_b64decode(s.encode())
-
-def _validate_signature(init_data: str, bot_id: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
-    from nacl.signing import VerifyKey
-    from nacl.exceptions import BadSignatureError
-
-    all_pairs = dict(parse_qsl(init_data, keep_blank_values=True))
-    signature_b64 = all_pairs.get("signature")
-    if not signature_b64:
-        return False, None, "missing_signature"
-
-    check_string, data = _sorted_pairs_without(init_data, "hash", "signature")
-    message = f"{bot_id}:WebAppData\n{check_string}".encode()
-
-    pubkey = bytes.fromhex(TMA_PUBLIC_KEY_HEX_PROD)
-    verify_key = VerifyKey(pubkey)
+# game — авторитетный раунд, крутится только в процессе-лидере шины;
+# round_state — его зеркало в каждом процессе с сокетами
+game = CrashGame(chain_length=CRASH_CHAIN_LENGTH if CRASH_HASH_CHAIN else None)
+round_state = RoundState()
+manager = WebSocketManager(round_state)
+bus = create_bus()
+bus.subscribe(manager.apply_round_event)
+# секрет HMAC и ключ Ed25519 считаются один раз, проверенные initData кэшируются
+init_data_validator = InitDataValidator(BOT_TOKEN, BOT_ID)
+session_tokens = SessionTokens(BOT_TOKEN)
+
+def round_state_event() -> Dict[str, Any]:
+    """Current authoritative round state, sent to processes that (re)subscribe to the bus."""
+    return {
+        "history": list(game.history),
+        "hashed_server_seed": game.hashed_server_seed,
+        "countdown": game.current_countdown,
+        "start_time": game.start_time,
+        "crash_point": game.crash_point,
+        "round_id": game.round_id,
+        "nonce": game.nonce,
+    }
 
+async def _reveal_seed():
+    # отыгранный сид больше не секрет: проставляем его в историю раундов (в режиме цепочки сиды раскрыты сразу)
+    if game.chain_length or not game.server_seed:
+        return
     try:
-        sig = _b64url_decode_with_padding(signature_b64)
+        await storage.reveal_seed(game.hashed_server_seed, game.server_seed)
     except Exception as e:
-        return False, None, f"bad_signature_b64:{e}"
-
-    try:
-        verify_key.verify(message, sig)
-    except BadSignatureError:
-        return False, None, "bad_signature"
-
-    try:
-        auth_date = int(data.get("auth_date", "0"))
-    except ValueError:
-        return False, None, "bad_auth_date"
-    now = int(time.time())
-    if not (-60 <= (now - auth_date) <= 86400):
-        return False, None, "auth_date_too_old"
-
-    try:
-        user_obj = json.loads(data.get("user", "{}"))
-    except Exception:
-        return False, None, "bad_user_json"
-    if not user_obj or "id" not in user_obj:
-        return False, None, "missing_user"
-
-    return True, user_obj, "ok_signature"
-
-def validate_init_data(init_data: str, bot_token: str, bot_id: Optional[str]) -> Tuple[bool, Optional[Dict[str, Any]], str]:
-    ok, user, reason = _validate_hash(init_data, bot_token)
-    if ok:
-        return ok, user, reason
-    if bot_id:
-        return _validate_signature(init_data, bot_id)
-    return False, None, reason
+        logger.warning(f"[ROUNDS] seed reveal failed: {e}")
 
 async def game_loop():
+    # после смены лидера продолжаем историю, которую видели клиенты
+    if not game.history and round_state.history:
+        game.history = list(round_state.history)
+    await bus.publish({"event": "state", **round_state_event()})
+    chain_task: Optional[asyncio.Task] = None
+
     while True:
         print("\n--- New Round: Preparation ---")
         game.start_time = None
-        manager.prepare_new_round()
+        game.crash_point = None
+        game.round_id = int(time.time() * 1000)
+        await bus.publish({"event": "prepare", "round_id": game.round_id})
 
-        if game.nonce >= 2000:
+        if game.needs_rotation():
+            await _reveal_seed()
             game.rotate_seeds()
+            await bus.publish({"event": "seed", "hashed_server_seed": game.hashed_server_seed})
+        # следующую цепочку хешей считаем заранее в потоке, ротация её только подхватывает
+        if game.chain_length and game.next_chain is None and (chain_task is None or chain_task.done()):
+            chain_task = asyncio.create_task(asyncio.to_thread(game.prepare_next_chain))
 
         print("--- Waiting for bets... ---")
-        history_data = [{"multiplier": item["multiplier"]} for item in game.history]
         wait_time = 10
         for i in range(wait_time, 0, -1):
             game.current_countdown = i
-            await manager.broadcast({"type": "waiting", "data": {"countdown": i, "history": history_data, "hashed_server_seed": game.hashed_server_seed}})
+            await bus.publish({"event": "countdown", "value": i})
             await asyncio.sleep(1)
         game.current_countdown = 0
 
-        await manager.activate_auto_bets()
-
         crash_point = game.calculate_crash_point()
+        game.crash_point = crash_point
         game.start_time = time.time()
-        manager.activate_bets()
         print(f"--- Round Started! Nonce: {game.nonce}, Crashing at {crash_point:.2f}x ---")
 
-        await manager.broadcast({"type": "round_start", "data": {"startTime": game.start_time}})
+        # crash_point уходит только процессам-ретрансляторам, клиентам — нет
+        await bus.publish({"event": "round_start", "start_time": game.start_time, "crash_point": crash_point, "nonce": game.nonce})
 
         crash_duration = game.get_duration_from_multiplier(crash_point)
         await asyncio.sleep(crash_duration)
 
         print(f"--- Crashed at {crash_point:.2f}x ---")
-        round_info = {"multiplier": crash_point, "server_seed": game.server_seed, "hashed_server_seed": game.hashed_server_seed, "nonce": game.nonce}
+        round_info = {
+            "multiplier": crash_point, "server_seed": game.server_seed, "hashed_server_seed": game.hashed_server_seed,
+            "nonce": game.nonce, "round_id": game.round_id, "mode": "chain" if game.chain is not None else "seed",
+            "start_time": game.start_time,
+        }
         game.history.insert(0, round_info)
-        if len(game.history) > 30:
+        if len(game.history) > HISTORY_SIZE:
             game.history.pop()
 
-        history_data_new = [{"multiplier": item["multiplier"]} for item in game.history]
-        await manager.broadcast({"type": "round_end", "data": {"crashPoint": crash_point, "history": history_data_new, "roundInfo": round_info}})
-        await manager.resolve_bets(crash_point)
+        await bus.publish({"event": "round_end", "round_info": round_info})
 
         print("--- Resolving bets and waiting for next round... ---")
         await asyncio.sleep(5)
 
+async def _validate_init_data(init_data: str):
+    # через допуск рукопожатий: проверка initData (Ed25519 — в пуле потоков, не в event loop)
+    # и апсерт юзера занимают один слот
+    async with handshake_gate.slot():
+        ok, user_obj, reason = await init_data_validator.avalidate(init_data)
+        if ok and user_obj:
+            await storage.get_or_create_user(int(user_obj["id"]), user_obj.get("username"))
+        return ok, user_obj, reason
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    accepted_at = time.perf_counter()
+
+    # толпа переподключений: не берём в очередь рукопожатий больше, чем она вмещает
+    if handshake_gate.overloaded():
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Server busy")
+        return
 
     init_data_str: Optional[str] = None
+    busy: Optional[str] = None
     user_obj: Optional[Dict[str, Any]] = None
+    session_claims: Optional[Dict[str, Any]] = None
+    # кодировка фреймов сервер -> клиент: ?enc=msgpack или "encoding" в handshake
+    requested_encoding: Optional[str] = websocket.query_params.get("enc")
 
     try:
         q_init = websocket.query_params.get("initData")
         if q_init:
-            ok, user_obj, reason = validate_init_data(q_init, BOT_TOKEN, BOT_ID)
+            ok, user_obj, reason = await _validate_init_data(q_init)
             logger.info(f"WS query initData validation: {reason}")
             if ok and user_obj:
                 init_data_str = q_init
+    except HandshakeRejected as e:
+        busy = e.reason
     except Exception as e:
         logger.warning(f"WS query parse error: {e}")
 
-    if not init_data_str:
+    if not init_data_str and busy is None:
         try:
-            first = await asyncio.wait_for(websocket.receive_text(), timeout=10.0)
+            first = await asyncio.wait_for(websocket.receive_text(), timeout=HANDSHAKE_RECV_TIMEOUT)
             try:
                 payload = json.loads(first) if first else {}
             except json.JSONDecodeError:
                 payload = {}
-            if payload.get("action") == "handshake" and "init_data" in payload:
-                candidate = payload["init_data"]
-                ok, user_obj, reason = validate_init_data(candidate, BOT_TOKEN, BOT_ID)
-                logger.info(f"WS handshake validation: {reason}")
-                if ok and user_obj:
-                    init_data_str = candidate
+            if payload.get("action") == "handshake":
+                requested_encoding = payload.get("encoding") or requested_encoding
+                # реконнект: токен сессии вместо повторной проверки initData
+                if payload.get("session_token"):
+                    ok, claims, reason = session_tokens.verify(payload["session_token"])
+                    logger.info(f"WS session resume: {reason}")
+                    if ok:
+                        session_claims = claims
+                        user_obj = {"id": claims["id"], "username": claims.get("username")}
+                if session_claims is None and "init_data" in payload:
+                    candidate = payload["init_data"]
+                    ok, user_obj, reason = await _validate_init_data(candidate)
+                    logger.info(f"WS handshake validation: {reason}")
+                    if ok and user_obj:
+                        init_data_str = candidate
+        except HandshakeRejected as e:
+            busy = e.reason
         except asyncio.TimeoutError:
             logger.warning("WS handshake timeout")
         except Exception as e:
             logger.exception(f"WS handshake receive error: {e}")
 
-    if not init_data_str or not user_obj:
+    if busy is not None:
+        logger.warning(f"WS handshake rejected: {busy}")
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Server busy")
+        return
+
+    if not (init_data_str or session_claims) or not user_obj:
         logger.warning("Invalid initData. Closing connection.")
         await websocket.close(code=1008, reason="Invalid credentials")
         return
@@ -221,29 +216,25 @@ async def websocket_endpoint(websocket: WebSocket):
     user_id = str(user_obj["id"])
     username = user_obj.get("username")
 
-    try:
-        parsed_qsl = dict(parse_qsl(unquote(init_data_str)))
-        user_source = json.loads(parsed_qsl.get("user", "{}")).get("start_param")
-    except Exception:
-        user_source = None
+    if session_claims is None:
+        user_source = user_obj.get("start_param")
 
-    try:
-        asyncio.create_task(log_event(event_type="user_connect", user_id=int(user_id), payload={"username": username}, user_source=user_source))
-    except Exception:
-        pass
+        try:
+            asyncio.create_task(log_event(event_type="user_connect", user_id=int(user_id), payload={"username": username}, user_source=user_source))
+        except Exception:
+            pass
 
-    get_or_create_user(int(user_id), username)
+    encoding = negotiate_encoding(requested_encoding)
+    await manager.connect(websocket, user_id, encoding)
+    handshake_gate.observe(time.perf_counter() - accepted_at)
+    logger.info(f"User {user_id} ({username}) {'resumed' if session_claims else 'connected'}, encoding={encoding}.")
 
-    await manager.connect(websocket, user_id)
-    logger.info(f"User {user_id} ({username}) connected.")
+    # токен для следующего переподключения; у продлённой сессии сохраняется жёсткий предел
+    token, expires_at = session_tokens.issue(int(user_id), username, session_claims.get("max") if session_claims else None)
+    await manager.send_to_user(user_id, {"type": "session", "data": {"token": token, "expires_at": expires_at}})
 
     try:
-        history_data = [{"multiplier": item["multiplier"]} for item in game.history]
-        if game.start_time:
-            initial_message = {"type": "round_start", "data": {"startTime": game.start_time, "history": history_data, "is_initial_sync": True}}
-        else:
-            initial_message = {"type": "waiting", "data": {"countdown": game.current_countdown, "history": history_data, "hashed_server_seed": game.hashed_server_seed, "is_initial_sync": True}}
-        await websocket.send_json(initial_message)
+        await manager.send_to_user(user_id, manager.snapshot())
 
         while True:
             data = await websocket.receive_json()
@@ -261,12 +252,15 @@ async def websocket_endpoint(websocket: WebSocket):
             elif msg_type == "cash_out":
                 logger.info(f"User {user_id} cashing out: {data}")
                 await manager.cash_out_user(user_id=user_id, panel_id=int(data.get("panelId")))
+            elif msg_type == "resync":
+                # клиент увидел дыру в seq — отдаём полный снапшот
+                await manager.send_to_user(user_id, manager.snapshot())
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
         logger.info(f"User {user_id} disconnected.")
     except Exception as e:
         logger.exception(f"WS error for user {user_id}: {e}")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
 
 @app.post("/create-star-invoice")
 async def create_star_invoice(data: dict = Body(...)):
@@ -283,8 +277,7 @@ async def create_star_invoice(data: dict = Body(...)):
         "currency": "XTR",
         "prices": json.dumps([{"label": f"{amount} crystals", "amount": amount}]),
     }
-    async with httpx.AsyncClient(timeout=20) as client:
-        resp = await client.post(url, data=payload)
+    resp = await http_clients.post("telegram", url, data=payload)
     if resp.status_code == 200:
         return {"ok": True, "invoice_link": resp.json().get("result")}
     logger.error(f"Error creating invoice: {resp.text}")
@@ -299,8 +292,7 @@ async def telegram_webhook(request: Request):
         query_id = data["pre_checkout_query"]["id"]
         url = f"https://api.telegram.org/bot{BOT_TOKEN}/answerPreCheckoutQuery"
         payload = {"pre_checkout_query_id": query_id, "ok": True}
-        async with httpx.AsyncClient(timeout=20) as client:
-            await client.post(url, json=payload)
+        await http_clients.post("telegram", url, json=payload)
         logger.info(f"Answered pre_checkout_query {query_id}")
         return {"status": "ok"}
 
@@ -309,7 +301,7 @@ async def telegram_webhook(request: Request):
         user_id = data["message"]["from"]["id"]
         amount_paid = payment_info["total_amount"]
 
-        current_balance = get_balance(user_id)
+        current_balance = await balance_cache.get(user_id)
         is_ftd = current_balance == 0
 
         try:
@@ -333,8 +325,14 @@ async def telegram_webhook(request: Request):
         except Exception:
             pass
 
-        new_balance = update_balance(user_id, float(amount_paid), op="inc")
-        await manager.send_to_user(str(user_id), {"type": "balance_update", "data": {"balance": new_balance}})
+        # оплату пишем сразу и атомарно; повторная доставка того же платежа не зачисляется дважды
+        charge_id = payment_info.get("telegram_payment_charge_id")
+        new_balance = await storage.apply_balance_mutation(
+            user_id, float(amount_paid), LEDGER_DEPOSIT,
+            idempotency_key=f"tg_payment:{charge_id}" if charge_id else None,
+        )
+        # сокет юзера может держать другой воркер — он сбросит кэш и отправит баланс
+        await bus.publish({"event": "balance_changed", "user_id": user_id})
         logger.info(f"User {user_id} successfully paid {amount_paid}. New balance: {new_balance}")
 
     return {"status": "ok"}
@@ -361,57 +359,186 @@ async def admin_ensure_clickhouse():
 async def admin_ch_status():
     return await ch_status()
 
+@app.get("/admin/ch_writer")
+async def admin_ch_writer():
+    return ch_writer.stats()
+
+@app.get("/admin/backfill")
+async def admin_backfill():
+    return ch_backfill.stats()
+
+@app.get("/admin/init_data")
+async def admin_init_data():
+    return {**init_data_validator.stats(), "session_tokens": session_tokens.stats()}
+
+FAIRNESS_VERIFY_MAX = int(os.getenv("FAIRNESS_VERIFY_MAX", "100000"))
+
+@app.get("/admin/hash_chain")
+async def admin_hash_chain():
+    if game.chain is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "commitment": game.chain.commitment,
+        "length": len(game.chain),
+        "position": game.nonce,
+        "next_prepared": game.next_chain is not None,
+    }
+
+@app.post("/fairness/verify_chain")
+async def verify_chain(data: dict = Body(...)):
+    # seeds — раскрытые сиды подряд, previous — commitment цепочки или сид раунда перед ними
+    seeds = data.get("seeds") or []
+    if not isinstance(seeds, list) or len(seeds) > FAIRNESS_VERIFY_MAX:
+        return {"ok": False, "error": f"seeds must be a list of at most {FAIRNESS_VERIFY_MAX} hex strings"}
+    return await asyncio.to_thread(CrashGame.verify_chain_segment, seeds, data.get("previous"))
+
+ROUNDS_PAGE_MAX = int(os.getenv("ROUNDS_PAGE_MAX", "500"))
+
+@app.get("/rounds")
+async def list_rounds(before: Optional[int] = Query(None), limit: int = Query(50, ge=1, le=ROUNDS_PAGE_MAX)):
+    # страницы по round_id (keyset): следующая — ?before=next_before
+    rounds = await storage.get_rounds(before, limit)
+    return {"rounds": rounds, "next_before": rounds[-1]["round_id"] if len(rounds) == limit else None}
+
+@app.get("/rounds/{round_id}")
+async def get_round(round_id: int):
+    record = await storage.get_round(round_id)
+    if record is None:
+        return {"ok": False, "error": "not_found"}
+    return {"ok": True, "round": record}
+
+@app.get("/fairness/verify_rounds")
+async def verify_rounds_range(from_id: int = Query(..., alias="from"), to_id: int = Query(..., alias="to"),
+                              limit: int = Query(10000, ge=1, le=FAIRNESS_VERIFY_MAX)):
+    # пересчёт раундов from..to по round_id на сервере; длинный диапазон — страницами через next_from
+    records = await storage.get_rounds_range(from_id, to_id, limit)
+    result = await asyncio.to_thread(verify_rounds, records)
+    result["next_from"] = records[-1]["round_id"] + 1 if len(records) == limit else None
+    return result
+
+@app.get("/admin/handshakes")
+async def admin_handshakes():
+    return handshake_gate.stats()
+
+@app.get("/admin/http_clients")
+async def admin_http_clients():
+    return http_clients.stats()
+
+@app.get("/admin/balance_cache")
+async def admin_balance_cache():
+    return balance_cache.stats()
+
+@app.get("/admin/storage")
+async def admin_storage():
+    return storage.stats()
+
+@app.get("/admin/bet_intake")
+async def admin_bet_intake():
+    return bet_intake.stats()
+
+# метрики читаются из роллапов spins_hourly/spins_daily (миграции 0003–0006),
+# а не сканом сырого spins; одинаковые запросы дашбордов отдаются из кэша
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "10"))
+_metrics_cache = TTLCache(ttl=METRICS_CACHE_TTL, max_size=256)
+
+_ROLLUP_SUMS = """
+      sum(deposit_sum)     AS deposit_sum,
+      sum(bet_success_cnt) AS bet_success_cnt,
+      sum(bet_fail_cnt)    AS bet_fail_cnt,
+      sum(win_sum)         AS win_sum,
+      sum(loss_sum)        AS loss_sum
+"""
+
+async def _metrics_query(key: tuple, sql: str) -> list:
+    rows = _metrics_cache.get(key)
+    if rows is None:
+        r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params={"query": sql, "database": CLICKHOUSE_DB, "default_format": "JSON"}, auth=_auth_tuple())
+        r.raise_for_status()
+        rows = r.json().get("data", [])
+        _metrics_cache.set(key, rows)
+    return rows
+
+def _since_hour(hours: int) -> str:
+    # окно выровнено по часу: роллап хранит целые часы, а ключ кэша не меняется каждую секунду
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    return since.strftime("%Y-%m-%d %H:%M:%S")
+
 @app.get("/admin/metrics/summary")
 async def metrics_summary(hours: int = Query(24, ge=1, le=720)):
     await ensure_clickhouse()
-    since = (datetime.utcnow() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    since = _since_hour(hours)
     sql = f"""
-    WITH toDateTime('{since}') AS since
-    SELECT
-      sumIf(amount, event_type = 'deposit')   AS deposit_sum,
-      countIf(event_type = 'bet_success')     AS bet_success_cnt,
-      countIf(event_type = 'bet_fail')        AS bet_fail_cnt,
-      sumIf(amount, event_type = 'win')       AS win_sum,
-      sumIf(amount, event_type = 'loss')      AS loss_sum
-    FROM {CLICKHOUSE_SPINS_TABLE}
-    WHERE timestamp >= since
+    SELECT{_ROLLUP_SUMS}
+    FROM {CLICKHOUSE_SPINS_HOURLY_TABLE}
+    WHERE hour >= toDateTime('{since}')
     """
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.post(CLICKHOUSE_HOST, params={"query": sql, "database": CLICKHOUSE_DB, "default_format": "JSON"}, auth=_auth_tuple())
-        r.raise_for_status()
-        data = r.json()
-    rows = data.get("data", [])
-    result = rows[0] if rows else {}
+    rows = await _metrics_query(("summary", since), sql)
+    result = dict(rows[0]) if rows else {}
     result["net"] = float(result.get("win_sum", 0) - result.get("deposit_sum", 0))
     return result
 
 @app.get("/admin/metrics/by-hour")
 async def metrics_by_hour(hours: int = Query(24, ge=1, le=720)):
     await ensure_clickhouse()
-    since = (datetime.utcnow() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    since = _since_hour(hours)
     sql = f"""
-    WITH toDateTime('{since}') AS since
     SELECT
-      toStartOfHour(timestamp) AS hour,
-      sumIf(amount, event_type = 'deposit') AS deposit_sum,
-      countIf(event_type = 'bet_success')    AS bet_success_cnt,
-      countIf(event_type = 'bet_fail')       AS bet_fail_cnt,
-      sumIf(amount, event_type = 'win')      AS win_sum,
-      sumIf(amount, event_type = 'loss')     AS loss_sum
-    FROM {CLICKHOUSE_SPINS_TABLE}
-    WHERE timestamp >= since
+      hour,{_ROLLUP_SUMS}
+    FROM {CLICKHOUSE_SPINS_HOURLY_TABLE}
+    WHERE hour >= toDateTime('{since}')
     GROUP BY hour
     ORDER BY hour ASC
     """
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.post(CLICKHOUSE_HOST, params={"query": sql, "database": CLICKHOUSE_DB, "default_format": "JSON"}, auth=_auth_tuple())
-        r.raise_for_status()
-        data = r.json()
-    return data.get("data", [])
+    return await _metrics_query(("by_hour", since), sql)
+
+@app.get("/admin/metrics/by-day")
+async def metrics_by_day(days: int = Query(30, ge=1, le=366)):
+    await ensure_clickhouse()
+    since = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+    sql = f"""
+    SELECT
+      day,{_ROLLUP_SUMS}
+    FROM {CLICKHOUSE_SPINS_DAILY_TABLE}
+    WHERE day >= toDate('{since}')
+    GROUP BY day
+    ORDER BY day ASC
+    """
+    return await _metrics_query(("by_day", since), sql)
+
+# ---- живые метрики процесса (без ClickHouse) ----
+
+LIVE_METRICS_SSE_INTERVAL = float(os.getenv("LIVE_METRICS_SSE_INTERVAL", "1.0"))
+
+@app.get("/admin/metrics/live")
+async def metrics_live(series: bool = Query(False)):
+    return live_metrics.snapshot(series=series)
+
+@app.get("/admin/metrics/live/stream")
+async def metrics_live_stream(request: Request):
+    async def events():
+        while not await request.is_disconnected():
+            yield f"data: {json.dumps(live_metrics.snapshot())}\n\n"
+            await asyncio.sleep(LIVE_METRICS_SSE_INTERVAL)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/admin/metrics/cache")
+async def metrics_cache_stats():
+    return _metrics_cache.stats()
+
+def _on_leader():
+    asyncio.create_task(game_loop())
+    # онлайн-бэкфилл ClickHouse в *_v2 тоже ведёт только лидер
+    asyncio.create_task(ch_backfill.run())
+    # дисковый буфер ClickHouse от воркеров, которых больше нет
+    asyncio.create_task(ch_writer.adopt_orphaned_spill())
 
 @app.on_event("startup")
 async def on_startup():
-    init_db()
+    await storage.init_db()
+    # история раундов переживает рестарт: последние раунды поднимаем из БД
+    if not round_state.history:
+        round_state.history = [to_round_info(r) for r in await storage.get_rounds(limit=HISTORY_SIZE)]
     # 1) миграции
     try:
         report = await run_migrations()
@@ -424,4 +551,20 @@ async def on_startup():
         logger.info(f"[CH] reachable={st.get('reachable')} payload_type={st.get('payload_type')} err={st.get('error')}")
     except Exception as e:
         logger.warning(f"ensure_clickhouse failed: {e}")
-    asyncio.create_task(game_loop())
+    asyncio.create_task(balance_cache.run_flusher())
+    # раунд крутит только лидер шины, остальные воркеры ретранслируют его события
+    await bus.start(on_leader=_on_leader, state_provider=round_state_event)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # следующий процесс начнёт с нового сида, так что текущий можно раскрыть
+    if bus.is_leader:
+        await _reveal_seed()
+    await bus.close()
+    # не теряем отложенные изменения балансов
+    await balance_cache.flush()
+    storage.close()
+    # дописываем в ClickHouse то, что осталось в очередях
+    await close_clickhouse()
+    await http_clients.close()
+    init_data_validator.close()
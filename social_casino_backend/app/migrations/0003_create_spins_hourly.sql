@@ -0,0 +1,13 @@
+-- source — откуда строка роллапа: живая MV или бэкфилл истории; по нему бэкфилл
+-- стирает свою прошлую попытку и не трогает чужие строки. Читатели суммируют всё подряд
+CREATE TABLE IF NOT EXISTS spins_hourly (
+                                            hour DateTime,
+                                            source LowCardinality(String),
+                                            deposit_sum Float64,
+                                            bet_success_cnt UInt64,
+                                            bet_fail_cnt UInt64,
+                                            win_sum Float64,
+                                            loss_sum Float64
+)
+    ENGINE = SummingMergeTree()
+ORDER BY (hour, source);
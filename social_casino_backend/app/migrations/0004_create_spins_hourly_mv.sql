@@ -0,0 +1,31 @@
+-- сначала MV, и она берёт только строки с timestamp >= {cutoff}; всё, что раньше, доливает
+-- бэкфилл ниже — так ни одна строка не проскочит между бэкфиллом и созданием MV.
+-- {cutoff} раннер фиксирует при первом запуске файла, повторный запуск берёт ту же границу,
+-- а бэкфилл сначала стирает свою прошлую попытку, так что файл можно перезапускать
+CREATE MATERIALIZED VIEW IF NOT EXISTS spins_hourly_mv TO spins_hourly AS
+SELECT
+    toStartOfHour(timestamp) AS hour,
+    'spins' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins
+WHERE timestamp >= toDateTime('{cutoff}')
+GROUP BY hour;
+
+ALTER TABLE spins_hourly DELETE WHERE source = 'spins_backfill' SETTINGS mutations_sync = 2;
+
+INSERT INTO spins_hourly (hour, source, deposit_sum, bet_success_cnt, bet_fail_cnt, win_sum, loss_sum)
+SELECT
+    toStartOfHour(timestamp) AS hour,
+    'spins_backfill' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins
+WHERE timestamp < toDateTime('{cutoff}')
+GROUP BY hour;
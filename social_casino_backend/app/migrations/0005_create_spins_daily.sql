@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS spins_daily (
+                                            day Date,
+                                            source LowCardinality(String),
+                                            deposit_sum Float64,
+                                            bet_success_cnt UInt64,
+                                            bet_fail_cnt UInt64,
+                                            win_sum Float64,
+                                            loss_sum Float64
+)
+    ENGINE = SummingMergeTree()
+ORDER BY (day, source);
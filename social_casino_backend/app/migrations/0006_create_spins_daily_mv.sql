@@ -0,0 +1,28 @@
+-- то же, что 0004 для часового роллапа: MV от {cutoff}, затем перезапускаемый бэкфилл до {cutoff}
+CREATE MATERIALIZED VIEW IF NOT EXISTS spins_daily_mv TO spins_daily AS
+SELECT
+    toDate(timestamp) AS day,
+    'spins' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins
+WHERE timestamp >= toDateTime('{cutoff}')
+GROUP BY day;
+
+ALTER TABLE spins_daily DELETE WHERE source = 'spins_backfill' SETTINGS mutations_sync = 2;
+
+INSERT INTO spins_daily (day, source, deposit_sum, bet_success_cnt, bet_fail_cnt, win_sum, loss_sum)
+SELECT
+    toDate(timestamp) AS day,
+    'spins_backfill' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins
+WHERE timestamp < toDateTime('{cutoff}')
+GROUP BY day;
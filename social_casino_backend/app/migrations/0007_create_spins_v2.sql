@@ -0,0 +1,23 @@
+-- spins с раскладкой под запросы: числовой user_id, LowCardinality для типа события,
+-- помесячные партиции, ключ сортировки (тип, юзер, время)
+CREATE TABLE IF NOT EXISTS spins_v2 (
+                                        user_id UInt64,
+                                        event_type LowCardinality(String),
+                                        amount Float64,
+                                        multiplier Float64,
+                                        timestamp DateTime
+)
+    ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp)
+ORDER BY (event_type, user_id, timestamp);
+
+-- всё, что ещё пишется в старую таблицу (старые воркеры, проигрыш дискового буфера), попадает и в новую;
+-- строки до создания этой MV копирует онлайн-бэкфилл (app/ch_backfill.py)
+CREATE MATERIALIZED VIEW IF NOT EXISTS spins_to_v2_mv TO spins_v2 AS
+SELECT
+    toUInt64OrZero(user_id) AS user_id,
+    event_type,
+    amount,
+    multiplier,
+    timestamp
+FROM spins;
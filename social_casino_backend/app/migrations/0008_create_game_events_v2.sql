@@ -0,0 +1,22 @@
+-- технические события: те же приёмы плюс TTL — сырые события храним 90 дней;
+-- бизнес-события (платежи) под TTL не попадают и хранятся бессрочно
+CREATE TABLE IF NOT EXISTS game_events_v2 (
+                                              ts DateTime,
+                                              event_type LowCardinality(String),
+                                              user_id UInt64,
+                                              user_source LowCardinality(String),
+                                              payload String
+)
+    ENGINE = MergeTree()
+PARTITION BY toYYYYMM(ts)
+ORDER BY (event_type, user_id, ts)
+TTL ts + INTERVAL 90 DAY DELETE WHERE event_type NOT IN ('successful_payment');
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS game_events_to_v2_mv TO game_events_v2 AS
+SELECT
+    ts,
+    event_type,
+    toUInt64(greatest(ifNull(user_id, 0), 0)) AS user_id,
+    ifNull(user_source, '') AS user_source,
+    payload
+FROM game_events;
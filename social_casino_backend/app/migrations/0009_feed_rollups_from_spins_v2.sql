@@ -0,0 +1,34 @@
+-- роллапы переезжают на spins_v2. Новые MV создаются первыми и берут строки с {cutoff},
+-- только потом снимаются старые MV со spins: ни одна строка не проскочит между ними.
+-- Строки, пришедшие в spins за эти миллисекунды, посчитаются дважды (source 'spins' и
+-- 'spins_v2') — это временно: историю до {cutoff} онлайн-бэкфилл (app/ch_backfill.py)
+-- после копирования spins -> spins_v2 пересобирает из spins_v2 под source 'spins_v2_backfill'
+-- и стирает все строки старых MV и бэкфиллов. До этого роллапы показывают историю из spins
+CREATE MATERIALIZED VIEW IF NOT EXISTS spins_v2_hourly_mv TO spins_hourly AS
+SELECT
+    toStartOfHour(timestamp) AS hour,
+    'spins_v2' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins_v2
+WHERE timestamp >= toDateTime('{cutoff}')
+GROUP BY hour;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS spins_v2_daily_mv TO spins_daily AS
+SELECT
+    toDate(timestamp) AS day,
+    'spins_v2' AS source,
+    sumIf(amount, event_type = 'deposit') AS deposit_sum,
+    countIf(event_type = 'bet_success') AS bet_success_cnt,
+    countIf(event_type = 'bet_fail') AS bet_fail_cnt,
+    sumIf(amount, event_type = 'win') AS win_sum,
+    sumIf(amount, event_type = 'loss') AS loss_sum
+FROM spins_v2
+WHERE timestamp >= toDateTime('{cutoff}')
+GROUP BY day;
+
+DROP VIEW IF EXISTS spins_hourly_mv;
+DROP VIEW IF EXISTS spins_daily_mv;
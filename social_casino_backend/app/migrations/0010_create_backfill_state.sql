@@ -0,0 +1,11 @@
+-- прогресс онлайн-бэкфилла: одна строка на скопированный день источника
+CREATE TABLE IF NOT EXISTS _backfill_state (
+                                               source String,
+                                               target String,
+                                               cutover DateTime,
+                                               day UInt32,
+                                               rows UInt64,
+                                               done_at DateTime
+)
+    ENGINE = MergeTree()
+ORDER BY (source, day);
@@ -2,9 +2,12 @@
 
 import os
 import glob
+import asyncio
+import contextlib
 from typing import List, Dict, Any
 import datetime
-import httpx
+
+from app.http_clients import http_clients
 
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "http://localhost:8123/")
 CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
@@ -13,46 +16,79 @@ CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "default")
 
 MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
 MIGRATIONS_TABLE = "_migrations"
+CUTOFFS_TABLE = "_migration_cutoffs"
+# миграции прогоняет ровно один воркер за раз: остальные ждут на flock и потом видят,
+# что всё уже применено (иначе бэкфиллы роллапов применились бы по разу на воркер)
+MIGRATIONS_LOCK_PATH = os.getenv("MIGRATIONS_LOCK_PATH", "/tmp/social_casino_migrations.lock")
+# граница «MV берёт строки с этого момента, бэкфилл — строго до него»
+CUTOFF_PLACEHOLDER = "{cutoff}"
 
 
 def _auth_tuple():
     return (CLICKHOUSE_USER, CLICKHOUSE_PASSWORD) if (CLICKHOUSE_USER or CLICKHOUSE_PASSWORD) else None
 
 
-async def _exec_sql(client: httpx.AsyncClient, sql: str, *, database: str | None = None) -> None:
+async def _exec_sql(sql: str, *, database: str | None = None, timeout: float = 10.0) -> None:
     params = {"query": sql}
     if database:
         params["database"] = database
-    r = await client.post(CLICKHOUSE_HOST, params=params, auth=_auth_tuple())
+    r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params=params, auth=_auth_tuple(), timeout=timeout)
     r.raise_for_status()
 
 
-async def _fetch_json(client: httpx.AsyncClient, sql: str, *, database: str | None = None) -> Dict[str, Any]:
+async def _fetch_json(sql: str, *, database: str | None = None) -> Dict[str, Any]:
     params = {"query": sql, "default_format": "JSON"}
     if database:
         params["database"] = database
-    r = await client.post(CLICKHOUSE_HOST, params=params, auth=_auth_tuple())
+    r = await http_clients.post("clickhouse", CLICKHOUSE_HOST, params=params, auth=_auth_tuple())
     r.raise_for_status()
     return r.json()
 
 
 async def ensure_migrations_store() -> None:
     """Создаёт служебную таблицу учёта применённых миграций."""
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        sql = f"""
-        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE}(
-            version String,
-            applied_at DateTime
-        ) ENGINE = MergeTree() ORDER BY (applied_at)
-        """
-        await _exec_sql(client, sql, database=CLICKHOUSE_DB)
+    sql = f"""
+    CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE}(
+        version String,
+        applied_at DateTime
+    ) ENGINE = MergeTree() ORDER BY (applied_at)
+    """
+    await _exec_sql(sql, database=CLICKHOUSE_DB)
+    sql = f"""
+    CREATE TABLE IF NOT EXISTS {CUTOFFS_TABLE}(
+        version String,
+        cutoff DateTime
+    ) ENGINE = MergeTree() ORDER BY (version)
+    """
+    await _exec_sql(sql, database=CLICKHOUSE_DB)
+
+
+async def migration_cutoff(version_filename: str) -> str | None:
+    """Cutoff fixed for a migration that uses {cutoff}, or None if it has not been started yet."""
+    safe_ver = version_filename.replace("'", "''")
+    sql = f"SELECT toString(min(cutoff)) AS c, count() AS n FROM {CUTOFFS_TABLE} WHERE version = '{safe_ver}'"
+    rows = (await _fetch_json(sql, database=CLICKHOUSE_DB)).get("data", [])
+    return rows[0]["c"] if rows and int(rows[0]["n"]) else None
+
+
+@contextlib.asynccontextmanager
+async def _migrations_lock():
+    import fcntl
+
+    fd = os.open(MIGRATIONS_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # блокирующий flock — в потоке, чтобы не вставал event loop
+        await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # закрытие дескриптора снимает лок
+        os.close(fd)
 
 
 async def list_applied_versions() -> List[str]:
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        sql = f"SELECT version FROM {MIGRATIONS_TABLE} ORDER BY version"
-        data = await _fetch_json(client, sql, database=CLICKHOUSE_DB)
-        return [row["version"] for row in data.get("data", [])]
+    sql = f"SELECT version FROM {MIGRATIONS_TABLE} ORDER BY version"
+    data = await _fetch_json(sql, database=CLICKHOUSE_DB)
+    return [row["version"] for row in data.get("data", [])]
 
 
 def list_files_versions() -> List[str]:
@@ -66,6 +102,26 @@ def read_migration_sql(version_filename: str) -> str:
         return f.read()
 
 
+def split_statements(sql: str) -> List[str]:
+    """
+    HTTP-интерфейс ClickHouse принимает один запрос за раз, поэтому файл режем на
+    запросы по строкам, которые заканчиваются на ';'. Строки-комментарии выкидываем.
+    """
+    statements: List[str] = []
+    current: List[str] = []
+    for line in sql.splitlines():
+        if line.strip().startswith("--"):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip().rstrip(";"))
+            current = []
+    tail = "\n".join(current).strip()
+    if tail:
+        statements.append(tail)
+    return [st for st in statements if st]
+
+
 async def apply_migration(version_filename: str) -> None:
     sql = read_migration_sql(version_filename)
     ts = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
@@ -78,22 +134,34 @@ async def apply_migration(version_filename: str) -> None:
         f"VALUES ('{safe_ver}', toDateTime('{ts}'))"
     )
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        await _exec_sql(client, sql, database=CLICKHOUSE_DB)
-        await _exec_sql(client, applied_sql, database=CLICKHOUSE_DB)
+    if CUTOFF_PLACEHOLDER in sql:
+        # граница фиксируется до первого запроса файла и переживает его перезапуск
+        cutoff = await migration_cutoff(version_filename)
+        if cutoff is None:
+            cutoff = ts
+            await _exec_sql(f"INSERT INTO {CUTOFFS_TABLE} (version, cutoff) VALUES ('{safe_ver}', toDateTime('{cutoff}'))",
+                            database=CLICKHOUSE_DB)
+        sql = sql.replace(CUTOFF_PLACEHOLDER, cutoff)
+
+    # запросы внутри файла должны быть идемпотентными (IF [NOT] EXISTS, бэкфилл стирает свою прошлую попытку):
+    # если файл упал посередине, он целиком перезапустится на следующем старте
+    for statement in split_statements(sql):
+        await _exec_sql(statement, database=CLICKHOUSE_DB, timeout=30.0)
+    await _exec_sql(applied_sql, database=CLICKHOUSE_DB, timeout=30.0)
 
 
 async def run_migrations() -> Dict[str, Any]:
     """Запускает все не применённые миграции, возвращает отчёт."""
-    await ensure_migrations_store()
-    applied = set(await list_applied_versions())
-    all_versions = list_files_versions()
-    to_apply = [v for v in all_versions if v not in applied]
-    applied_now: List[str] = []
-
-    for ver in to_apply:
-        await apply_migration(ver)
-        applied_now.append(ver)
+    async with _migrations_lock():
+        await ensure_migrations_store()
+        applied = set(await list_applied_versions())
+        all_versions = list_files_versions()
+        to_apply = [v for v in all_versions if v not in applied]
+        applied_now: List[str] = []
+
+        for ver in to_apply:
+            await apply_migration(ver)
+            applied_now.append(ver)
 
     return {
         "ok": True,
@@ -0,0 +1,188 @@
+# social_casino_backend/app/round_bus.py
+#
+# Шина событий раунда между процессами.
+# Ровно один процесс (лидер) крутит CrashGame и публикует события раунда,
+# все процессы с WebSocket-соединениями (включая лидера) их получают и применяют
+# через WebSocketManager.apply_round_event.
+#
+#   GAME_BUS=local — один процесс, события доставляются напрямую (по умолчанию)
+#   GAME_BUS=unix  — несколько воркеров uvicorn: лидер выбирается через flock
+#                    на GAME_BUS_LOCK_PATH и раздаёт события по Unix-сокету
+#                    GAME_BUS_PATH; остальные подписываются и ретранслируют.
+#                    Если лидер умер, первый заметивший это воркер забирает лок.
+
+import os
+import json
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Any, Optional
+
+from app.ws_codec import encode_json
+
+GAME_BUS = os.getenv("GAME_BUS", "local").strip().lower()
+GAME_BUS_PATH = os.getenv("GAME_BUS_PATH", "/tmp/social_casino_round_bus.sock")
+GAME_BUS_LOCK_PATH = os.getenv("GAME_BUS_LOCK_PATH", "/tmp/social_casino_round_bus.lock")
+# сколько байт может скопиться в сокете подписчика, прежде чем лидер его отключит
+GAME_BUS_MAX_BUFFER = int(os.getenv("GAME_BUS_MAX_BUFFER", str(4 * 1024 * 1024)))
+
+logger = logging.getLogger("uvicorn.error")
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+StateProvider = Callable[[], Dict[str, Any]]
+
+
+class LocalBus:
+    """Single-process bus: the round loop and the sockets live in the same process."""
+
+    def __init__(self):
+        self._handlers: list[EventHandler] = []
+        self.is_leader = False
+
+    def subscribe(self, handler: EventHandler) -> None:
+        self._handlers.append(handler)
+
+    async def start(self, on_leader: Callable[[], None], state_provider: StateProvider) -> None:
+        self.is_leader = True
+        on_leader()
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        await self._deliver(event)
+
+    async def _deliver(self, event: Dict[str, Any]) -> None:
+        for handler in self._handlers:
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.exception(f"[BUS] handler failed on {event.get('event')}: {e}")
+
+    async def close(self) -> None:
+        pass
+
+
+class UnixSocketBus(LocalBus):
+    """
+    Multi-process bus over a Unix domain socket (newline-delimited JSON).
+    The leader fans events out to its own handlers and to every subscriber;
+    events published by a subscriber go upstream and the leader fans them out.
+    """
+
+    def __init__(self, path: str = GAME_BUS_PATH, lock_path: str = GAME_BUS_LOCK_PATH):
+        super().__init__()
+        self.path = path
+        self.lock_path = lock_path
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscribers: set[asyncio.StreamWriter] = set()
+        self._upstream: Optional[asyncio.StreamWriter] = None
+        self._follower_task: Optional[asyncio.Task] = None
+        self._on_leader: Callable[[], None] = lambda: None
+        self._state_provider: StateProvider = dict
+
+    def _try_lock(self) -> bool:
+        import fcntl
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def start(self, on_leader: Callable[[], None], state_provider: StateProvider) -> None:
+        self._on_leader = on_leader
+        self._state_provider = state_provider
+        if self._try_lock():
+            await self._become_leader()
+        else:
+            self._follower_task = asyncio.create_task(self._follow())
+
+    async def _become_leader(self) -> None:
+        # сокет мог остаться от умершего лидера — лок наш, значит его можно удалить
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_subscriber, path=self.path)
+        self.is_leader = True
+        logger.info(f"[BUS] pid={os.getpid()} is the round loop leader ({self.path})")
+        self._on_leader()
+
+    async def _serve_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._send_line(writer, {"event": "state", **self._state_provider()})
+        self._subscribers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.publish(json.loads(line))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"[BUS] subscriber error: {e}")
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    def _send_line(self, writer: asyncio.StreamWriter, event: Dict[str, Any]) -> bool:
+        if writer.transport.get_write_buffer_size() > GAME_BUS_MAX_BUFFER:
+            logger.warning("[BUS] subscriber is not reading, dropping it")
+            self._subscribers.discard(writer)
+            writer.close()
+            return False
+        writer.write((encode_json(event) + "\n").encode("utf-8"))
+        return True
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        if self.is_leader:
+            for writer in list(self._subscribers):
+                self._send_line(writer, event)
+            await self._deliver(event)
+        elif self._upstream is not None:
+            self._upstream.write((encode_json(event) + "\n").encode("utf-8"))
+        else:
+            logger.warning(f"[BUS] no leader connection, dropping {event.get('event')}")
+
+    async def _follow(self) -> None:
+        delay = 0.2
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                self._upstream = writer
+                delay = 0.2
+                logger.info(f"[BUS] pid={os.getpid()} subscribed to round loop leader")
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self._deliver(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[BUS] leader connection failed: {e}")
+            finally:
+                self._upstream = None
+
+            # лидер пропал — пробуем занять его место
+            if self._try_lock():
+                await self._become_leader()
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    async def close(self) -> None:
+        if self._follower_task is not None:
+            self._follower_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._subscribers):
+                writer.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+def create_bus() -> LocalBus:
+    if GAME_BUS == "unix":
+        return UnixSocketBus()
+    return LocalBus()
@@ -0,0 +1,104 @@
+# social_casino_backend/app/round_history.py
+#
+# Постоянная история раундов (таблица rounds в SQLite, см. app.db): каждый
+# процесс после round_end пишет одну строку — номер, хеш/commitment сида,
+# раскрытый сид, crash point, время и агрегаты ставок. В режиме seed сидом
+# играют ещё до SEED_ROUNDS раундов, и по нему предсказываются все следующие,
+# поэтому в строку он не пишется: лидер проставляет его всем раундам сида при
+# ротации (app.db.reveal_seed), до тех пор server_seed — NULL. Отсюда же — пересчёт
+# раундов для проверки честности: crash point заново из сида, для режима
+# seed — sha256(сид) против опубликованного хеша, для цепочки — звенья
+# sha256(сид раунда) == сид предыдущего раунда (или commitment для первого).
+
+import hashlib
+from typing import Any, Dict, Iterable, Optional
+
+from app.game_logic import CrashGame
+
+# сколько расхождений возвращать в ответе проверки
+MISMATCH_REPORT_LIMIT = 100
+
+
+def round_row(round_info: Dict[str, Any], ended_at: float, bets_count: int, bets_sum: float,
+              wins_count: int, wins_sum: float) -> tuple:
+    """Builds a rounds table row (app.db.ROUND_COLUMNS order) from a round_end round_info."""
+    mode = round_info.get("mode", "seed")
+    return (
+        round_info["round_id"], round_info["nonce"], mode,
+        round_info["hashed_server_seed"], round_info["server_seed"] if mode == "chain" else None, round_info["multiplier"],
+        round_info.get("start_time"), ended_at, bets_count, bets_sum, wins_count, wins_sum,
+    )
+
+
+def to_round_info(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored round in the shape of game.history entries (restores history after a restart)."""
+    return {
+        "multiplier": record["crash_point"],
+        "server_seed": record["server_seed"],
+        "hashed_server_seed": record["hashed_server_seed"],
+        "nonce": record["nonce"],
+        "round_id": record["round_id"],
+        "mode": record["mode"],
+        "start_time": record["started_at"],
+    }
+
+
+def _recompute(record: Dict[str, Any]) -> tuple[Optional[float], Optional[str]]:
+    seed = record["server_seed"]
+    try:
+        if record["mode"] == "chain":
+            return CrashGame.crash_point_for_chain_seed(seed), None
+        if hashlib.sha256(seed.encode("utf-8")).hexdigest() != record["hashed_server_seed"]:
+            return None, "seed_hash_mismatch"
+        return CrashGame.crash_point_for_seed(seed, record["nonce"]), None
+    except ValueError:
+        return None, "bad_seed"
+
+
+def verify_rounds(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Recomputes every round in `records` (oldest first) and checks hash-chain links
+    between consecutive rounds of the same chain that are both in the range.
+    Seed-mode rounds whose seed is still in play (not revealed yet) are skipped.
+    """
+    checked = 0
+    unrevealed = 0
+    links_checked = 0
+    mismatches: list[Dict[str, Any]] = []
+    mismatch_count = 0
+    prev: Optional[Dict[str, Any]] = None
+
+    for record in records:
+        if record["server_seed"] is None:
+            unrevealed += 1
+            continue
+        checked += 1
+        recomputed, reason = _recompute(record)
+        if reason is None and recomputed != record["crash_point"]:
+            reason = "crash_point_mismatch"
+        if reason is None and record["mode"] == "chain":
+            link_to = None
+            if record["nonce"] == 1:
+                link_to = record["hashed_server_seed"]
+            elif (prev is not None and prev["mode"] == "chain" and prev["nonce"] == record["nonce"] - 1
+                  and prev["hashed_server_seed"] == record["hashed_server_seed"]):
+                link_to = prev["server_seed"]
+            if link_to is not None:
+                links_checked += 1
+                if hashlib.sha256(bytes.fromhex(record["server_seed"])).hexdigest() != link_to:
+                    reason = "chain_link_mismatch"
+        if reason is not None:
+            mismatch_count += 1
+            if len(mismatches) < MISMATCH_REPORT_LIMIT:
+                mismatches.append({"round_id": record["round_id"], "nonce": record["nonce"], "reason": reason,
+                                   "stored": record["crash_point"], "recomputed": recomputed})
+        prev = record
+
+    return {
+        "ok": mismatch_count == 0,
+        "checked": checked,
+        "unrevealed": unrevealed,
+        "links_checked": links_checked,
+        "mismatch_count": mismatch_count,
+        "mismatches": mismatches,
+    }
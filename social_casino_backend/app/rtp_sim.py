@@ -0,0 +1,199 @@
+# social_casino_backend/app/rtp_sim.py
+#
+# Монте-Карло RTP и house edge для CrashGame на NumPy. Crash point считается
+# той же формулой, что и CrashGame.crash_point_from_int (те же float64-операции
+# в том же порядке), только сразу для пачки раундов; 32-битное число раунда —
+# равномерное, как первые 4 байта HMAC-SHA256 в проде. Перед прогоном формула
+# сверяется с эталоном на случайных и граничных значениях.
+#
+# Стратегии (ставка 1, выигрыш при target <= crash point, как в auto_cashout):
+#   --targets 1.5,2,10          — фиксированный авто-кэшаут
+#   --manual lognormal:0.7,0.6  — ручной кэшаут, точка из распределения
+#            uniform:1.1,5 | exponential:1.5 (1 + Exp(scale))
+# Отчёт: RTP и 99.9% доверительный интервал, дисперсия выплаты, доля выигрышей,
+# максимальная выплата и хвост распределения множителя.
+#
+# NumPy опционален и нужен только здесь. Запуск из social_casino_backend/:
+#   python -m app.rtp_sim --rounds 100000000 --targets 1.5,2,10,100
+#   python -m app.rtp_sim --rounds 10000000 --manual lognormal:0.7,0.6 --seed 42
+
+import argparse
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from app.game_logic import CrashGame
+
+E = 2**32
+TAIL_THRESHOLDS = (2, 10, 100, 1000, 10000)
+# z для двустороннего 99.9% интервала
+Z_999 = 3.2905
+
+
+def crash_points(ints: "np.ndarray", house_edge: float = CrashGame.HOUSE_EDGE) -> "np.ndarray":
+    """Vectorized CrashGame.crash_point_from_int for an array of 32-bit round values."""
+    x = ints.astype(np.float64)
+    crash = ((1 - house_edge) * E) / (E - x)
+    np.multiply(crash, 100, out=crash)
+    np.floor(crash, out=crash)
+    np.divide(crash, 100, out=crash)
+    np.maximum(crash, 1.00, out=crash)
+    crash[x < E * house_edge] = 1.00
+    return crash
+
+
+def check_formula(samples: int = 100000, seed: Optional[int] = None) -> int:
+    """Compares crash_points with CrashGame.crash_point_from_int; returns the number of mismatches."""
+    rnd = random.Random(seed)
+    edge = int(E * CrashGame.HOUSE_EDGE)
+    ints = [0, 1, edge - 1, edge, edge + 1, E - 2, E - 1] + [rnd.randrange(E) for _ in range(samples)]
+    got = crash_points(np.array(ints, dtype=np.uint64))
+    return sum(1 for i, v in zip(ints, got.tolist()) if CrashGame.crash_point_from_int(i) != v)
+
+
+class _Stats:
+    """Running sums of per-round payouts for one strategy (bet size 1)."""
+
+    __slots__ = ("name", "n", "payout", "payout_sq", "wins", "max_payout")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.n = 0
+        self.payout = 0.0
+        self.payout_sq = 0.0
+        self.wins = 0
+        self.max_payout = 0.0
+
+    def add(self, payouts: "np.ndarray") -> None:
+        self.n += payouts.size
+        self.payout += float(payouts.sum())
+        self.payout_sq += float(np.dot(payouts, payouts))
+        self.wins += int(np.count_nonzero(payouts))
+        self.max_payout = max(self.max_payout, float(payouts.max(initial=0.0)))
+
+    def report(self) -> Dict[str, Any]:
+        rtp = self.payout / self.n
+        variance = max(self.payout_sq / self.n - rtp * rtp, 0.0)
+        half = Z_999 * (variance / self.n) ** 0.5
+        return {
+            "strategy": self.name,
+            "rtp": rtp,
+            "house_edge": 1 - rtp,
+            "rtp_ci999": (rtp - half, rtp + half),
+            "variance": variance,
+            "std": variance ** 0.5,
+            "win_rate": self.wins / self.n,
+            "max_payout": self.max_payout,
+        }
+
+
+def _parse_manual(spec: str) -> Tuple[str, List[float]]:
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    expected = {"lognormal": 2, "uniform": 2, "exponential": 1}
+    if kind not in expected or len(values) != expected[kind]:
+        raise ValueError(f"bad manual strategy {spec!r}: use lognormal:mu,sigma | uniform:a,b | exponential:scale")
+    return kind, values
+
+
+def _manual_points(rng: "np.random.Generator", kind: str, params: List[float], n: int) -> "np.ndarray":
+    if kind == "lognormal":
+        points = rng.lognormal(params[0], params[1], n)
+    elif kind == "uniform":
+        points = rng.uniform(params[0], params[1], n)
+    else:
+        points = 1 + rng.exponential(params[0], n)
+    # множитель стартует с 1.00x: первая точка, где можно забрать ставку, — 1.01x;
+    # игрок видит множитель с точностью до сотых
+    np.maximum(points, 1.01, out=points)
+    return np.floor(points * 100) / 100
+
+
+def simulate(rounds: int, targets: List[float], manual: List[str], batch: int = 1_000_000,
+             seed: Optional[int] = None, house_edge: float = CrashGame.HOUSE_EDGE) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    strategies = [(f"auto@{t:g}", "auto", t) for t in targets] + \
+                 [(f"manual {spec}", "manual", _parse_manual(spec)) for spec in manual]
+    stats = [_Stats(name) for name, _, _ in strategies]
+    tail = dict.fromkeys(TAIL_THRESHOLDS, 0)
+    instant = 0
+    max_crash = 0.0
+    crash_sum = 0.0
+
+    done = 0
+    while done < rounds:
+        n = min(batch, rounds - done)
+        crash = crash_points(rng.integers(0, E, size=n, dtype=np.uint64), house_edge)
+        instant += int(np.count_nonzero(crash == 1.00))
+        max_crash = max(max_crash, float(crash.max()))
+        crash_sum += float(crash.sum())
+        for threshold in TAIL_THRESHOLDS:
+            tail[threshold] += int(np.count_nonzero(crash >= threshold))
+        for st, (_, kind, param) in zip(stats, strategies):
+            if kind == "auto":
+                st.add(np.where(crash >= param, param, 0.0))
+            else:
+                points = _manual_points(rng, param[0], param[1], n)
+                st.add(np.where(crash >= points, points, 0.0))
+        done += n
+
+    return {
+        "rounds": rounds,
+        "house_edge_config": house_edge,
+        "instant_crash_rate": instant / rounds,
+        "mean_crash": crash_sum / rounds,
+        "max_crash": max_crash,
+        "tail": {f">={t}x": tail[t] / rounds for t in TAIL_THRESHOLDS},
+        # теоретически P(crash >= t) ≈ (1 - house_edge) / t
+        "tail_expected": {f">={t}x": (1 - house_edge) / t for t in TAIL_THRESHOLDS},
+        "strategies": [st.report() for st in stats],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Monte Carlo RTP / house edge simulator for CrashGame")
+    parser.add_argument("--rounds", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=1_000_000, help="rounds per vectorized batch (memory bound)")
+    parser.add_argument("--targets", default="1.5,2,5,10,100", help="comma-separated auto-cashout targets")
+    parser.add_argument("--manual", action="append", default=[], help="manual cashout distribution, repeatable")
+    parser.add_argument("--house-edge", type=float, default=CrashGame.HOUSE_EDGE)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("NumPy is required for the simulator: pip install numpy")
+
+    mismatches = check_formula(seed=args.seed)
+    print(f"formula check vs CrashGame.crash_point_from_int: {'ok' if not mismatches else f'{mismatches} MISMATCHES'}")
+    if mismatches:
+        sys.exit(1)
+
+    targets = [float(t) for t in args.targets.split(",") if t]
+    started = time.perf_counter()
+    try:
+        result = simulate(args.rounds, targets, args.manual, args.batch, args.seed, args.house_edge)
+    except ValueError as e:
+        sys.exit(str(e))
+    elapsed = time.perf_counter() - started
+
+    print(f"{result['rounds']:,} rounds in {elapsed:.1f}s ({result['rounds'] / elapsed / 1e6:.1f}M rounds/s), "
+          f"house edge {result['house_edge_config']:.2%}")
+    print(f"instant crash {result['instant_crash_rate']:.4%}   mean crash {result['mean_crash']:.3f}x   "
+          f"max crash {result['max_crash']:,.2f}x")
+    print("tail P(crash >= x):  " + "   ".join(
+        f"{k} {v:.3e} (exp {result['tail_expected'][k]:.3e})" for k, v in result["tail"].items()))
+    print(f"{'strategy':<28} {'RTP':>8} {'99.9% CI':>19} {'edge':>8} {'std':>9} {'win rate':>9} {'max payout':>12}")
+    for s in result["strategies"]:
+        lo, hi = s["rtp_ci999"]
+        print(f"{s['strategy']:<28} {s['rtp']:8.4%} {lo:9.4%}-{hi:8.4%} {s['house_edge']:8.4%} "
+              f"{s['std']:9.3f} {s['win_rate']:9.4%} {s['max_payout']:12,.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# social_casino_backend/app/session_tokens.py
+#
+# Короткоживущие токены сессии для переподключений. После полной проверки
+# initData сервер выдаёт клиенту подписанный токен; при реконнекте клиент
+# предъявляет его, и вместо HMAC/Ed25519 по initData, лога user_connect и
+# get_or_create_user хватает одного HMAC по паре десятков байт.
+# Секрет по умолчанию выводится из токена бота — токен, выданный одним
+# воркером, принимают все остальные.
+#
+# Формат: base64url(json{id, username, exp, max}) "." base64url(hmac_sha256[:16]).
+# exp сдвигается при каждом переподключении, max — жёсткий предел с момента
+# полной проверки initData: дольше него сессия без initData не живёт.
+
+import os
+import time
+import json
+import hmac
+import base64
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+from app.init_data import AUTH_MAX_AGE
+
+SESSION_TOKEN_SECRET = os.getenv("SESSION_TOKEN_SECRET", "").strip()
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "900"))
+SESSION_TOKEN_MAX_AGE = int(os.getenv("SESSION_TOKEN_MAX_AGE", str(AUTH_MAX_AGE)))
+
+_MAC_BYTES = 16
+
+
+def _b64e(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64d(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+class SessionTokens:
+    """Issues and verifies HMAC-signed session tokens that stand in for initData on reconnect."""
+
+    def __init__(self, bot_token: str, secret: str = SESSION_TOKEN_SECRET,
+                 ttl: int = SESSION_TOKEN_TTL, max_age: int = SESSION_TOKEN_MAX_AGE):
+        key = secret.encode() if secret else hmac.new(b"SessionToken", bot_token.encode(), hashlib.sha256).digest()
+        self._key = key
+        self.ttl = ttl
+        self.max_age = max_age
+        self.issued = 0
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _mac(self, body: bytes) -> bytes:
+        return hmac.new(self._key, body, hashlib.sha256).digest()[:_MAC_BYTES]
+
+    def issue(self, user_id: int, username: Optional[str], deadline: Optional[int] = None) -> Tuple[str, int]:
+        """Returns (token, expires_at); deadline carries the hard limit over from a resumed token."""
+        now = int(time.time())
+        deadline = deadline or now + self.max_age
+        expires_at = min(now + self.ttl, deadline)
+        body = json.dumps({"id": int(user_id), "username": username, "exp": expires_at, "max": deadline},
+                          separators=(",", ":")).encode()
+        self.issued += 1
+        return f"{_b64e(body)}.{_b64e(self._mac(body))}", expires_at
+
+    def verify(self, token: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+        ok, claims, reason = self._verify(token)
+        if ok:
+            self.accepted += 1
+        else:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return ok, claims, reason
+
+    def _verify(self, token: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+        if not isinstance(token, str) or token.count(".") != 1:
+            return False, None, "malformed"
+        body_b64, mac_b64 = token.split(".")
+        try:
+            body, mac = _b64d(body_b64), _b64d(mac_b64)
+        except Exception:
+            return False, None, "malformed"
+        if not hmac.compare_digest(self._mac(body), mac):
+            return False, None, "bad_mac"
+        try:
+            claims = json.loads(body)
+        except Exception:
+            return False, None, "malformed"
+        if int(time.time()) > claims.get("exp", 0):
+            return False, None, "expired"
+        return True, claims, "ok_session"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl": self.ttl,
+            "max_age": self.max_age,
+            "issued": self.issued,
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+        }
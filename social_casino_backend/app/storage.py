@@ -0,0 +1,90 @@
+# social_casino_backend/app/storage.py
+#
+# Асинхронный фасад над app.db: все обращения к SQLite выполняются в одном
+# выделенном потоке, в порядке поступления. Event loop (раунд, countdown,
+# сокеты) больше не стоит, пока SQLite ждёт busy_timeout или fsync.
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from app import db
+
+
+class Storage:
+    """
+    Runs app.db functions on a dedicated DB thread and awaits the result.
+    One thread means one connection and strict FIFO order: a read submitted after
+    a write always sees it.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.in_flight -= 1
+            self.calls += 1
+            self.total_latency += elapsed
+            self.max_latency = max(self.max_latency, elapsed)
+
+    async def init_db(self) -> None:
+        await self.run(db.init_db)
+
+    async def get_or_create_user(self, user_id: int, username: str | None = None) -> None:
+        await self.run(db.get_or_create_user, user_id, username)
+
+    async def get_balance(self, user_id: int) -> float:
+        return await self.run(db.get_balance, user_id)
+
+    async def apply_balance_mutation(self, user_id: int, amount: float, kind: str, *, round_id: int | None = None,
+                                     idempotency_key: str | None = None) -> float | None:
+        return await self.run(
+            lambda: db.apply_balance_mutation(user_id, amount, kind, round_id=round_id, idempotency_key=idempotency_key)
+        )
+
+    async def apply_ledger_entries(self, entries: list[tuple[int, str, float, int | None]]) -> list[int]:
+        return await self.run(db.apply_ledger_entries, entries)
+
+    async def record_round(self, row: tuple) -> None:
+        await self.run(db.record_round, row)
+
+    async def reveal_seed(self, hashed_server_seed: str, server_seed: str) -> int:
+        return await self.run(db.reveal_seed, hashed_server_seed, server_seed)
+
+    async def get_round(self, round_id: int) -> dict | None:
+        return await self.run(db.get_round, round_id)
+
+    async def get_rounds(self, before: int | None = None, limit: int = 50) -> list[dict]:
+        return await self.run(db.get_rounds, before, limit)
+
+    async def get_rounds_range(self, from_id: int, to_id: int, limit: int) -> list[dict]:
+        return await self.run(db.get_rounds_range, from_id, to_id, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "queue_depth": self.in_flight,
+            "max_queue_depth": self.max_in_flight,
+            "avg_latency_ms": (self.total_latency / self.calls * 1000) if self.calls else None,
+            "max_latency_ms": self.max_latency * 1000,
+        }
+
+    def close(self) -> None:
+        """Waits for queued calls to finish and stops the DB thread."""
+        self._executor.shutdown(wait=True)
+
+
+storage = Storage()
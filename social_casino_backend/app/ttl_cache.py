@@ -0,0 +1,54 @@
+# social_casino_backend/app/ttl_cache.py
+#
+# Маленький кэш с ограниченным размером и временем жизни записи.
+# Вытесняется самая старая запись; протухшие удаляются при обращении.
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class TTLCache:
+    """Bounded mapping whose entries expire ttl seconds after they were set."""
+
+    def __init__(self, ttl: float, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Stores value; ttl overrides the default lifetime (capped by it) for this entry."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else None,
+        }
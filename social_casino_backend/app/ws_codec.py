@@ -0,0 +1,50 @@
+# social_casino_backend/app/ws_codec.py
+
+import json
+
+# orjson — опционально: если установлен, кодируем им (в разы быстрее stdlib json)
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# msgpack — бинарные фреймы для клиентов, которые попросили enc=msgpack.
+# Без библиотеки все клиенты получают JSON.
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_ENCODER = "orjson" if orjson is not None else "json"
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+
+def encode_json(message: dict) -> str:
+    """
+    Serializes a message into a ready-to-send text frame.
+    Output matches Starlette's send_json (compact separators, no ASCII escaping).
+    """
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_msgpack(message: dict) -> bytes:
+    """Serializes a message into a binary MessagePack frame."""
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def negotiate_encoding(requested: str | None) -> str:
+    """Picks the frame encoding for a client; anything unknown or unavailable falls back to JSON."""
+    if (requested or "").strip().lower() == ENCODING_MSGPACK and msgpack is not None:
+        return ENCODING_MSGPACK
+    return ENCODING_JSON
+
+
+def encode_frame(message: dict, encoding: str) -> str | bytes:
+    """Text frame (str) for JSON clients, binary frame (bytes) for MessagePack clients."""
+    if encoding == ENCODING_MSGPACK:
+        return encode_msgpack(message)
+    return encode_json(message)
@@ -1,71 +1,277 @@
 # social_casino_backend/app/ws_manager.py
 
+import os
 import time
 import asyncio
+from collections import deque
 from fastapi import WebSocket
-from app.game_logic import CrashGame
-from app.db import get_balance, update_balance
+from app.game_logic import CrashGame, RoundState
+from app.ws_codec import encode_frame, ENCODING_JSON
+from app.balance_cache import balance_cache
+from app.db import LEDGER_BET, LEDGER_WIN, LEDGER_REFUND
+from app.bet_intake import bet_intake
+from app.bet_table import Bet, BetTable, BetStatus
+from app.auto_cashout import AutoCashoutScheduler
 from app.clickhouse_logger import log_event, log_spin
+from app.storage import storage
+from app.round_history import round_row
+
+
+# Максимум неотправленных сообщений на одно соединение и таймаут одной отправки.
+# Клиент, который не успевает разгребать очередь, отключается (close 1013) —
+# фронт сам переподключится и получит свежий initial sync.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5.0"))
+
+# Версия протокола игровых фреймов. v2: снапшот при подключении/ресинке,
+# дальше только дельты с порядковым номером seq (см. publish/snapshot).
+PROTOCOL_VERSION = 2
+HISTORY_SIZE = 30
+
+
+class ClientConnection:
+    """
+    Outbound side of a single WebSocket: a bounded queue drained by its own writer task.
+    enqueue() never awaits the socket, so a slow client only delays itself.
+    """
+
+    def __init__(self, manager: "WebSocketManager", user_id: str, websocket: WebSocket, encoding: str = ENCODING_JSON):
+        self.manager = manager
+        self.user_id = user_id
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._writer = asyncio.create_task(self._run())
+
+    def enqueue(self, msg_type: str | None, frame: str | bytes, coalesce: bool = False) -> bool:
+        """
+        Puts an already encoded frame into the outbound queue. With coalesce=True a
+        frame of the same type still waiting at the tail of the queue is replaced
+        instead of queueing a new one (countdown ticks: only the latest value matters).
+        Only the tail is checked so frames never overtake each other.
+        Returns False if the queue overflowed and the client was dropped.
+        """
+        if self._closed:
+            return False
+        if coalesce and self.queue and self.queue[-1][0] == msg_type:
+            self.queue[-1] = (msg_type, frame)
+            return True
+        if len(self.queue) >= WS_SEND_QUEUE_SIZE:
+            print(f"Send queue overflow for {self.user_id} ({len(self.queue)} pending). Dropping slow client.")
+            self.manager.slow_clients_dropped += 1
+            self.manager.disconnect(self.user_id, self.websocket)
+            asyncio.create_task(self._close_socket(code=1013, reason="Too slow"))
+            return False
+        self.queue.append((msg_type, frame))
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, frame = self.queue.popleft()
+                if isinstance(frame, bytes):
+                    await asyncio.wait_for(self.websocket.send_bytes(frame), timeout=WS_SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(frame), timeout=WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Failed to send message to {self.user_id}: {e}. Disconnecting.")
+            self.manager.disconnect(self.user_id, self.websocket)
+            # закрываем и сам сокет: иначе клиент висит на живом соединении без данных и не переподключается
+            await self._close_socket(code=1013, reason="Send failed")
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def close(self):
+        """Stops the writer; unsent messages are discarded."""
+        self._closed = True
+        self.queue.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
 
 
 class WebSocketManager:
     """Manages WebSocket connections, user bets, and broadcasting."""
 
-    def __init__(self, game: CrashGame):
-        self.active_connections: dict[str, WebSocket] = {}
-        self.bets: dict[str, list] = {}
-        self.game = game
+    def __init__(self, round_state: RoundState):
+        self.active_connections: dict[str, ClientConnection] = {}
+        self.bets = BetTable()
+        self.round = round_state
+        self.slow_clients_dropped = 0
+        self.auto_cashouts = AutoCashoutScheduler(on_due=self.settle_auto_cashouts)
+        # номер последнего изменения состояния раунда, которое ушло клиентам
+        self.seq = 0
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        self.active_connections[user_id] = websocket
-        balance = get_balance(int(user_id))
+    async def connect(self, websocket: WebSocket, user_id: str, encoding: str = ENCODING_JSON):
+        previous = self.active_connections.get(user_id)
+        if previous is not None:
+            previous.close()
+        self.active_connections[user_id] = ClientConnection(self, user_id, websocket, encoding)
+        # после переподключения берём баланс из БД: пока юзера не было, его мог менять другой воркер
+        balance_cache.invalidate(int(user_id))
+        balance = await balance_cache.get(int(user_id))
         await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": balance}})
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
+    def disconnect(self, user_id: str, websocket: WebSocket | None = None):
+        conn = self.active_connections.get(user_id)
+        # старый сокет того же юзера (после переподключения) не должен сносить новое соединение
+        if conn is not None and websocket is not None and conn.websocket is not websocket:
+            return
+        if conn is not None:
             del self.active_connections[user_id]
-        if user_id in self.bets:
-            del self.bets[user_id]
+            conn.close()
+        self.bets.remove_user(user_id)
+        balance_cache.invalidate(int(user_id))
         print(f"Cleaned up data for user {user_id}")
 
-    async def send_to_user(self, user_id: str, message: dict):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_json(message)
-            except Exception as e:
-                print(f"Failed to send message to {user_id}: {e}. Disconnecting.")
-                self.disconnect(user_id)
+    async def send_to_user(self, user_id: str, message: dict, coalesce: bool = False):
+        conn = self.active_connections.get(user_id)
+        if conn is not None:
+            conn.enqueue(message.get("type"), encode_frame(message, conn.encoding), coalesce=coalesce)
 
-    async def broadcast(self, message: dict):
-        for user_id, connection in list(self.active_connections.items()):
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Failed to broadcast to {user_id}: {e}. Disconnecting.")
-                self.disconnect(user_id)
+    async def broadcast(self, message: dict, coalesce: bool = False):
+        # кодируем один раз на каждую кодировку и раскладываем один и тот же фрейм
+        # по очередям — сокеты пишут их собственные writer-таски
+        msg_type = message.get("type")
+        frames: dict[str, str | bytes] = {}
+        for conn in list(self.active_connections.values()):
+            frame = frames.get(conn.encoding)
+            if frame is None:
+                frame = frames[conn.encoding] = encode_frame(message, conn.encoding)
+            conn.enqueue(msg_type, frame, coalesce=coalesce)
 
-    def prepare_new_round(self):
-        for user_id, user_bets in self.bets.items():
-            self.bets[user_id] = [
-                self.bets[user_id][0] if user_bets[0] and user_bets[0].get("autoBet") else None,
-                self.bets[user_id][1] if user_bets[1] and user_bets[1].get("autoBet") else None,
-            ]
+    async def publish(self, message: dict, advance: bool = True, coalesce: bool = False):
+        """
+        Broadcasts a game-state delta stamped with the feed sequence number.
+        advance=False is for frames carrying absolute values (countdown ticks): they
+        reuse the current seq, so they can be coalesced without creating a gap.
+        Clients that see seq jump by more than one ask for a resync.
+        """
+        if advance:
+            self.seq += 1
+        message["seq"] = self.seq
+        await self.broadcast(message, coalesce=coalesce)
 
-    async def add_bet(self, user_id: str, panel_id: int, bet_data: dict):
-        # поздно — раунд уже идёт
-        if self.game.start_time is not None:
+    def snapshot(self) -> dict:
+        """Full game state for a fresh (or resyncing) client; deltas continue from its seq."""
+        data = {
+            "phase": "running" if self.round.start_time else "waiting",
+            "countdown": self.round.current_countdown,
+            "startTime": self.round.start_time,
+            "history": [item["multiplier"] for item in self.round.history],
+            "hashed_server_seed": self.round.hashed_server_seed,
+        }
+        return {"type": "snapshot", "v": PROTOCOL_VERSION, "seq": self.seq, "data": data}
+
+    async def apply_round_event(self, event: dict):
+        """
+        Applies one event of the authoritative round loop to this process: updates the
+        round mirror, runs bet phase transitions and publishes client frames.
+        Every process holding sockets receives the same event stream (app.round_bus).
+        """
+        kind = event.get("event")
+        state = self.round
+
+        if kind == "state":
+            # (пере)подписка на шину: берём состояние целиком, клиенты получают свежий снапшот
+            state.history = list(event["history"])
+            state.hashed_server_seed = event["hashed_server_seed"]
+            state.current_countdown = event["countdown"]
+            state.start_time = event["start_time"]
+            state.bets_closed = state.start_time is not None
+            state.crash_point = event["crash_point"]
+            state.round_id = event["round_id"]
+            state.nonce = event["nonce"]
+            self.seq += 1
+            await self.broadcast(self.snapshot())
+
+        elif kind == "prepare":
+            state.start_time = None
+            state.bets_closed = False
+            state.crash_point = None
+            state.round_id = event["round_id"]
+            self.prepare_new_round()
+
+        elif kind == "seed":
+            state.hashed_server_seed = event["hashed_server_seed"]
+            await self.publish({"type": "seed", "data": {"hashed_server_seed": state.hashed_server_seed}})
+
+        elif kind == "countdown":
+            state.current_countdown = event["value"]
+            await self.publish({"type": "waiting", "data": {"countdown": state.current_countdown}}, advance=False, coalesce=True)
+
+        elif kind == "round_start":
+            state.current_countdown = 0
+            # закрываем приём до drain: ставка, пришедшая во время ожидания, не должна
+            # попасть в раунд мимо группового коммита
+            state.bets_closed = True
+            # ставки последней секунды должны успеть закоммититься до старта
+            await bet_intake.drain()
+            await self.activate_auto_bets()
+            state.crash_point = event["crash_point"]
+            state.nonce = event["nonce"]
+            state.start_time = event["start_time"]
+            self.activate_bets()
+            self.auto_cashouts.start(self.bets.with_status(BetStatus.ACTIVE), state.start_time, state.crash_point)
+            await self.publish({"type": "round_start", "data": {"startTime": state.start_time}})
+
+        elif kind == "round_end":
+            round_info = event["round_info"]
+            # несработавшие триггеры (цель == точке краша) досчитает resolve_bets
+            self.auto_cashouts.stop()
+            state.history.insert(0, round_info)
+            del state.history[HISTORY_SIZE:]
+            # клиент сам добавляет crashPoint в голову своей истории
+            await self.publish({"type": "round_end", "data": {"crashPoint": round_info["multiplier"], "roundInfo": round_info}})
+            await self.resolve_bets(round_info["multiplier"])
+            # строку собираем сразу: к prepare следующего раунда ставки уже сбросятся
             try:
-                asyncio.create_task(log_spin(user_id=str(user_id), event_type="bet_fail",
-                                             amount=float(bet_data.get("amount", 0.0)), multiplier=1.0))
+                asyncio.create_task(self.record_round(self.round_row(round_info)))
             except Exception:
                 pass
-            await self.send_to_user(user_id, {"type": "bet_error", "data": {"panelId": panel_id, "message": "Too late to bet."}})
-            return
 
-        if user_id not in self.bets:
-            self.bets[user_id] = [None, None]
+        elif kind == "balance_changed":
+            # баланс изменили в другом месте (оплата) — сбрасываем кэш и шлём свежий
+            user_id = str(event["user_id"])
+            balance_cache.invalidate(int(user_id))
+            if user_id in self.active_connections:
+                balance = await balance_cache.get(int(user_id))
+                await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": balance}})
+
+        elif kind == "user_message":
+            # сообщение юзеру из другого процесса (например, баланс после вебхука оплаты)
+            await self.send_to_user(str(event["user_id"]), event["message"])
+
+    def prepare_new_round(self):
+        self.bets.start_round()
+
+    async def _reject_late_bet(self, user_id: str, panel_id: int, bet_data: dict):
+        try:
+            asyncio.create_task(log_spin(user_id=str(user_id), event_type="bet_fail",
+                                         amount=float(bet_data.get("amount", 0.0)), multiplier=1.0))
+        except Exception:
+            pass
+        await self.send_to_user(user_id, {"type": "bet_error", "data": {"panelId": panel_id, "message": "Too late to bet."}})
+
+    async def add_bet(self, user_id: str, panel_id: int, bet_data: dict):
+        # поздно — раунд уже стартует или идёт
+        if self.round.bets_closed:
+            await self._reject_late_bet(user_id, panel_id, bet_data)
+            return
 
-        if self.bets[user_id][panel_id] is not None:
+        if self.bets.get(user_id, panel_id) is not None:
             try:
                 asyncio.create_task(log_spin(user_id=str(user_id), event_type="bet_fail",
                                              amount=float(bet_data.get("amount", 0.0)), multiplier=1.0))
@@ -75,7 +281,11 @@ class WebSocketManager:
             return
 
         amount_to_bet = float(bet_data["amount"])
-        current_balance = get_balance(int(user_id))
+        current_balance = await balance_cache.get(int(user_id))
+        # пока читали баланс из БД, мог прийти round_start
+        if self.round.bets_closed:
+            await self._reject_late_bet(user_id, panel_id, bet_data)
+            return
 
         # тех.лог
         try:
@@ -106,14 +316,32 @@ class WebSocketManager:
             return
 
         # списание и фиксация ставки
-        new_balance = update_balance(int(user_id), -amount_to_bet, is_delta=True)
-        self.bets[user_id][panel_id] = {
-            "amount": amount_to_bet,
-            "autoCashoutAt": bet_data.get("autoCashoutAt"),
-            "status": "placed",
-            "winAmount": 0.0,
-            "cashedOutAt": None,
-        }
+        # между get() выше и add() нет await — проверка и списание атомарны для event loop
+        round_id = self.round.round_id
+        debit = balance_cache.add(int(user_id), -amount_to_bet, LEDGER_BET, round_id)
+        bet = self.bets.place(user_id, panel_id, amount_to_bet, bet_data.get("autoCashoutAt"))
+
+        # ждём группового коммита: подтверждаем только записанное списание
+        try:
+            await bet_intake.submit()
+        except Exception as e:
+            print(f"Bet commit failed for {user_id}: {e}. Refunding.")
+            if self.bets.get(user_id, panel_id) is bet:
+                self.bets.remove(user_id, panel_id)
+            # списание вернулось в очередь флаша — просто убираем его; уже ушедшее компенсируем возвратом
+            if not balance_cache.cancel(debit):
+                balance_cache.add(int(user_id), amount_to_bet, LEDGER_REFUND, round_id)
+            await self.send_to_user(user_id, {"type": "bet_error", "data": {"panelId": panel_id, "message": "Bet failed, try again."}})
+            await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": await balance_cache.get(int(user_id))}})
+            return
+        if balance_cache.rejected(debit):
+            # деньги успели потратить через другой воркер: в БД списание не прошло, ставки нет
+            if self.bets.get(user_id, panel_id) is bet:
+                self.bets.remove(user_id, panel_id)
+            await self.send_to_user(user_id, {"type": "bet_error", "data": {"panelId": panel_id, "message": "Not enough crystals."}})
+            await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": await balance_cache.get(int(user_id))}})
+            return
+
         # метрика: bet_success
         try:
             asyncio.create_task(log_spin(user_id=str(user_id), event_type="bet_success",
@@ -121,112 +349,142 @@ class WebSocketManager:
         except Exception:
             pass
 
+        new_balance = await balance_cache.get(int(user_id))
         await self.send_to_user(user_id, {"type": "bet_confirm", "data": {"panelId": panel_id}})
         await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": new_balance}})
 
     def activate_bets(self):
-        for user_id, user_bets in self.bets.items():
-            for bet in user_bets:
-                if bet and bet.get("status") == "placed":
-                    bet["status"] = "active"
+        self.bets.transition(BetStatus.PLACED, BetStatus.ACTIVE)
 
     async def cash_out_user(self, user_id: str, panel_id: int):
-        if user_id not in self.bets or self.bets[user_id][panel_id] is None:
+        bet = self.bets.get(user_id, panel_id)
+        if bet is None:
             return
 
-        bet = self.bets[user_id][panel_id]
-        if bet.get("status") == "active" and self.game.start_time is not None:
-            elapsed = time.time() - self.game.start_time
-            current_multiplier = self.game.get_multiplier_from_duration(elapsed)
-            win_amount = bet["amount"] * current_multiplier
-
-            bet["status"] = "cashed_out"
-            bet["winAmount"] = win_amount
-            bet["cashedOutAt"] = current_multiplier
-
-            # метрика: win (ручной кэшаут)
-            try:
-                asyncio.create_task(log_spin(user_id=str(user_id), event_type="win",
-                                             amount=float(win_amount), multiplier=float(current_multiplier)))
-            except Exception:
-                pass
-            # тех.лог
-            try:
-                asyncio.create_task(log_event(event_type="bet_win", user_id=int(user_id), payload={
-                    "bet_amount": bet["amount"],
-                    "win_amount": win_amount,
-                    "multiplier": current_multiplier,
-                    "cashout_type": "manual",
-                }, user_source=None))
-            except Exception:
-                pass
-
-            new_balance = update_balance(int(user_id), win_amount, is_delta=True)
+        if bet.status == BetStatus.ACTIVE and self.round.start_time is not None:
+            elapsed = time.time() - self.round.start_time
+            current_multiplier = CrashGame.get_multiplier_from_duration(elapsed)
+            # краш уже случился, round_end просто ещё не дошёл до этого процесса
+            if self.round.crash_point is not None and current_multiplier >= self.round.crash_point:
+                return
+            win_amount = self._settle_win(bet, current_multiplier, "manual")
+            new_balance = await balance_cache.get(int(user_id))
             await self.send_to_user(user_id, {
                 "type": "bet_result",
                 "data": {"panelId": panel_id, "winAmount": round(win_amount, 2), "cashedOutAt": round(current_multiplier, 2)}
             })
             await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": new_balance}})
 
+    def _settle_win(self, bet: Bet, multiplier: float, cashout_type: str) -> float:
+        """Marks an active bet as cashed out at multiplier, logs it and credits the win."""
+        user_id = bet.user_id
+        win_amount = bet.amount * multiplier
+        self.bets.set_status(bet, BetStatus.CASHED_OUT)
+        bet.win_amount = win_amount
+        bet.cashed_out_at = multiplier
+
+        # метрика: win
+        try:
+            asyncio.create_task(log_spin(user_id=str(user_id), event_type="win",
+                                         amount=float(win_amount), multiplier=float(multiplier)))
+        except Exception:
+            pass
+        # тех.лог
+        try:
+            asyncio.create_task(log_event(event_type="bet_win", user_id=int(user_id), payload={
+                "bet_amount": bet.amount,
+                "win_amount": win_amount,
+                "multiplier": multiplier,
+                "cashout_type": cashout_type,
+            }, user_source=None))
+        except Exception:
+            pass
+
+        balance_cache.add(int(user_id), win_amount, LEDGER_WIN, self.round.round_id)
+        return win_amount
+
+    async def settle_auto_cashouts(self, due: list[Bet]):
+        """
+        Called by the auto-cashout scheduler while the round is still running: each due
+        bet is paid at exactly its target and the player learns about it immediately.
+        """
+        touched: set[str] = set()
+        for bet in due:
+            # ставку могли забрать руками или снять вместе с отключением
+            if bet.status != BetStatus.ACTIVE or self.bets.get(bet.user_id, bet.panel_id) is not bet:
+                continue
+            win_amount = self._settle_win(bet, bet.auto_cashout_at, "auto")
+            touched.add(bet.user_id)
+            await self.send_to_user(bet.user_id, {
+                "type": "bet_result",
+                "data": {"panelId": bet.panel_id, "winAmount": round(win_amount, 2), "cashedOutAt": bet.auto_cashout_at}
+            })
+
+        for user_id in touched:
+            if user_id in self.active_connections:
+                balance = await balance_cache.get(int(user_id))
+                await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": balance}})
+
+    def round_row(self, round_info: dict) -> tuple:
+        """rounds table row for the finished round with this process's bet aggregates."""
+        played = self.bets.with_status(BetStatus.CASHED_OUT) + self.bets.with_status(BetStatus.RESOLVED)
+        won = [bet for bet in played if bet.status == BetStatus.CASHED_OUT]
+        return round_row(round_info, time.time(), len(played), sum(bet.amount for bet in played),
+                         len(won), sum(bet.win_amount for bet in won))
+
+    async def record_round(self, row: tuple):
+        """Persists a finished round: one write per round (app.round_history)."""
+        try:
+            await storage.record_round(row)
+        except Exception as e:
+            print(f"Failed to record round {row[0]}: {e}")
+
     async def resolve_bets(self, crash_point: float):
-        for user_id, user_bets in self.bets.items():
-            for i, bet in enumerate(user_bets):
-                if bet is None or bet.get("status") != "active":
-                    continue
+        """
+        Settles the whole round in memory and pushes fresh balances to everyone who
+        had a bet. Winnings land in the balance cache; its flusher writes them in one
+        transaction.
+        """
+        results: list[tuple[str, dict]] = []
 
-                win_amount = 0.0
-                cashed_at = None
-
-                if bet.get("autoCashoutAt") and bet.get("autoCashoutAt") <= crash_point:
-                    win_amount = bet["amount"] * bet["autoCashoutAt"]
-                    cashed_at = bet["autoCashoutAt"]
-                    bet["status"] = "cashed_out"
-
-                    # метрика: win (авто)
-                    try:
-                        asyncio.create_task(log_spin(user_id=str(user_id), event_type="win",
-                                                     amount=float(win_amount), multiplier=float(cashed_at)))
-                    except Exception:
-                        pass
-                    # тех.лог
-                    try:
-                        asyncio.create_task(log_event(event_type="bet_win", user_id=int(user_id), payload={
-                            "bet_amount": bet["amount"],
-                            "win_amount": win_amount,
-                            "multiplier": cashed_at,
-                            "cashout_type": "auto",
-                        }, user_source=None))
-                    except Exception:
-                        pass
-
-                    update_balance(int(user_id), win_amount, is_delta=True)
-                else:
-                    bet["status"] = "resolved"
-                    # метрика: loss
-                    try:
-                        asyncio.create_task(log_spin(user_id=str(user_id), event_type="loss",
-                                                     amount=float(bet["amount"]), multiplier=0.0))
-                    except Exception:
-                        pass
-                    # тех.лог
-                    try:
-                        asyncio.create_task(log_event(event_type="bet_loss", user_id=int(user_id),
-                                                      payload={"bet_amount": bet["amount"], "crash_point": crash_point},
-                                                      user_source=None))
-                    except Exception:
-                        pass
-
-                await self.send_to_user(user_id, {
-                    "type": "bet_result",
-                    "data": {"panelId": i, "winAmount": round(win_amount, 2), "cashedOutAt": cashed_at}
-                })
-
-        for user_id in list(self.active_connections.keys()):
-            balance = get_balance(int(user_id))
-            await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": balance}})
+        for bet in self.bets.with_status(BetStatus.ACTIVE):
+            user_id = bet.user_id
+            win_amount = 0.0
+            cashed_at = None
+
+            if bet.auto_cashout_at and bet.auto_cashout_at <= crash_point:
+                cashed_at = bet.auto_cashout_at
+                win_amount = self._settle_win(bet, cashed_at, "auto")
+            else:
+                self.bets.set_status(bet, BetStatus.RESOLVED)
+                # метрика: loss
+                try:
+                    asyncio.create_task(log_spin(user_id=str(user_id), event_type="loss",
+                                                 amount=float(bet.amount), multiplier=0.0))
+                except Exception:
+                    pass
+                # тех.лог
+                try:
+                    asyncio.create_task(log_event(event_type="bet_loss", user_id=int(user_id),
+                                                  payload={"bet_amount": bet.amount, "crash_point": crash_point},
+                                                  user_source=None))
+                except Exception:
+                    pass
+
+            results.append((user_id, {
+                "type": "bet_result",
+                "data": {"panelId": bet.panel_id, "winAmount": round(win_amount, 2), "cashedOutAt": cashed_at}
+            }))
+
+        for user_id, message in results:
+            await self.send_to_user(user_id, message)
+
+        # баланс мог измениться только у тех, кто ставил в этом раунде (включая ручные кэшауты)
+        for user_id in self.bets.users():
+            if user_id in self.active_connections:
+                balance = await balance_cache.get(int(user_id))
+                await self.send_to_user(user_id, {"type": "balance_update", "data": {"balance": balance}})
 
     async def activate_auto_bets(self):
-        for user_id, user_bets in self.bets.items():
-            for i, bet in enumerate(user_bets):
-                if bet and bet.get("autoBet"):
-                    bet["status"] = "placed"
+        for bet in self.bets.auto_bets():
+            self.bets.set_status(bet, BetStatus.PLACED)
@@ -0,0 +1,68 @@
+# social_casino_backend/benchmarks/bet_intake_bench.py
+#
+# Всплеск ставок в последнюю секунду countdown:
+#   per_bet — каждая ставка отдельной транзакцией (storage.apply_balance_mutation)
+#   intake  — проверка/списание в кэше + групповой коммит (app.bet_intake)
+# В обоих режимах ставка считается принятой, когда её списание записано в SQLite.
+#
+# Запуск из social_casino_backend/:
+#   python -m benchmarks.bet_intake_bench
+#   python -m benchmarks.bet_intake_bench --bets 20000
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bet_intake_bench.db"))
+
+from app import db  # noqa: E402
+from app.storage import storage  # noqa: E402
+from app.balance_cache import balance_cache  # noqa: E402
+from app.bet_intake import bet_intake  # noqa: E402
+
+
+async def _per_bet(user_id: int) -> None:
+    await storage.apply_balance_mutation(user_id, -1.0, db.LEDGER_BET, round_id=1)
+
+
+async def _intake(user_id: int) -> None:
+    if await balance_cache.get(user_id) >= 1.0:
+        balance_cache.add(user_id, -1.0, db.LEDGER_BET, 1)
+        await bet_intake.submit()
+
+
+async def _burst(fn, users: list[int]) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(fn(user_id) for user_id in users))
+    return time.perf_counter() - started
+
+
+async def _main(bets: int) -> None:
+    users = list(range(1, bets + 1))
+    await storage.init_db()
+    await storage.run(lambda: db.get_db().executemany(
+        "INSERT OR REPLACE INTO users(user_id, balance) VALUES(?, ?)", [(u, 1e9) for u in users]))
+    # прогреваем кэш, как после connect
+    for user_id in users:
+        await balance_cache.get(user_id)
+
+    elapsed = await _burst(_per_bet, users)
+    print(f"per_bet  {bets} bets in {elapsed:7.3f}s -> {bets / elapsed:10.0f} bets/s")
+    elapsed = await _burst(_intake, users)
+    stats = bet_intake.stats()
+    print(f"intake   {bets} bets in {elapsed:7.3f}s -> {bets / elapsed:10.0f} bets/s "
+          f"(batches={stats['batches']} avg_batch={stats['avg_batch']:.0f})")
+    storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bet burst: per-bet transactions vs group commit")
+    parser.add_argument("--bets", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(_main(args.bets))
+
+
+if __name__ == "__main__":
+    main()
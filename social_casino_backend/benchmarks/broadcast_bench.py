@@ -0,0 +1,62 @@
+# social_casino_backend/benchmarks/broadcast_bench.py
+#
+# CPU на один broadcast в зависимости от числа соединений:
+#   per_socket  — как раньше: json.dumps на каждый сокет (send_json)
+#   encode_once — кодируем один раз (app.ws_codec.encode_json) и раздаём готовый фрейм
+#
+# Запуск из social_casino_backend/:
+#   python -m benchmarks.broadcast_bench
+#   python -m benchmarks.broadcast_bench --connections 100 1000 10000 --rounds 20
+
+import argparse
+import json
+import time
+
+from app.ws_codec import encode_json, encode_msgpack, msgpack, JSON_ENCODER
+
+
+def _waiting_message() -> dict:
+    # типичный countdown-тик: 30 записей истории + хэш сида
+    history = [{"multiplier": round(1.0 + i * 0.37, 2)} for i in range(30)]
+    return {"type": "waiting", "data": {"countdown": 7, "history": history, "hashed_server_seed": "ab" * 32}}
+
+
+def _per_socket(message: dict, connections: int) -> None:
+    for _ in range(connections):
+        json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _encode_once(message: dict, connections: int) -> None:
+    frame = encode_json(message)
+    queues = [None] * connections
+    for i in range(connections):
+        queues[i] = frame
+
+
+def _measure(fn, message: dict, connections: int, rounds: int) -> float:
+    start = time.process_time()
+    for _ in range(rounds):
+        fn(message, connections)
+    return (time.process_time() - start) / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CPU per broadcast vs connection count")
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1_000, 10_000, 50_000])
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    message = _waiting_message()
+    print(f"encoder={JSON_ENCODER} json_frame_bytes={len(encode_json(message).encode())}")
+    if msgpack is not None:
+        print(f"msgpack_frame_bytes={len(encode_msgpack(message))}")
+    print(f"{'connections':>12} {'per_socket ms':>14} {'encode_once ms':>15} {'speedup':>8}")
+    for n in args.connections:
+        old = _measure(_per_socket, message, n, args.rounds)
+        new = _measure(_encode_once, message, n, args.rounds)
+        speedup = old / new if new > 0 else float("inf")
+        print(f"{n:>12} {old * 1000:>14.3f} {new * 1000:>15.3f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
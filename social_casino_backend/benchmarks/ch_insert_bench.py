@@ -0,0 +1,82 @@
+# social_casino_backend/benchmarks/ch_insert_bench.py
+#
+# Размер и CPU тела INSERT на 10k строк для spins и game_events:
+#   legacy    — как раньше: одна строка JSONEachRow на запрос, payload закодирован дважды
+#   json      — многострочный JSONEachRow (app.ch_format, фолбэк)
+#   rowbinary — RowBinary по схеме таблицы
+# каждый формат — без сжатия, gzip и (если установлен zstandard) zstd.
+#
+# Запуск из social_casino_backend/:
+#   python -m benchmarks.ch_insert_bench
+#   python -m benchmarks.ch_insert_bench --rows 10000 --repeat 5
+
+import argparse
+import datetime
+import json
+import random
+import time
+
+from app import ch_format
+from app.clickhouse_logger import GAME_EVENTS_COLUMNS, SPINS_COLUMNS
+
+
+def _spins(n: int) -> list[dict]:
+    ts = datetime.datetime.utcnow()
+    return [{
+        "user_id": random.randint(10**8, 10**10),
+        "event_type": random.choice(("bet_success", "win", "loss", "bet_fail")),
+        "amount": round(random.uniform(1, 500), 2),
+        "multiplier": round(random.uniform(1, 20), 2),
+        "timestamp": (ts + datetime.timedelta(seconds=i // 200)).strftime("%Y-%m-%d %H:%M:%S"),
+    } for i in range(n)]
+
+
+def _events(n: int) -> list[dict]:
+    ts = datetime.datetime.utcnow()
+    return [{
+        "ts": (ts + datetime.timedelta(seconds=i // 200)).strftime("%Y-%m-%d %H:%M:%S"),
+        "event_type": random.choice(("bet_placed", "bet_win", "bet_loss")),
+        "user_id": random.randint(10**8, 10**10),
+        "user_source": "",
+        "payload": {"bet_amount": round(random.uniform(1, 500), 2), "auto_cashout_at": 2.0, "panel_id": i % 2},
+    } for i in range(n)]
+
+
+def _legacy(rows: list[dict], double_payload: bool) -> bytes:
+    out = []
+    for row in rows:
+        if double_payload:
+            row = {**row, "payload": json.dumps(row["payload"], ensure_ascii=False)}
+        out.append((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+    return b"".join(out)
+
+
+def _measure(fn, repeat: int) -> tuple[int, float]:
+    size = 0
+    started = time.process_time()
+    for _ in range(repeat):
+        size = len(fn())
+    return size, (time.process_time() - started) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ClickHouse insert body size and CPU per batch")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    methods = ["none", "gzip"] + (["zstd"] if ch_format.zstandard is not None else [])
+    for table, rows, columns in (("spins", _spins(args.rows), SPINS_COLUMNS),
+                                 ("game_events", _events(args.rows), GAME_EVENTS_COLUMNS)):
+        print(f"{table}: {args.rows} rows")
+        size, cpu = _measure(lambda: _legacy(rows, table == "game_events"), args.repeat)
+        print(f"  {'legacy':>9} {'none':>5} {size:>10} B  {cpu * 1000:8.1f} ms CPU  ({args.rows} requests)")
+        for fmt, encode in (("json", lambda: ch_format.encode_json_each_row(rows)),
+                            ("rowbinary", lambda: ch_format.encode_row_binary(columns, rows))):
+            for method in methods:
+                size, cpu = _measure(lambda: ch_format.compress(encode(), method)[0], args.repeat)
+                print(f"  {fmt:>9} {method:>5} {size:>10} B  {cpu * 1000:8.1f} ms CPU")
+
+
+if __name__ == "__main__":
+    main()
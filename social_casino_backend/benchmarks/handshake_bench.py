@@ -0,0 +1,106 @@
+# social_casino_backend/benchmarks/handshake_bench.py
+#
+# Проверок initData в секунду (только валидация, без сокета):
+#   legacy — прежний алгоритм: секрет HMAC и VerifyKey на каждый вызов, три разбора строки
+#   cold   — app.init_data, каждый initData уникален (кэш не помогает)
+#   warm   — app.init_data, шторм переподключений: те же initData повторно
+#   session — реконнект с токеном сессии (app.session_tokens) вместо initData
+# Отдельно для HMAC по токену бота и для Ed25519-подписи (нужен PyNaCl).
+#
+# Запуск из social_casino_backend/:
+#   python -m benchmarks.handshake_bench
+#   python -m benchmarks.handshake_bench --n 20000
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from app.init_data import InitDataValidator, VerifyKey
+from app.session_tokens import SessionTokens
+
+BOT_TOKEN = "123456:bench-token"
+BOT_ID = 123456
+
+
+def _make_init_data(i: int, signing_key=None) -> str:
+    pairs = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"AAH{i:010d}",
+        "user": json.dumps({"id": 10**8 + i, "first_name": "Bench", "username": f"user{i}", "language_code": "en"}),
+    }
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
+    if signing_key is not None:
+        sig = signing_key.sign(f"{BOT_ID}:WebAppData\n{check_string}".encode()).signature
+        pairs["signature"] = base64.urlsafe_b64encode(sig).decode().rstrip("=")
+        pairs["hash"] = "0" * 64
+    else:
+        secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+        pairs["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(pairs)
+
+
+def _legacy_validate(init_data: str, public_key_hex: str) -> bool:
+    # прежний путь из main.py: всё считается на каждый вызов
+    all_pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+    pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+    pairs.pop("hash", None)
+    pairs.pop("signature", None)
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    if hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest() == all_pairs.get("hash"):
+        json.loads(pairs["user"])
+        return True
+    all_pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+    pairs = dict(parse_qsl(init_data, keep_blank_values=True))
+    pairs.pop("hash", None)
+    pairs.pop("signature", None)
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(pairs.items()))
+    from nacl.signing import VerifyKey as _VerifyKey
+    sig = all_pairs["signature"]
+    sig = base64.urlsafe_b64decode(sig + "=" * (-len(sig) % 4))
+    _VerifyKey(bytes.fromhex(public_key_hex)).verify(f"{BOT_ID}:WebAppData\n{check_string}".encode(), sig)
+    json.loads(pairs["user"])
+    return True
+
+
+def _rate(fn, items: list[str]) -> float:
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="initData validations per second")
+    parser.add_argument("--n", type=int, default=10000)
+    args = parser.parse_args()
+
+    modes = [("hmac", None, "00" * 32)]
+    if VerifyKey is not None:
+        from nacl.signing import SigningKey
+        signing_key = SigningKey.generate()
+        modes.append(("ed25519", signing_key, signing_key.verify_key.encode().hex()))
+    else:
+        print("PyNaCl not installed: skipping the signature path")
+
+    for name, signing_key, public_key_hex in modes:
+        items = [_make_init_data(i, signing_key) for i in range(args.n)]
+        validator = InitDataValidator(BOT_TOKEN, BOT_ID, public_key_hex)
+        assert validator.validate(items[0])[0]
+        legacy = _rate(lambda s: _legacy_validate(s, public_key_hex), items)
+        validator = InitDataValidator(BOT_TOKEN, BOT_ID, public_key_hex)
+        cold = _rate(validator.validate, items)
+        warm = _rate(validator.validate, items)
+        print(f"{name:>8}: legacy {legacy:10.0f}/s   cold {cold:10.0f}/s   warm (cached) {warm:10.0f}/s")
+
+    sessions = SessionTokens(BOT_TOKEN)
+    tokens = [sessions.issue(10**8 + i, f"user{i}")[0] for i in range(args.n)]
+    print(f"{'session':>8}: {_rate(sessions.verify, tokens):10.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
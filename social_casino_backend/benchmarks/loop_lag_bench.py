@@ -0,0 +1,111 @@
+# social_casino_backend/benchmarks/loop_lag_bench.py
+#
+# Задержка event loop под синтетической нагрузкой ставок:
+#   sync  — как раньше: функции app.db вызываются прямо из корутин
+#   async — через app.storage (выделенный поток БД)
+# Параллельно отдельный поток периодически держит write-lock SQLite
+# (как флаш другого воркера), чтобы было видно ожидание busy_timeout.
+#
+# Запуск из social_casino_backend/:
+#   python -m benchmarks.loop_lag_bench
+#   python -m benchmarks.loop_lag_bench --bettors 200 --seconds 5 --lock-ms 50
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "loop_lag_bench.db"))
+
+from app import db  # noqa: E402
+from app.storage import Storage  # noqa: E402
+
+TICK = 0.01
+
+
+async def _measure_lag(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def _bettor_sync(user_id: int, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        db.apply_balance_mutation(user_id, -1.0, db.LEDGER_BET)
+        db.get_balance(user_id)
+        await asyncio.sleep(0.005)
+
+
+async def _bettor_async(storage: Storage, user_id: int, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        await storage.apply_balance_mutation(user_id, -1.0, db.LEDGER_BET)
+        await storage.get_balance(user_id)
+        await asyncio.sleep(0.005)
+
+
+def _lock_holder(stop: threading.Event, lock_ms: float) -> None:
+    # отдельное соединение = "другой процесс", держит RESERVED-лок lock_ms раз в 200 мс
+    conn = sqlite3.connect(os.environ["SQLITE_PATH"], isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout=5000;")
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(lock_ms / 1000)
+        conn.execute("COMMIT")
+        time.sleep(0.2)
+    conn.close()
+
+
+async def _run(mode: str, bettors: int, seconds: float) -> list[float]:
+    stop = asyncio.Event()
+    lags: list[float] = []
+    storage = Storage() if mode == "async" else None
+    tasks = [asyncio.create_task(_measure_lag(stop, lags))]
+    for user_id in range(1, bettors + 1):
+        if storage is not None:
+            tasks.append(asyncio.create_task(_bettor_async(storage, user_id, stop)))
+        else:
+            tasks.append(asyncio.create_task(_bettor_sync(user_id, stop)))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    if storage is not None:
+        storage.close()
+    return lags
+
+
+def _report(mode: str, lags: list[float]) -> None:
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1] if lags_ms else 0.0
+    print(f"{mode:>6} ticks={len(lags_ms):>5} p50={statistics.median(lags_ms):8.2f}ms "
+          f"p99={p99:8.2f}ms max={lags_ms[-1]:8.2f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event loop lag: sync SQLite vs storage thread")
+    parser.add_argument("--bettors", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--lock-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    db.init_db()
+    db.get_db().executemany("INSERT OR REPLACE INTO users(user_id, balance) VALUES(?, ?)",
+                            [(user_id, 1e12) for user_id in range(1, args.bettors + 1)])
+
+    print(f"db={os.environ['SQLITE_PATH']} bettors={args.bettors} lock={args.lock_ms}ms/200ms tick={TICK * 1000:.0f}ms")
+    for mode in ("sync", "async"):
+        stop_locker = threading.Event()
+        locker = threading.Thread(target=_lock_holder, args=(stop_locker, args.lock_ms), daemon=True)
+        locker.start()
+        lags = asyncio.run(_run(mode, args.bettors, args.seconds))
+        stop_locker.set()
+        locker.join()
+        _report(mode, lags)
+
+
+if __name__ == "__main__":
+    main()
@@ -80,6 +80,82 @@ function createNoise2D(random = Math.random) {
     };
 }
 
+/*
+Minimal MessagePack decoder for server frames (nil/bool/int/float/str/bin/array/map).
+Server -> client frames are binary when the socket negotiated enc=msgpack.
+*/
+function decodeMsgpack(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const textDecoder = new TextDecoder();
+    let pos = 0;
+
+    const str = (len) => {
+        const s = textDecoder.decode(bytes.subarray(pos, pos + len));
+        pos += len;
+        return s;
+    };
+    const bin = (len) => {
+        const b = bytes.slice(pos, pos + len);
+        pos += len;
+        return b;
+    };
+    const array = (len) => {
+        const out = new Array(len);
+        for (let i = 0; i < len; i++) out[i] = read();
+        return out;
+    };
+    const map = (len) => {
+        const out = {};
+        for (let i = 0; i < len; i++) {
+            const key = read();
+            out[key] = read();
+        }
+        return out;
+    };
+    const u8 = () => view.getUint8(pos++);
+    const u16 = () => { const v = view.getUint16(pos); pos += 2; return v; };
+    const u32 = () => { const v = view.getUint32(pos); pos += 4; return v; };
+
+    function read() {
+        const b = u8();
+        if (b <= 0x7f) return b;
+        if (b >= 0xe0) return b - 0x100;
+        if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+        if ((b & 0xf0) === 0x90) return array(b & 0x0f);
+        if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+        let v;
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(u8());
+            case 0xc5: return bin(u16());
+            case 0xc6: return bin(u32());
+            case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+            case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+            case 0xcc: return u8();
+            case 0xcd: return u16();
+            case 0xce: return u32();
+            case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+            case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+            case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+            case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+            case 0xd9: return str(u8());
+            case 0xda: return str(u16());
+            case 0xdb: return str(u32());
+            case 0xdc: return array(u16());
+            case 0xdd: return array(u32());
+            case 0xde: return map(u16());
+            case 0xdf: return map(u32());
+        }
+        throw new Error(`msgpack: unsupported type 0x${b.toString(16)}`);
+    }
+
+    return read();
+}
+
 document.addEventListener("DOMContentLoaded", () => {
     const tg = window.Telegram && window.Telegram.WebApp ? window.Telegram.WebApp : null;
 
@@ -96,6 +172,8 @@ document.addEventListener("DOMContentLoaded", () => {
     const WS_SCHEME = location.protocol === "https:" ? "wss" : "ws";
     const WEBSOCKET_URL = `${WS_SCHEME}://${location.host}`;
     const WS_PATH = "/ws";
+    // Бинарные фреймы (MessagePack). Если сервер не умеет — шлёт JSON текстом.
+    const WS_ENCODING = "msgpack";
 
     // HTTP API (инвойсы Stars)
     const API_BASE = "";
@@ -126,12 +204,21 @@ document.addEventListener("DOMContentLoaded", () => {
 
     // ======= STATE =======
     let ws;
+    // токен сессии от сервера: на реконнекте заменяет полную проверку initData
+    let sessionToken = null;
     let balance = 0.0;
     let gameState = "connecting";
     let roundStartTime = 0;
     let animationTimestamp = 0;
     let isRoundActive = false;
 
+    // Протокол v2: снапшот при подключении, дальше дельты с seq.
+    // lastSeq === null — ждём снапшот, дельты до него игнорируются.
+    const PROTOCOL_VERSION = 2;
+    const HISTORY_SIZE = 30;
+    let lastSeq = null;
+    let history = [];
+
     const panelStates = [
         {
             status: "idle",
@@ -335,7 +422,7 @@ document.addEventListener("DOMContentLoaded", () => {
             panelStates.forEach((state, id) => {
                 if (state.status === "active") {
                     betPanels[id].querySelector(".button-value").textContent = `💎 ${(state.amount * multiplier).toFixed(2)}`;
-                    if (state.autoCashoutToggle && multiplier >= state.autoCashoutValue) cashOut(id);
+                    // автокэшаут срабатывает на сервере ровно на autoCashoutAt, результат придёт bet_result
                 }
             });
         }
@@ -406,7 +493,8 @@ document.addEventListener("DOMContentLoaded", () => {
             return;
         }
 
-        ws = new WebSocket(WEBSOCKET_URL + WS_PATH);
+        ws = new WebSocket(`${WEBSOCKET_URL}${WS_PATH}?enc=${WS_ENCODING}`);
+        ws.binaryType = "arraybuffer";
 
         ws.onopen = () => {
             console.log("WebSocket connected!");
@@ -415,14 +503,17 @@ document.addEventListener("DOMContentLoaded", () => {
                 JSON.stringify({
                     action: "handshake",
                     init_data: tg.initData,
+                    // при реконнекте сервер проверяет только токен сессии
+                    session_token: sessionToken,
+                    encoding: WS_ENCODING,
                 })
             );
         };
 
         ws.onmessage = (event) => {
             try {
-                const msg = JSON.parse(event.data);
-                handleWebSocketMessage(msg);
+                const msg = typeof event.data === "string" ? JSON.parse(event.data) : decodeMsgpack(event.data);
+                if (acceptSequenced(msg)) handleWebSocketMessage(msg);
             } catch (e) {
                 console.error("WS parse error:", e);
             }
@@ -430,12 +521,16 @@ document.addEventListener("DOMContentLoaded", () => {
 
         ws.onclose = (event) => {
             gameState = "connecting";
+            lastSeq = null;
             isRoundActive = false;
             if (event.code === 1008) {
                 statusTextEl.textContent = "Auth Failed!";
             } else {
                 statusTextEl.textContent = "Reconnecting...";
-                setTimeout(connectWebSocket, 3000);
+                // разброс, чтобы после рестарта сервера клиенты не ломились разом;
+                // 1013 — очередь рукопожатий переполнена, ждём дольше
+                const base = event.code === 1013 ? 8000 : 3000;
+                setTimeout(connectWebSocket, base + Math.random() * base);
             }
             statusTextEl.className = "status-text-overlay";
             multiplierDisplayEl.classList.remove("visible");
@@ -449,8 +544,44 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
-    function handleWebSocketMessage({ type, data }) {
+    // Проверка порядка игровых дельт. waiting-тики несут абсолютный countdown
+    // и текущий seq (не продвигают его), остальные дельты — seq + 1.
+    function acceptSequenced(msg) {
+        if (msg.type === "snapshot") return true;
+        if (msg.seq === undefined) return true; // личные сообщения (баланс, ставки)
+        if (lastSeq === null) return false;
+        if (msg.seq <= lastSeq) return msg.seq === lastSeq && msg.type === "waiting";
+        if (msg.seq === lastSeq + 1) {
+            lastSeq = msg.seq;
+            return true;
+        }
+        // пропустили дельту — просим полный снапшот
+        console.warn(`WS seq gap: ${lastSeq} -> ${msg.seq}, resyncing`);
+        lastSeq = null;
+        sendToServer({ type: "resync" });
+        return false;
+    }
+
+    function handleWebSocketMessage({ type, data, seq, v }) {
         switch (type) {
+            case "snapshot":
+                if (v !== PROTOCOL_VERSION) console.warn(`WS protocol v${v}, expected v${PROTOCOL_VERSION}`);
+                lastSeq = seq;
+                history = data.history;
+                if (data.phase === "running") {
+                    handleWebSocketMessage({ type: "round_start", data: { startTime: data.startTime, is_initial_sync: true } });
+                } else {
+                    handleWebSocketMessage({ type: "waiting", data: { countdown: data.countdown, is_initial_sync: true } });
+                }
+                break;
+
+            case "seed":
+                break;
+
+            case "session":
+                sessionToken = data.token;
+                break;
+
             case "balance_update":
                 updateBalance(data.balance);
                 break;
@@ -463,7 +594,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 statusTextEl.className = "status-text-overlay waiting";
                 statusTextEl.textContent = `Starts in ${data.countdown}s`;
                 multiplierDisplayEl.classList.remove("visible");
-                updateHistory(data.history);
+                updateHistory();
 
                 if (!data.is_initial_sync) {
                     panelStates.forEach((state, id) => {
@@ -485,7 +616,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 roundStartTime = data.startTime * 1000;
                 statusTextEl.className = "status-text-overlay running";
                 multiplierDisplayEl.classList.add("visible");
-                if (data.is_initial_sync) updateHistory(data.history);
+                if (data.is_initial_sync) updateHistory();
 
                 graphState.points = [{ time: 0, multiplier: 1 }];
 
@@ -503,7 +634,9 @@ document.addEventListener("DOMContentLoaded", () => {
                 statusTextEl.className = "status-text-overlay crashed";
                 statusTextEl.textContent = `Crashed @ ${data.crashPoint.toFixed(2)}x`;
                 multiplierDisplayEl.classList.remove("visible");
-                updateHistory(data.history);
+                history.unshift(data.crashPoint);
+                if (history.length > HISTORY_SIZE) history.length = HISTORY_SIZE;
+                updateHistory();
 
                 const duration = getDurationFromMultiplier(data.crashPoint);
                 graphState.points = [];
@@ -546,9 +679,9 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
-    function updateHistory(history) {
+    function updateHistory() {
         historyBarEl.innerHTML = history
-            .map(({ multiplier }) => {
+            .map((multiplier) => {
                 let cn = "low";
                 if (multiplier >= 100) cn = "epic";
                 else if (multiplier >= 10) cn = "high";